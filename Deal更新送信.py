@@ -1,231 +1,139 @@
 # coding: utf-8
 
-import pandas as pd
-import requests
-import json
 import os
-from datetime import datetime, timedelta, timezone
 import traceback
 
+from batch_recovery import BatchRecovery, DeadLetter
+from csv_io import read_csv
+from date_convert import print_invalid_summary
+from hubspot_client import HubSpotClient
+from hubspot_lookup import find_line_items_by_deals, read_by_property, search_line_items_by_slip
+from id_registry import IdRegistry
+from lineitem_reconcile import reconcile_line_items
+from metrics import METRICS
+from schemas import DEAL_SCHEMA, LINE_ITEM_SCHEMA
+from snapshot_store import SnapshotStore, SNAPSHOT_DB, slip_hashes
+from transform_engine import changed_properties
+
 # 定数
 BATCH_SIZE = 100  # 一度に送信するバッチのサイズ
-JST = timezone(timedelta(hours=+9))  # 日本標準時 (JST)
-UTC = timezone.utc  # UTCタイムゾーン
 API_KEY = 'xxxxxxxxxxxxxxxxxxxxxxxxx0'  # ここに実際のAPIキーを入力してください
-
-# CSVファイルを読み込む関数
-def read_csv(file_path):
-    print(f"Reading CSV file from: {file_path}")
-    encodings = ['utf-8', 'shift_jis', 'cp932', 'utf-16']
-    for enc in encodings:
-        try:
-            print(f"Trying encoding: {enc}")
-            df = pd.read_csv(file_path, dtype=str, encoding=enc)  # 異なるエンコーディングを試す
-            df = df.fillna('')  # 欠損値を空文字に置き換える
-            return df
-        except UnicodeDecodeError:
-            print(f"Failed with encoding: {enc}")
-        except FileNotFoundError:
-            print(f"File not found: {file_path}")
-            raise
-        except Exception as e:
-            print(f"An error occurred while reading the file with encoding {enc}: {e}")
-            print(traceback.format_exc())
-            raise
-    raise ValueError("Unable to read the file with any of the given encodings.")
-
-# 日付をUTCの深夜0時のタイムスタンプに変換する関数
-def convert_to_utc_midnight_timestamp(date_str):
-    try:
-        dt = datetime.strptime(date_str, "%Y/%m/%d").replace(tzinfo=UTC)
-        dt_midnight_utc = dt.replace(hour=0, minute=0, second=0, microsecond=0)
-        timestamp = int(dt_midnight_utc.timestamp() * 1000)  # ミリ秒に変換
-        return timestamp
-    except ValueError:
-        print(f"Skipping invalid date: {date_str}")
-        return ''  # 日付形式でない場合は空文字を返す
-
-# 日時をUTCのタイムスタンプに変換する関数
-def convert_to_utc_timestamp(datetime_str):
-    try:
-        dt = datetime.strptime(datetime_str, "%Y/%m/%d %H:%M:%S").replace(tzinfo=JST)
-        dt_utc = dt.astimezone(UTC)
-        timestamp = int(dt_utc.timestamp() * 1000)  # ミリ秒に変換
-        return timestamp
-    except ValueError:
-        print(f"Skipping invalid datetime: {datetime_str}")
-        return ''  # 日付形式でない場合は空文字を返す
-
-# Line Itemsを検索する関数
-def search_line_items(invoice_numbers):
-    url = 'https://api.hubapi.com/crm/v3/objects/line_items/search'
-    headers = {
-        'Authorization': f'Bearer {API_KEY}',
-        'Content-Type': 'application/json'
-    }
-    all_line_item_ids = []
-    after = ""
-
-    while True:
-        data = {
-            "limit": 100,
-            "after": after,
-            "filterGroups": [
-                {
-                    "filters": [
-                        {
-                            "propertyName": "bugyo_denpyo_no",  # 修正：プロパティ名を元に戻す
-                            "values": invoice_numbers,
-                            "operator": "IN"
-                        }
-                    ]
-                }
-            ]
-        }
-        print(f"Request data: {json.dumps(data, indent=2)}")  # デバッグ用にリクエストデータを出力
-        response = requests.post(url, headers=headers, data=json.dumps(data))
-        
-        if response.status_code != 200:
-            print(f"Failed to search line items. Status code: {response.status_code}, Response: {response.text}")
-            return all_line_item_ids
-        
-        result = response.json()
-        print(f"Search result: {result}")  # デバッグ用にレスポンスを出力
-
-        if 'results' not in result:
-            print(f"Unexpected response format: {result}")
-            break
-
-        for item in result['results']:
-            all_line_item_ids.append(item['id'])
-
-        if 'paging' in result and 'next' in result['paging']:
-            after = result['paging']['next']['after']
-        else:
-            break
-
-    return all_line_item_ids
-
-# Line Itemsを削除（アーカイブ）する関数
-def delete_line_items(line_item_ids):
-    url = 'https://api.hubapi.com/crm/v3/objects/line_items/batch/archive'
-    headers = {
-        'Authorization': f'Bearer {API_KEY}',
-        'Content-Type': 'application/json'
-    }
-    data = {"inputs": [{"id": line_item_id} for line_item_id in line_item_ids]}
-    print(f"Deleting line items with IDs: {line_item_ids}")  # デバッグ用に削除するIDを出力
-    response = requests.post(url, headers=headers, data=json.dumps(data))
-    print(f"Delete response: {response.status_code}, {response.text}")  # デバッグ用にレスポンスを出力
-    return response.status_code
-
-# データを変換する関数
-def transform_data(df):
-    properties_mapping = {
-        "取引ステージ": "dealstage",
-        "パイプライン": "pipeline",
-        "合計売上": "amount",
-        "クローズ日": "closedate",
-        "取引名": "dealname",
-        "部門コード": "bugyo_bumon_code",
-        "直送先役職": "bugyo_chokusosaki_yakushoku",
-        "直送先コード": "bugyo_chokusou_saki_code",
-        "直送先電話番号": "bugyo_chokusou_saki_denwa_bangou",
-        "直送先FAX番号": "bugyo_chokusou_saki_fax_bangou",
-        "直送先住所1": "bugyo_chokusou_saki_juusho1",
-        "直送先住所2": "bugyo_chokusou_saki_juusho2",
-        "直送先敬称": "bugyo_chokusou_saki_keishou",
-        "直送先名1": "bugyo_chokusou_saki_mei1",
-        "直送先名2": "bugyo_chokusou_saki_mei2",
-        "直送先担当者": "bugyo_chokusou_saki_tantousha",
-        "直送先郵便番号": "bugyo_chokusou_saki_yuubin_bangou",
-        "伝票フラグコード": "bugyo_denpyou_flag_code",
-        "受注ID": "bugyo_juchuu_id",
-        "受注明細ID": "bugyo_juchuu_meisai_id",
-        "回収期日": "bugyo_kaishuu_kijitsu",
-        "入金摘要": "bugyo_nyuukin_tekiyou",
-        "プロジェクトコード": "bugyo_project_code",
-        "請求先コード": "bugyo_seikyuu_saki_code",
-        "信販会社コード": "bugyo_shinpan_kaisha_code",
-        "信販手数料": "bugyo_shinpan_tesuuryou",
-        "修正日付": "bugyo_shuusei_hizuke",
-        "修正者名": "bugyo_shuuseisha_mei",
-        "担当者コード": "bugyo_tantousha_code",
-        "摘要": "bugyo_tekiyou",
-        "摘要2": "bugyo_tekiyou2",
-        "摘要3": "bugyo_tekiyou3",
-        "得意先コード": "bugyo_tokuisaki_code",
-        "得意先名1": "bugyo_tokuisaki_mei1",
-        "得意先名2": "bugyo_tokuisaki_mei2",
-        "得意先担当者": "bugyo_tokuisaki_tantousha",
-        "登録日付": "bugyo_touroku_hizuke",
-        "登録者名": "bugyo_tourokusha_mei",
-        "売上日付": "bugyo_uriage_hiduke",
-        "税額通知コード": "bugyo_zeigaku_tsuuchi_code",
-        "伝票No.": "no_____",
-        "sha512": "sha512",
-        "sha512_contents": "sha512_contents"
-    }
-
-    # ステージ名とパイプライン名を対応するIDに変換するマッピング
-    stage_mapping = {
-        "FAX受注 (実績)": "149884283"
-    }
-    pipeline_mapping = {
-        "実績": "79111068"
-    }
-
-    deals = []
-    invoice_numbers = df["伝票No."].tolist()
-    line_item_ids = search_line_items(invoice_numbers)
-
+LINE_ITEM_DISCOVERY = 'associations'  # 既存の商品項目の探し方: 'associations'（取引IDから関連付けを読む）または 'search'（伝票No.で検索する）
+READ_MISSING_VALUES = True  # ローカルに前回の値がない取引は、HubSpotから現在の値を読んで差分を取る
+LINE_ITEM_CSV = '更新あったものだけ5.csv'  # 更新する伝票の明細（ある場合は既存の商品項目と突き合わせて差分だけを反映する）
+
+# 既存のLine Itemsを探す関数（伝票No.ごとに分割して同時に取得する）
+# failed にセットを指定した場合は、既存の商品項目を読み込めなかった伝票No.を追加し、その伝票の商品項目は返さない
+def find_line_items(client, registry, invoice_numbers, failed=None):
+    unreadable = set()
+    if LINE_ITEM_DISCOVERY == 'search':
+        line_items = search_line_items_by_slip(client, invoice_numbers, failed=unreadable)
+    else:
+        line_items = find_line_items_by_deals(client, registry, invoice_numbers, unreadable)
+    if failed is not None:
+        failed.update(unreadable)
+    line_item_ids = [item['id'] for slip, items in line_items.items() if slip not in unreadable for item in items]
+    print(f"Found {len(line_item_ids)} line items on {len(line_items)} deals.")
+    return line_item_ids
+
+# Line Itemsを削除（アーカイブ）する関数（BATCH_SIZE件ずつ同時に送信する）
+def delete_line_items(client, line_item_ids):
+    inputs = [{"id": line_item_id} for line_item_id in line_item_ids]
+    batches = (inputs[i:i+BATCH_SIZE] for i in range(0, len(inputs), BATCH_SIZE))
+    failed = 0
+    for batch_number, (batch, response) in enumerate(client.send_batches('/crm/v3/objects/line_items/batch/archive', batches), start=1):
+        if response:  # 成功時は204で本文がない
+            print(f"Delete batch {batch_number} failed: {response}")
+            failed += len(batch)
+    print(f"Deleted {len(inputs) - failed} of {len(inputs)} line items.")
+    return failed == 0
+
+# 更新する伝票の商品項目をすべてアーカイブし、アーカイブできなかった伝票No.を返す関数（差分の明細ファイルがない場合に使う）
+def replace_line_items(client, registry, df):
+    failed_slips = set()
+    line_item_ids = find_line_items(client, registry, df["伝票No."].tolist(), failed_slips)
+    if failed_slips:
+        # 既存の商品項目が分からない伝票は、一部だけをアーカイブしないよう書き込まない
+        print(f"Could not read existing line items for {len(failed_slips)} slips. Skipping: {sorted(failed_slips)}")
     if line_item_ids:
-        delete_status = delete_line_items(line_item_ids)
-        if delete_status == 204:
-            print("Line items deleted successfully.")
-        else:
-            print(f"Failed to delete line items. Status code: {delete_status}")
-
-    for _, row in df.iterrows():
-        properties = {}
-        for csv_name, internal_name in properties_mapping.items():
-            if internal_name == "dealstage":
-                properties[internal_name] = stage_mapping.get(row[csv_name], row[csv_name])
-            elif internal_name == "pipeline":
-                properties[internal_name] = pipeline_mapping.get(row[csv_name], row[csv_name])
-            elif internal_name in ["closedate", "bugyo_uriage_hiduke"]:
-                timestamp = convert_to_utc_midnight_timestamp(row[csv_name])
-                properties[internal_name] = timestamp
-            elif internal_name in ["bugyo_touroku_hizuke", "bugyo_shuusei_hizuke"]:
-                timestamp = convert_to_utc_timestamp(row[csv_name])
-                properties[internal_name] = timestamp
-            else:
-                properties[internal_name] = row[csv_name]
-        deals.append({"idProperty": "no_____", "id": row["伝票No."], "properties": properties})
-    return deals
-
-# バッチを送信する関数
-def send_batch(deals_batch):
-    url = 'https://api.hubapi.com/crm/v3/objects/deals/batch/update'
-    headers = {
-        'Authorization': f'Bearer {API_KEY}',
-        'Content-Type': 'application/json'
-    }
-    data = {"inputs": deals_batch}
-    response = requests.post(url, headers=headers, data=json.dumps(data))
-    return response.json()
+        delete_line_items(client, line_item_ids)
+    return failed_slips
+
+# データを変換する関数（対応表は schemas.DEAL_SCHEMA で設定する）
+def transform_data(df, invalid_report=None):
+    properties = DEAL_SCHEMA.build_properties(df, invalid_report)
+    return [
+        {"idProperty": "no_____", "id": invoice_number, "properties": deal_properties}
+        for invoice_number, deal_properties in zip(df["伝票No."].tolist(), properties)
+    ]
+
+# 前回同期した値と比べ、変わったプロパティだけの更新にする関数（全プロパティの値の辞書も返す）
+def sparse_deals(client, store, all_deals):
+    keys = [deal["id"] for deal in all_deals]
+    previous = store.get_properties('deals', keys)
+    missing = [key for key in keys if key not in previous]
+    if missing and READ_MISSING_VALUES:
+        for item in read_by_property(client, 'deals', 'no_____', missing, DEAL_SCHEMA.target_properties):
+            previous[item['properties']['no_____']] = item['properties']
+
+    updates = []
+    synced = {}  # 更新が成功した場合に記録する、取引ごとの全プロパティの値
+    for deal in all_deals:
+        old = previous.get(deal["id"])
+        properties = deal["properties"] if old is None else changed_properties(deal["properties"], old)
+        synced[deal["id"]] = deal["properties"]
+        if properties:
+            updates.append({**deal, "properties": properties})
+    print(f"Sparse update: {sum(len(deal['properties']) for deal in updates)} of "
+          f"{sum(len(deal['properties']) for deal in all_deals)} properties, {len(all_deals) - len(updates)} deals unchanged")
+    return updates, synced
+
+# バッチを同時送信する関数（送信順に (バッチ, 応答) を返す。recovery を指定した場合は失敗した入力だけを再送する）
+def send_batches(client, all_deals, recovery=None):
+    batches = (all_deals[i:i+BATCH_SIZE] for i in range(0, len(all_deals), BATCH_SIZE))
+    return client.send_batches('/crm/v3/objects/deals/batch/update', batches, send=recovery.send if recovery else None)
 
 # メイン関数
 def main(file_path):
     try:
-        df = read_csv(file_path)
-        all_deals = transform_data(df)
-
-        # バッチ処理
-        for i in range(0, len(all_deals), BATCH_SIZE):
-            batch = all_deals[i:i+BATCH_SIZE]
-            response = send_batch(batch)
-            print(f"Batch {i//BATCH_SIZE + 1} response: ", response)
+        db_path = os.path.join(os.path.dirname(file_path), SNAPSHOT_DB)
+        client = HubSpotClient(API_KEY)
+        df = read_csv(file_path, columns=DEAL_SCHEMA.columns('伝票No.'))
+        invalid_report = {}  # 日付に変換できなかった値の集計
+        all_deals = transform_data(df, invalid_report)
+
+        # バッチ処理（成功したバッチのsha512_contentsと送信後の値をスナップショットに記録する）
+        # 再送しても更新できなかった取引・商品項目は dead_letter_deal_update.csv に書き出す
+        with client, SnapshotStore(db_path) as store, IdRegistry(db_path) as registry, \
+                DeadLetter(os.path.dirname(file_path), 'deal_update') as dead_letter:
+            recovery = BatchRecovery(client, dead_letter)
+            updates, synced = sparse_deals(client, store, all_deals)
+            # 送信するプロパティがない取引は、HubSpotがすでに同じ値のためハッシュだけを記録する
+            unchanged = set(synced) - {deal["id"] for deal in updates}
+            store.record('deals', [(slip, synced[slip]['sha512_contents']) for slip in unchanged if synced[slip].get('sha512_contents')])
+            for batch_number, (batch, response) in enumerate(send_batches(client, updates, recovery), start=1):
+                print(f"Batch {batch_number} response: ", response)
+                if response.get('status') == 'COMPLETE':
+                    # 更新の応答には送信したプロパティしか含まれない（伝票No.を含まない）ため、送信した値から記録する
+                    failed = {deal["id"] for deal in response.get('failedInputs', [])}
+                    succeeded = [deal["id"] for deal in batch if deal["id"] not in failed]
+                    store.record('deals', [(slip, synced[slip]['sha512_contents']) for slip in succeeded if synced[slip].get('sha512_contents')])
+                    store.record_properties('deals', [(slip, synced[slip]) for slip in succeeded])
+
+            # 商品項目は明細ファイルがあれば差分だけを反映し、なければ従来どおりアーカイブする（作成はLineitems作成で行う）
+            line_path = os.path.join(os.path.dirname(file_path), LINE_ITEM_CSV)
+            if os.path.exists(line_path):
+                line_df = read_csv(line_path, columns=LINE_ITEM_SCHEMA.columns('伝票No.', 'sha512_contents'))
+                failed_slips = reconcile_line_items(client, registry, line_df, LINE_ITEM_DISCOVERY, invalid_report, recovery)
+                store.record('line_items', [
+                    (slip, digest) for slip, digest in slip_hashes(line_df).items() if slip not in failed_slips
+                ])
+            else:
+                failed_slips = replace_line_items(client, registry, df)
+            if failed_slips:
+                print(f"Line items of {len(failed_slips)} slips could not be updated: {sorted(failed_slips)}")
+        print_invalid_summary(invalid_report)
+        METRICS.write_reports(os.path.dirname(file_path), 'deal_update')
     except Exception as e:
         print(f"Error occurred: {e}")
         print(traceback.format_exc())
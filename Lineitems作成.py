@@ -1,197 +1,99 @@
 # coding: utf-8
 
-import pandas as pd
-import requests
-import json
 import os
-from datetime import datetime, timedelta, timezone
-import traceback
+import sys
+
+from batch_recovery import BatchRecovery, DeadLetter
+from checkpoint_journal import CheckpointJournal
+from csv_io import read_csv
+from date_convert import print_invalid_summary
+from hubspot_client import HubSpotClient
+from hubspot_lookup import resolve_deal_ids
+from id_registry import IdRegistry
+from lineitem_reconcile import rebuild_stale_line_items
+from metrics import METRICS
+from product_index import resolve_product_ids, set_product_ids
+from schemas import LINE_ITEM_SCHEMA, build_line_item_record
+from snapshot_store import SnapshotStore, SNAPSHOT_DB, slip_hashes
 
 # 定数
 BATCH_SIZE = 100  # 一度に送信するバッチのサイズ
-JST = timezone(timedelta(hours=+9))  # 日本標準時 (JST)
-UTC = timezone.utc  # UTCタイムゾーン
 API_KEY = 'xxxxxxxxxxxxxxxxxxxxxx0'  # ここに実際のAPIキーを入力してください
+JOURNAL_KEY = ['bugyo_denpyo_no', 'sha512_contents']  # ジャーナルで送信済みのレコードを識別するプロパティ（商品IDや取引IDは実行ごとに変わりうるため含めない）
 
-# CSVファイルを読み込む関数
-def read_csv(file_path):
-    print(f"Reading CSV file from: {file_path}")
-    encodings = ['utf-8', 'shift_jis', 'cp932', 'utf-16']
-    for enc in encodings:
-        try:
-            print(f"Trying encoding: {enc}")
-            df = pd.read_csv(file_path, dtype=str, encoding=enc)  # 異なるエンコーディングを試す
-            df = df.fillna('')  # 欠損値を空文字に置き換える
-            return df
-        except UnicodeDecodeError:
-            print(f"Failed with encoding: {enc}")
-        except FileNotFoundError:
-            print(f"File not found: {file_path}")
-            raise
-        except Exception as e:
-            print(f"An error occurred while reading the file with encoding {enc}: {e}")
-            print(traceback.format_exc())
-            raise
-    raise ValueError("Unable to read the file with any of the given encodings.")
+# HubSpot APIを呼び出して商品項目を作成する関数（失敗した入力だけを再送し、送信できなかった入力は failedInputs で返す）
+def create_line_items(recovery, line_items):
+    return recovery.send('/crm/v3/objects/line_items/batch/create', line_items)
 
-# 日付をUTCの深夜0時のタイムスタンプに変換する関数
-def convert_to_utc_midnight_timestamp(date_str):
-    try:
-        dt = datetime.strptime(date_str, "%Y/%m/%d").replace(tzinfo=UTC)
-        dt_midnight_utc = dt.replace(hour=0, minute=0, second=0, microsecond=0)
-        timestamp = int(dt_midnight_utc.timestamp() * 1000)  # ミリ秒に変換
-        return timestamp
-    except ValueError:
-        print(f"Skipping invalid date: {date_str}")
-        return ''  # 日付形式でない場合は空文字を返す
+# 商品項目を作成し、作成できなかった商品項目の伝票No.を記録する関数（前回の実行で作成済みのバッチは送信しない）
+# failures にリストを指定した場合は、作成できなかった (入力, エラー) を追加する
+def send_line_items(recovery, line_items, failed_slips, journal, failures=None):
+    for batch in journal.pending([line_items]):
+        with METRICS.stage('send', rows=len(batch)):
+            response = create_line_items(recovery, batch)
+        failed_slips.update(item["properties"]["bugyo_denpyo_no"] for item in response.get('failedInputs', []))
+        if failures is not None:
+            failures.extend(zip(response.get('failedInputs', []), response.get('errors', [])))
+        journal.record(batch, response.get('results', []))
 
-# 日時をUTCのタイムスタンプに変換する関数
-def convert_to_utc_timestamp(datetime_str):
-    try:
-        dt = datetime.strptime(datetime_str, "%Y/%m/%d %H:%M:%S").replace(tzinfo=JST)
-        dt_utc = dt.astimezone(UTC)
-        timestamp = int(dt_utc.timestamp() * 1000)  # ミリ秒に変換
-        return timestamp
-    except ValueError:
-        print(f"Skipping invalid datetime: {datetime_str}")
-        return ''  # 日付形式でない場合は空文字を返す
+# CSVファイルを読み込んで商品項目を作成するメイン関数
+# resume=True の場合は前回のジャーナルで完了済みのバッチを送信しない
+def main(file_path, resume=False):
+    df = read_csv(file_path, columns=LINE_ITEM_SCHEMA.columns('伝票No.', 'sha512_contents'))
+    db_path = os.path.join(os.path.dirname(file_path), SNAPSHOT_DB)
+    # 例外で中断してもクライアント・ジャーナル・失敗ファイルを閉じる（Deal新規送信と同じ構成）
+    with CheckpointJournal(file_path, 'line_item_create', JOURNAL_KEY, resume) as journal, HubSpotClient(API_KEY) as client, \
+            IdRegistry(db_path) as registry, DeadLetter(os.path.dirname(file_path), 'line_item_create') as dead_letter:
+        recovery = BatchRecovery(client, dead_letter)
 
-# HubSpot APIを呼び出して取引のIDを取得する関数
-def get_deal_ids(deal_numbers):
-    url = 'https://api.hubapi.com/crm/v3/objects/deals/batch/read?archived=false'
-    headers = {
-        'authorization': f'Bearer {API_KEY}',
-        'content-type': 'application/json'
-    }
-    inputs = [{"id": str(deal_number)} for deal_number in deal_numbers]
-    data = {
-        "idProperty": "no_____",
-        "inputs": inputs,
-        "properties": ["dealname"]
-    }
-    
-    try:
-        response = requests.post(url, headers=headers, data=json.dumps(data))
-        response.raise_for_status()
-        results = response.json().get("results", [])
-        deal_ids = {result["properties"]["no_____"]: result["id"] for result in results}
-        return deal_ids
-    except requests.exceptions.RequestException as e:
-        print(f"Request failed: {e}")
-        return {}
+        # プロパティは schemas.LINE_ITEM_SCHEMA でカラム単位にまとめて変換する
+        invalid_report = {}  # 日付に変換できなかった値の集計
+        properties = LINE_ITEM_SCHEMA.build_properties(df, invalid_report)
+        print_invalid_summary(invalid_report)
 
-# HubSpot APIを呼び出して商品項目を作成する関数
-def create_line_items(line_items):
-    url = 'https://api.hubapi.com/crm/v3/objects/line_items/batch/create'
-    headers = {
-        'authorization': f'Bearer {API_KEY}',
-        'content-type': 'application/json'
-    }
-    data = {"inputs": line_items}
-    
-    try:
-        response = requests.post(url, headers=headers, data=json.dumps(data))
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        print(f"Request failed: {e}")
-        return {}
+        # 伝票No.から取引IDを、商品コードから商品IDを取得する（前回までに取得したIDはローカルの索引から引く）
+        deal_numbers = df["伝票No."].unique().tolist()
+        deal_ids = resolve_deal_ids(client, registry, deal_numbers)
+        product_ids = resolve_product_ids(client, registry, properties)
+        linked = set_product_ids(properties, product_ids)
+        print(f"Linked {linked} of {len(properties)} line items to products")
 
-# CSVファイルを読み込んで商品項目を作成するメイン関数
-def main(file_path):
-    df = read_csv(file_path)
-    
-    deal_numbers = df["伝票No."].unique().tolist()
-    deal_ids = get_deal_ids(deal_numbers)
-    
-    line_items = []
-    for _, row in df.iterrows():
-        deal_id = deal_ids.get(row["伝票No."], None)
-        if not deal_id:
-            print(f"Deal ID not found for deal number: {row['伝票No.']}")
-            continue
+        line_items = []
+        failed_slips = set()  # 商品項目を作成できなかった伝票No.
+        failures = []  # 作成できなかった (商品項目, エラー)
+        for deal_number, line_item_properties in zip(df["伝票No."].tolist(), properties):
+            deal_id = deal_ids.get(deal_number, None)
+            if not deal_id:
+                print(f"Deal ID not found for deal number: {deal_number}")
+                failed_slips.add(deal_number)
+                continue
+            
+            line_item = build_line_item_record(line_item_properties, deal_id)
+            line_items.append(line_item)
+            if len(line_items) >= BATCH_SIZE:
+                send_line_items(recovery, line_items, failed_slips, journal, failures)
+                line_items.clear()
         
-        line_item = {
-            "associations": [
-                {
-                    "types": [
-                        {
-                            "associationCategory": "HUBSPOT_DEFINED",
-                            "associationTypeId": 20
-                        }
-                    ],
-                    "to": {
-                        "id": deal_id
-                    }
-                }
-            ],
-            "properties": {
-                "hs_price_jpy": row["売上金額"],
-                "tanka_shosu_keta": row["単価小数桁"],
-                "hakosuu_shosu_keta": row["箱数小数桁"],
-                "name": row["商品名"],
-                "nyuusuu": row["入数"],
-                "nyuusuu_shosu_keta": row["入数2"],
-                "shouhin_code": row["商品コード"],
-                "shu_shiire_saki_code": row["仕入先コード"],
-                "suuryou_shosu_keta": row["数量小数桁"],
-                "tanni": row["単位"],
-                "bugyo_biko": row["備考"],
-                "bugyo_chumon_no": row["注文No."],
-                "bugyo_denpyo_no": row["伝票No."],
-                "bugyo_douzi_shori_code": row["同時処理コード"],
-                "bugyo_fusen_memo": row["付箋メモ"],
-                "bugyo_fusenshoku_code": row["付箋色コード"],
-                "bugyo_genka_shohizei": row["原価消費税"],
-                "bugyo_genka_zeikomi_kubun_code": row["原価税込区分コード"],
-                "bugyo_hako_su": row["箱数"],
-                "bugyo_irisu2_shousu_keta": row["入数2小数桁"],
-                "bugyo_kazeikubun_code": row["課税区分コード"],
-                "bugyo_shohinmei2": row["商品名2"],
-                "bugyo_shohinmei3": row["商品名3"],
-                "bugyo_shohinmei4": row["商品名4"],
-                "bugyo_shohinmei5": row["商品名5"],
-                "bugyo_shohinmei6": row["商品名6"],
-                "bugyo_shohizei": row["消費税"],
-                "bugyo_shukka_kubun": row["出荷区分"],
-                "bugyo_shusei_hiduke_uriage_denpyo_base": convert_to_utc_timestamp(row["修正日付"]),
-                "bugyo_shusei_sha_urage_denpyo_base": row["修正者名"],
-                "bugyo_souko_code": row["倉庫コード"],
-                "bugyo_syohin_code_shurui_code": row["商品コード種類コード"],
-                "bugyo_tani_genka_urage_denpyo_base": row["単位原価"],
-                "bugyo_tanka": row["単価"],
-                "price": row["単価"],  # "price"プロパティに"単価"を追加
-                "bugyo_tanka_kubun": row["単価区分"],
-                "bugyo_torihiki_zyotai_kubun_code": row["取引状態区分コード"],
-                "bugyo_touroku_hiduke_uriage_denpyo_base": convert_to_utc_timestamp(row["登録日付"]),
-                "bugyo_tourokusha_mei_uriage_denpyo_base": row["登録者名"],
-                "bugyo_urage_kingaku_urage_denpyo_base": row["売上金額"],
-                "bugyo_uriage_genka": row["売上原価"],
-                "bugyo_uriage_kubun_code": row["売上区分コード"],
-                "bugyo_uritanka": row["売単価"],
-                "bugyo_zeikomi_kubun_code": row["税込区分コード"],
-                "bugyo_zeiritsu": row["税率"],
-                "bugyo_zeiritsu_kubun_code": row["税率区分コード"],
-                "bugyo_zeiritsu_shubetu": row["税率種別"],
-                "n2": row["売上原価2"],
-                "no____": row["伝票No."],
-                "sha512": row["sha512"],
-                "sha512_contents": row["sha512_contents"],
-                "quantity": row["数量"]
-            }
-        }
-        
-        line_items.append(line_item)
-        if len(line_items) >= BATCH_SIZE:
-            create_line_items(line_items)
-            line_items.clear()
-    
-    if line_items:
-        create_line_items(line_items)
+        if line_items:
+            send_line_items(recovery, line_items, failed_slips, journal, failures)
+
+        # 索引の取引IDが使えなかった伝票は、取引IDを引き直して1回だけ再送する
+        retry = rebuild_stale_line_items(client, registry, failures)
+        failed_slips -= {slip for slip, _ in retry}
+        for i in range(0, len(retry), BATCH_SIZE):
+            send_line_items(recovery, [line_item for _, line_item in retry[i:i + BATCH_SIZE]], failed_slips, journal)
+        journal.finish()
+
+    # すべての明細を作成できた伝票の明細ハッシュをスナップショットに記録する
+    with SnapshotStore(db_path) as store:
+        store.record('line_items', [
+            (slip, digest) for slip, digest in slip_hashes(df).items() if slip not in failed_slips
+        ])
+    METRICS.write_reports(os.path.dirname(file_path), 'line_item_create')
 
 if __name__ == "__main__":
     script_dir = os.path.dirname(os.path.abspath(__file__))
     csv_file_path = os.path.join(script_dir, '新規だけ5.csv')  # CSVファイルの相対パスを指定
     print(f"Script directory: {script_dir}")
     print(f"CSV file path: {csv_file_path}")
-    main(csv_file_path)
+    main(csv_file_path, resume='--resume' in sys.argv[1:])
@@ -0,0 +1,222 @@
+# coding: utf-8
+
+import csv
+import json
+import os
+import threading
+import time
+
+import requests
+
+# 定数
+MAX_INPUT_RETRIES = 2  # 207で個別にエラーになった入力だけを再送する回数
+SPLIT_STATUSES = (400, 409, 422)  # バッチ全体が拒否される（何も書き込まれない）ステータス。半分に分割して再送する
+SERVER_RETRY_STATUSES = (502, 503, 504)  # ゲートウェイ・一時的な障害のステータス。間隔を空けて同じリクエストを再送する
+MAX_SERVER_RETRIES = 3  # SERVER_RETRY_STATUSES を受け取った場合の最大リトライ回数
+SERVER_RETRY_BACKOFF = 1.0  # SERVER_RETRY_STATUSES を受け取った場合の初回待機時間（秒）
+TRACE_ID_FIELD = 'objectWriteTraceId'  # 入力に付ける追跡ID（エラーの context に返される）
+DEAD_LETTER_PREFIX = 'dead_letter_'  # 送信できなかった入力を書き出すCSVの名前（dead_letter_{実行名}.csv）
+UNKNOWN_CATEGORY = 'UNKNOWN_OUTCOME'  # 書き込まれたかどうか分からない入力に付けるエラーの category
+DEAD_LETTER_COLUMNS = ['failed_at', 'endpoint', 'category', 'message', 'id', 'idProperty', 'properties', 'associations']  # 送信できなかった入力のCSVのカラム
+
+# 応答の本文をJSONとして読む関数（本文がない・JSONでない場合はエラーの辞書）
+def _body(response):
+    try:
+        return response.json() if response.content else {}
+    except ValueError:
+        return {"status": "error", "message": response.text}
+
+# バッチ全体のエラーを1件のエラーにまとめる関数
+def _request_error(response, body):
+    return {
+        "status": "error",
+        "category": body.get('category', f"HTTP_{response.status_code}"),
+        "message": body.get('message', response.reason),
+        "statusCode": response.status_code,
+    }
+
+# エラーの context から失敗した入力の位置を返す関数（特定できない場合は空）
+def _failed_positions(error, inputs):
+    context = error.get('context') or {}
+    positions = set()
+    for value in list(context.get(TRACE_ID_FIELD, [])) + list(context.get('index', [])):
+        if str(value).isdigit() and int(value) < len(inputs):
+            positions.add(int(value))
+    ids = {str(value) for value in context.get('ids', [])}
+    if ids:
+        positions.update(position for position, item in enumerate(inputs) if str(item.get('id')) in ids)
+    return positions
+
+# 応答の results から書き込まれた入力の位置と、どの入力にも対応しなかった results の件数を返す関数
+# 追跡ID、idProperty の値、オブジェクトIDの順で照合する
+def _written_positions(results, inputs):
+    by_trace_id = {str(position): position for position in range(len(inputs))}
+    positions = set()
+    unmatched = 0
+    for result in results:
+        position = by_trace_id.get(str(result.get(TRACE_ID_FIELD)))
+        if position is None:
+            position = next((
+                position for position, item in enumerate(inputs)
+                if item.get('id') is not None and str(item['id']) == str(
+                    (result.get('properties') or {}).get(item['idProperty']) if item.get('idProperty') else result.get('id'))
+            ), None)
+        if position is None:
+            unmatched += 1
+        else:
+            positions.add(position)
+    return positions, unmatched
+
+# エラーを書き込まれたかどうか分からない（UNKNOWN_OUTCOME）エラーに変える関数
+def _unknown_outcome(error):
+    return {**error, "status": "unknown", "category": UNKNOWN_CATEGORY,
+            "message": f"May have been written ({error.get('category', '')}: {error.get('message', '')})"}
+
+# バッチ全体のエラーが同じ内容か判定する関数
+def _same_error(a, b):
+    return all(a.get(name) == b.get(name) for name in ('statusCode', 'category', 'message'))
+
+# 再送しても送信できなかった入力をCSVに追記するクラス（複数スレッドから使える。--resume で再実行しても前回分は残る）
+class DeadLetter:
+    def __init__(self, directory, run):
+        self.path = os.path.join(directory, f'{DEAD_LETTER_PREFIX}{run}.csv')
+        self.count = 0
+        self.file = None
+        self.lock = threading.Lock()
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            print(f"{self.count} inputs could not be sent. Written to {self.path}")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # 送信できなかった入力とエラーを追記する（プロパティはJSONで1カラムにまとめる）
+    def add(self, path, failures):
+        with self.lock:
+            if self.file is None:
+                is_new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+                self.file = open(self.path, 'a', encoding='utf-8', newline='')
+                self.writer = csv.DictWriter(self.file, fieldnames=DEAD_LETTER_COLUMNS)
+                if is_new:
+                    self.writer.writeheader()
+            for item, error in failures:
+                self.writer.writerow({
+                    'failed_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+                    'endpoint': path,
+                    'category': error.get('category', ''),
+                    'message': error.get('message', ''),
+                    'id': item.get('id', ''),
+                    'idProperty': item.get('idProperty', ''),
+                    'properties': json.dumps(item.get('properties', {}), ensure_ascii=False),
+                    'associations': json.dumps(item['associations'], ensure_ascii=False) if item.get('associations') else '',
+                })
+            self.count += len(failures)
+            self.file.flush()
+
+# 一部の入力だけが失敗したバッチを、失敗した入力だけ再送・分割して送信するクラス
+class BatchRecovery:
+    def __init__(self, client, dead_letter=None):
+        self.client = client
+        self.dead_letter = dead_letter
+
+    # バッチを送信し、成功した results と最終的に送信できなかった入力（failedInputs）を1つの応答にまとめて返す
+    # 書き込まれたかどうか分からない入力も成功として記録しないよう failedInputs に含める（エラーの category は UNKNOWN_OUTCOME）
+    # HubSpotClient.send_batches の send に指定して使う
+    def send(self, path, batch, extra_body=None):
+        results, failures = [], []
+        self._send(path, batch, extra_body, 0, results, failures)
+        response = {"status": "COMPLETE", "results": results}
+        if failures:
+            response.update({
+                "errors": [error for _, error in failures],
+                "numErrors": len(failures),
+                "failedInputs": [item for item, _ in failures],
+            })
+            if self.dead_letter is not None:
+                self.dead_letter.add(path, failures)
+        return response
+
+    def _send(self, path, inputs, extra_body, attempt, results, failures):
+        error = self._post(path, inputs, extra_body, attempt, results, failures)
+        if error is not None:
+            self._bisect(path, inputs, extra_body, attempt, results, failures, error)
+
+    # バッチ全体が拒否された場合に半分ずつ送信し、原因の入力を絞り込む
+    # 両方の半分が同じエラーで拒否された場合は、未知のプロパティなどバッチ全体の問題とみなしてそれ以上分割しない
+    def _bisect(self, path, inputs, extra_body, attempt, results, failures, error):
+        if len(inputs) == 1:
+            failures.append((inputs[0], error))
+            return
+        middle = len(inputs) // 2
+        halves = [inputs[:middle], inputs[middle:]]
+        print(f"Batch of {len(inputs)} rejected ({error.get('statusCode')}). Splitting...")
+        errors = [self._post(path, half, extra_body, attempt, results, failures) for half in halves]
+        if all(half_error is not None and _same_error(half_error, error) for half_error in errors):
+            print(f"Both halves rejected with the same error. Not splitting further: {error.get('message')}")
+            failures.extend((item, error) for item in inputs)
+            return
+        for half, half_error in zip(halves, errors):
+            if half_error is not None:
+                self._bisect(path, half, extra_body, attempt, results, failures, half_error)
+
+    # 1リクエストを送信して応答を処理する（バッチ全体が拒否された場合は入力を記録せずにそのエラーを返す）
+    def _post(self, path, inputs, extra_body, attempt, results, failures):
+        tagged = [{**item, TRACE_ID_FIELD: str(position)} for position, item in enumerate(inputs)]
+        for retry in range(MAX_SERVER_RETRIES + 1):
+            try:
+                response = self.client.request('POST', path, {"inputs": tagged, **(extra_body or {})})
+            except requests.exceptions.ConnectTimeout as e:
+                # 接続できなかった場合は送信されていない
+                failures.extend((item, {"status": "error", "category": "REQUEST_FAILED", "message": str(e)}) for item in inputs)
+                return None
+            except requests.exceptions.RequestException as e:
+                # 送信後のタイムアウトや切断は、書き込まれたかどうか分からない
+                error = _unknown_outcome({"status": "error", "category": "REQUEST_FAILED", "message": str(e)})
+                failures.extend((item, error) for item in inputs)
+                return None
+            if response.status_code not in SERVER_RETRY_STATUSES or retry == MAX_SERVER_RETRIES:
+                break
+            wait = SERVER_RETRY_BACKOFF * (2 ** retry)
+            print(f"Server error ({response.status_code}). Retrying in {wait} seconds...")
+            time.sleep(wait)
+        body = _body(response)
+
+        if response.status_code in SPLIT_STATUSES:
+            return _request_error(response, body)
+
+        if not response.ok:
+            # 5xxは書き込まれたかどうか分からないため、二重に作成しないようこれ以上再送しない
+            error = _request_error(response, body)
+            failures.extend((item, _unknown_outcome(error) if response.status_code >= 500 else error) for item in inputs)
+            return None
+
+        results.extend(body.get('results', []))
+        failed = {}
+        unmatched_errors = []
+        for error in body.get('errors', []):
+            positions = _failed_positions(error, inputs)
+            if not positions:
+                print(f"Could not match an error to its input: {error}")
+                unmatched_errors.append(error)
+            for position in positions:
+                failed[position] = error
+        if unmatched_errors:
+            # どの入力のエラーか分からない場合は、results に含まれない入力を再送せずに記録する
+            # results の一部が入力と照合できなかった場合は、書き込まれたかどうか分からない入力として記録する
+            written, unmatched_results = _written_positions(body.get('results', []), inputs)
+            error = _unknown_outcome(unmatched_errors[0]) if unmatched_results else unmatched_errors[0]
+            remaining = [position for position in range(len(inputs)) if position not in written and position not in failed]
+            failures.extend((inputs[position], error) for position in remaining)
+        if not failed:
+            return None
+        if attempt < MAX_INPUT_RETRIES:
+            print(f"{len(failed)} of {len(inputs)} inputs failed. Retrying only the failed inputs...")
+            self._send(path, [inputs[position] for position in sorted(failed)], extra_body, attempt + 1, results, failures)
+        else:
+            failures.extend((inputs[position], failed[position]) for position in sorted(failed))
+        return None
@@ -0,0 +1,121 @@
+# coding: utf-8
+
+import json
+import os
+import time
+from collections import Counter
+
+# 定数
+JOURNAL_SUFFIX = '.journal'  # 入力CSVの横に作るジャーナルファイルの拡張子（{CSV}.{実行名}.journal）
+
+# 入力のキー（key_properties の値をタブでつないだ文字列）を返す関数
+# 送信内容全体ではなくキーで判定するため、商品IDや取引IDが実行ごとに変わっても同じレコードとして扱える
+def record_key(item, key_properties):
+    properties = item.get('properties', {})
+    return '\t'.join('' if properties.get(name) is None else str(properties.get(name)) for name in key_properties)
+
+# 入力ファイルを識別する情報を返す関数（再開時にCSVが変わっていないか確認する）
+def source_signature(file_path):
+    stat = os.stat(file_path)
+    return {'path': os.path.basename(file_path), 'size': stat.st_size, 'mtime': int(stat.st_mtime)}
+
+# 送信したバッチのレコードのキーを追記していくジャーナル（バッチごとにfsyncし、--resume で完了済みのレコードを飛ばす）
+# key_properties はレコードを識別するプロパティ（取引は no_____、商品項目は bugyo_denpyo_no と sha512_contents など）
+class CheckpointJournal:
+    def __init__(self, file_path, run, key_properties, resume=False):
+        self.path = f'{file_path}.{run}{JOURNAL_SUFFIX}'
+        self.key_properties = list(key_properties)
+        self.source = source_signature(file_path) if os.path.exists(file_path) else None
+        self.completed = Counter()  # {レコードのキー: 完了済みの件数}（同じキーのレコードが複数ある場合も数で扱う）
+        self.ranges = {}  # {id(バッチ): (開始行, 終了行)} 送信中のバッチの範囲
+        self.rows = 0  # ここまでに読み込んだレコード数
+        self.skipped = 0  # 完了済みとして飛ばしたレコード数
+        if resume and os.path.exists(self.path):
+            self._load()
+            mode = 'a'
+        else:
+            if os.path.exists(self.path) and not self._finished():
+                print(f"Unfinished journal found, starting over (use --resume to continue it): {self.path}")
+            mode = 'w'
+        self.file = open(self.path, mode, encoding='utf-8')
+        if mode == 'a' and self._torn():
+            self.file.write('\n')  # 書き込み途中で終了した行の後ろに続けて書かないようにする
+        self._append({'type': 'start', 'run': run, 'resume': bool(resume), 'source': self.source, 'time': time.time()})
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # ジャーナルの行を順に返す（書き込み途中で終了した最後の行は読み飛ばす）
+    def _entries(self):
+        with open(self.path, encoding='utf-8') as f:
+            for line in f:
+                try:
+                    yield json.loads(line)
+                except ValueError:
+                    continue
+
+    # 最後の行が改行で終わっていないか確認する
+    def _torn(self):
+        with open(self.path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            if f.tell() == 0:
+                return False
+            f.seek(-1, os.SEEK_END)
+            return f.read(1) != b'\n'
+
+    def _finished(self):
+        finished = False
+        for entry in self._entries():
+            finished = entry.get('type') == 'finish'
+        return finished
+
+    # 既存のジャーナルから完了済みのレコードを読み込む（CSVが変わっている場合は再開しない）
+    def _load(self):
+        for entry in self._entries():
+            if entry.get('type') == 'start' and entry.get('source') != self.source:
+                raise RuntimeError(f"The CSV has changed since the journal was written: {entry.get('source')} -> {self.source}. "
+                                   f"Run without --resume to start over: {self.path}")
+            if entry.get('type') == 'batch':
+                self.completed.update(entry.get('keys', []))
+        print(f"Resuming from {self.path}: {sum(self.completed.values())} records already completed")
+
+    # 1行追記してディスクに書き出す（電源断やプロセスの強制終了でも失われないようにする）
+    def _append(self, entry):
+        self.file.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    # 完了済みのレコードを除いて送信するバッチを返すジェネレーター（すべて完了済みのバッチは送信しない）
+    def pending(self, batches):
+        for batch in batches:
+            start, self.rows = self.rows, self.rows + len(batch)
+            remaining = []
+            for item in batch:
+                key = record_key(item, self.key_properties)
+                if self.completed[key] > 0:
+                    self.completed[key] -= 1
+                    self.skipped += 1
+                else:
+                    remaining.append(item)
+            if remaining:
+                self.ranges[id(remaining)] = (start, self.rows)
+                yield remaining
+
+    # 送信したバッチのレコードのキーを記録する（results は作成・更新の応答の results）
+    def record(self, batch, results):
+        start, end = self.ranges.pop(id(batch), (None, None))
+        keys = [record_key(item, self.key_properties) for item in batch]
+        ids = [result.get('id') for result in results]
+        self._append({'type': 'batch', 'start': start, 'end': end, 'keys': keys, 'ids': ids, 'time': time.time()})
+
+    # 最後まで送信できたことを記録する
+    def finish(self):
+        self._append({'type': 'finish', 'rows': self.rows, 'skipped': self.skipped, 'time': time.time()})
+        if self.skipped:
+            print(f"Skipped {self.skipped} records completed in a previous run")
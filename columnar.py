@@ -0,0 +1,60 @@
+# coding: utf-8
+
+import os
+
+# pyarrowがインストールされていない場合はCSVだけを使う
+try:
+    import pyarrow as pa
+    import pyarrow.feather as feather
+except ImportError:
+    pa = None
+    feather = None
+
+# 定数
+WRITE_COLUMNAR = True  # Trueの場合、中間ファイルのCSVと同じ場所にArrow IPC（.arrow）も書き出す（pyarrowがない場合は書き出さない）
+READ_COLUMNAR = True  # Trueの場合、CSVより新しい .arrow があればそちらをメモリマップで読み込む
+COLUMNAR_SUFFIX = '.arrow'  # Arrow IPCファイルの拡張子
+
+# CSVのパスに対応するArrow IPCファイルのパスを返す関数
+def columnar_path(file_path):
+    return os.path.splitext(file_path)[0] + COLUMNAR_SUFFIX
+
+# CSVの代わりに読み込めるArrow IPCファイルのパスを返す関数（CSVより古い場合や使えない場合はNone）
+def fresh_columnar(file_path):
+    if pa is None or not READ_COLUMNAR:
+        return None
+    path = columnar_path(file_path)
+    if not os.path.exists(path):
+        return None
+    if os.path.exists(file_path) and os.path.getmtime(path) < os.path.getmtime(file_path):
+        print(f"Ignoring {path}: older than {file_path}")
+        return None
+    return path
+
+# データフレームをArrow IPC（非圧縮のFeather V2）で書き出す関数（書き出した場合はパスを返す）
+def write_columnar(df, file_path):
+    if pa is None or not WRITE_COLUMNAR:
+        return None
+    path = columnar_path(file_path)
+    temp_path = f'{path}.tmp'
+    # 非圧縮にしておくと、読み込み時にメモリマップからコピーせずに参照できる
+    feather.write_feather(pa.Table.from_pandas(df, preserve_index=False), temp_path, compression='uncompressed')
+    os.replace(temp_path, path)
+    return path
+
+# Arrow IPCファイルをメモリマップで開き、指定したカラムだけのテーブルを返す関数（存在しないカラムは無視する）
+def read_columnar_table(path, columns=None):
+    table = pa.ipc.open_file(pa.memory_map(path, 'r')).read_all()
+    if columns is not None:
+        table = table.select([name for name in dict.fromkeys(columns) if name in table.column_names])
+    return table
+
+# Arrow IPCファイルをデータフレームとして読み込む関数
+def read_columnar(path, columns=None):
+    return read_columnar_table(path, columns).to_pandas()
+
+# Arrow IPCファイルをchunk_size行ずつのデータフレームとして返すジェネレーター
+def read_columnar_chunks(path, chunk_size, columns=None):
+    table = read_columnar_table(path, columns)
+    for batch in table.to_batches(max_chunksize=chunk_size):
+        yield batch.to_pandas()
@@ -0,0 +1,12 @@
+# coding: utf-8
+
+from object_index import INDEX_TTL, ObjectIndex
+
+# 定数
+COMPANY_KEY_PROPERTY = 'bugyo_tokuisaki_code_unique'  # 関連付けのキーを格納している会社のユニークプロパティ
+
+# 関連付けのキーから会社IDを引くローカルの索引
+class CompanyIndex(ObjectIndex):
+    def __init__(self, registry, property_name=COMPANY_KEY_PROPERTY, ttl=INDEX_TTL):
+        # 伝票No.などの索引と区別するため、種別名にプロパティ名を含める
+        super().__init__(registry, 'companies', property_name, f'companies:{property_name}', ttl)
@@ -0,0 +1,235 @@
+# coding: utf-8
+
+import codecs
+import json
+import os
+import traceback
+
+import pandas as pd
+
+from columnar import fresh_columnar, read_columnar, read_columnar_chunks, write_columnar
+from metrics import METRICS
+from sha512_engine import ensure_sha512_columns
+
+# 定数
+CHUNK_SIZE = 1000  # ストリーミング時に1度に読み込む行数（BATCH_SIZEの倍数にする）
+SNIFF_BYTES = 64 * 1024  # エンコーディング判定に使うファイル先頭のバイト数
+VALIDATE_BLOCK_BYTES = 1024 * 1024  # ストリーミング前にファイル全体を復号できるか確認する場合に1度に読むバイト数
+ENCODING_CACHE = 'encoding_cache.json'  # 出力元ごとに判定したエンコーディングを記録するファイル名
+ENCODINGS = ['utf-8', 'cp932']  # BOMがない場合に試すエンコーディングの順番（cp932はshift_jisの上位互換）
+COMPACT_DTYPES = True  # Trueの場合、read_csv で値の種類が少ないカラムをカテゴリ型にする
+CATEGORY_MIN_ROWS = 1000  # この行数以上のデータフレームだけカテゴリ型にする
+CATEGORY_MAX_RATIO = 0.5  # 重複しない値の割合がこれ以下のカラムをカテゴリ型にする（区分コード・単位・税率など）
+
+# BOMとエンコーディングの対応
+BOMS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF16_LE, 'utf-16'),
+    (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+# エンコーディングのキャッシュファイルのパスを返す関数
+def _cache_path(file_path):
+    return os.path.join(os.path.dirname(os.path.abspath(file_path)), ENCODING_CACHE)
+
+# 出力元（ファイル名）ごとに記録したエンコーディングを読み込む関数
+def _load_cache(file_path):
+    try:
+        with open(_cache_path(file_path), encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+# 判定したエンコーディングを出力元ごとに記録する関数
+def _save_cache(file_path, encoding):
+    cache = _load_cache(file_path)
+    source = os.path.basename(file_path)
+    if cache.get(source) == encoding:
+        return
+    cache[source] = encoding
+    try:
+        with open(_cache_path(file_path), 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False, indent=2)
+    except OSError as e:
+        print(f"Could not save encoding cache: {e}")
+
+# サンプルのバイト列を指定のエンコーディングで復号できるか確認する関数
+def _can_decode(sample, encoding):
+    decoder = codecs.getincrementaldecoder(encoding)()
+    try:
+        decoder.decode(sample, final=False)  # 末尾で途切れた文字はエラーにしない
+        return True
+    except UnicodeDecodeError:
+        return False
+
+# 試すエンコーディングの候補を返す関数（前回の判定結果を優先する）
+def _candidates(file_path, sample):
+    candidates = list(ENCODINGS)
+    if b'\x00' in sample:
+        candidates.append('utf-16')  # BOMのないUTF-16はNULバイトを含む場合のみ候補にする
+    cached = _load_cache(file_path).get(os.path.basename(file_path))
+    if cached:
+        candidates = [cached] + [enc for enc in candidates if enc != cached]
+    return candidates
+
+# ファイル全体を指定のエンコーディングで復号できるか確認する関数（パースはせず、ブロックごとに復号するだけ）
+def _can_decode_file(file_path, encoding):
+    decoder = codecs.getincrementaldecoder(encoding)()
+    try:
+        with open(file_path, 'rb') as f:
+            for block in iter(lambda: f.read(VALIDATE_BLOCK_BYTES), b''):
+                decoder.decode(block, final=False)
+            decoder.decode(b'', final=True)
+        return True
+    except UnicodeDecodeError:
+        return False
+
+# ファイル全体を復号できるエンコーディングを返す関数（先頭のサンプルで判定したものが使えない場合は残りの候補を試す）
+# ストリーミングでは途中で復号に失敗すると送信済みのバッチが残るため、最初のチャンクを返す前に確認する
+def detect_file_encoding(file_path):
+    encoding = detect_encoding(file_path)
+    if _can_decode_file(file_path, encoding):
+        return encoding
+    print(f"Failed with encoding: {encoding}")
+    for fallback in ENCODINGS:
+        if fallback == encoding:
+            continue
+        if _can_decode_file(file_path, fallback):
+            _save_cache(file_path, fallback)
+            return fallback
+        print(f"Failed with encoding: {fallback}")
+    raise ValueError("Unable to read the file with any of the given encodings.")
+
+# ファイル先頭のBOMとサンプルからエンコーディングを判定する関数
+def detect_encoding(file_path):
+    with open(file_path, 'rb') as f:
+        sample = f.read(SNIFF_BYTES)
+    for bom, encoding in BOMS:
+        if sample.startswith(bom):
+            return encoding
+    for encoding in _candidates(file_path, sample):
+        if _can_decode(sample, encoding):
+            _save_cache(file_path, encoding)
+            return encoding
+    raise ValueError("Unable to detect the encoding of the file.")
+
+# CSVファイルを読み込む関数（読み込み時間と行数を metrics の read ステージに記録する）
+# hash_spec（sha512_engine.HASH_SPECS の値）を指定した場合、sha512のカラムがなければ読み込んだデータから計算する
+# CSVより新しいArrow IPC（.arrow）がある場合はそちらを読み込み、columns を指定した場合はそのカラムだけを読み込む
+# （columns は Schema.columns() で送信に使うカラムから作る。CSVに存在しないカラムは無視する）
+def read_csv(file_path, hash_spec=None, columns=None):
+    columnar = fresh_columnar(file_path)
+    columns = _with_hash_columns(columns, hash_spec)
+    with METRICS.stage('read'):
+        if columnar:
+            print(f"Reading columnar file from: {columnar}")
+            df = _fillna(read_columnar(columnar, columns))
+        else:
+            df = _read_csv(file_path, columns)
+    METRICS.add_rows('read', len(df))
+    if hash_spec is not None:
+        df = ensure_sha512_columns(df, hash_spec)
+    if COMPACT_DTYPES:
+        df = compact_dtypes(df)
+    return df
+
+# 読み込むカラムを pd.read_csv の usecols に変換する関数（存在しないカラムを指定してもエラーにしない）
+def _usecols(columns):
+    if columns is None:
+        return None
+    wanted = set(columns)
+    return lambda name: name in wanted
+
+# 値の種類が少ないカラムをカテゴリ型にする関数（行ごとに文字列オブジェクトを持たず、値の種類分だけを持つ）
+def compact_dtypes(df):
+    if len(df) < CATEGORY_MIN_ROWS:
+        return df
+    limit = len(df) * CATEGORY_MAX_RATIO
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            continue
+        codes, uniques = pd.factorize(df[col])  # 1回のハッシュで種類の数とカテゴリ型のコードを求める
+        if len(uniques) <= limit and (codes >= 0).all():
+            df[col] = pd.Categorical.from_codes(codes, uniques)
+    return df
+
+# 欠損値を空文字に置き換える関数（カテゴリ型のカラムは空文字をカテゴリに加えてから置き換える）
+def _fillna(df):
+    for col in df.columns:
+        if isinstance(df[col].dtype, pd.CategoricalDtype) and '' not in df[col].cat.categories and df[col].isna().any():
+            df[col] = df[col].cat.add_categories([''])
+    return df.fillna('')
+
+# エンコーディングを判定してから1回だけ読み込む関数
+def _read_csv(file_path, columns=None):
+    print(f"Reading CSV file from: {file_path}")
+    try:
+        encoding = detect_encoding(file_path)
+    except FileNotFoundError:
+        print(f"File not found: {file_path}")
+        raise
+    print(f"Detected encoding: {encoding}")
+    try:
+        df = pd.read_csv(file_path, dtype=str, encoding=encoding, usecols=_usecols(columns))
+    except UnicodeDecodeError:
+        # 先頭のサンプル以降で復号に失敗した場合のみ、残りの候補を試す
+        print(f"Failed with encoding: {encoding}")
+        df = None
+        for fallback in ENCODINGS:
+            if fallback == encoding:
+                continue
+            try:
+                print(f"Trying encoding: {fallback}")
+                df = pd.read_csv(file_path, dtype=str, encoding=fallback, usecols=_usecols(columns))
+                _save_cache(file_path, fallback)
+                break
+            except UnicodeDecodeError:
+                print(f"Failed with encoding: {fallback}")
+        if df is None:
+            raise ValueError("Unable to read the file with any of the given encodings.")
+    except Exception as e:
+        print(f"An error occurred while reading the file with encoding {encoding}: {e}")
+        print(traceback.format_exc())
+        raise
+    df = df.fillna('')  # 欠損値を空文字に置き換える
+    return df
+
+# ハッシュを計算する場合に必要なカラムを読み込むカラムに加える関数
+def _with_hash_columns(columns, hash_spec):
+    if columns is None or hash_spec is None:
+        return columns
+    return list(columns) + ['sha512', 'sha512_contents'] + hash_spec['contents_columns'] + hash_spec['audit_columns']
+
+# CSVファイルをチャンク単位で読み込むジェネレーター（hash_spec・columns は read_csv と同じ）
+def read_csv_chunks(file_path, chunk_size=CHUNK_SIZE, hash_spec=None, columns=None):
+    columnar = fresh_columnar(file_path)
+    if columnar:
+        print(f"Reading columnar file in chunks of {chunk_size} rows from: {columnar}")
+        chunks = read_columnar_chunks(columnar, chunk_size, _with_hash_columns(columns, hash_spec))
+    else:
+        print(f"Reading CSV file in chunks of {chunk_size} rows from: {file_path}")
+        encoding = detect_file_encoding(file_path)
+        print(f"Detected encoding: {encoding}")
+        chunks = pd.read_csv(file_path, dtype=str, encoding=encoding, chunksize=chunk_size,
+                             usecols=_usecols(_with_hash_columns(columns, hash_spec)))
+    for chunk in METRICS.timed('read', chunks):
+        chunk = _fillna(chunk)  # 欠損値を空文字に置き換える
+        if hash_spec is not None:
+            chunk = ensure_sha512_columns(chunk, hash_spec, max_workers=1)  # チャンクは小さいため現在のプロセスで計算する
+        yield chunk
+
+# データフレームをCSVに書き出す関数（columnar.WRITE_COLUMNAR の場合はArrow IPCも書き出す）
+def write_csv(df, file_path):
+    df.to_csv(file_path, index=False)
+    write_columnar(df, file_path)  # CSVより後に書き、CSVより新しい状態にする
+
+# 変換済みのレコードをBATCH_SIZEごとにまとめるジェネレーター
+def iter_batches(records_iter, batch_size):
+    buffer = []
+    for records in records_iter:
+        buffer.extend(records)
+        while len(buffer) >= batch_size:
+            yield buffer[:batch_size]
+            del buffer[:batch_size]
+    if buffer:
+        yield buffer
@@ -0,0 +1,79 @@
+# coding: utf-8
+
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+# 定数
+JST = timezone(timedelta(hours=+9))  # 日本標準時 (JST)
+UTC = timezone.utc  # UTCタイムゾーン
+DATE_FORMAT = "%Y/%m/%d"  # 日付の形式（UTCの深夜0時として扱う）
+DATETIME_FORMAT = "%Y/%m/%d %H:%M:%S"  # 日時の形式（JSTとして扱う）
+CACHE_SIZE = 65536  # 変換結果をキャッシュする値の数
+
+# 日付をUTCの深夜0時のタイムスタンプ（ミリ秒）に変換する関数（日付形式でない場合はNone）
+@lru_cache(maxsize=CACHE_SIZE)
+def to_utc_midnight_timestamp(date_str):
+    try:
+        dt = datetime.strptime(date_str, DATE_FORMAT).replace(tzinfo=UTC)
+    except (TypeError, ValueError):
+        return None
+    dt_midnight_utc = dt.replace(hour=0, minute=0, second=0, microsecond=0)
+    return int(dt_midnight_utc.timestamp() * 1000)  # ミリ秒に変換
+
+# 日時（JST）をUTCのタイムスタンプ（ミリ秒）に変換する関数（日時形式でない場合はNone）
+@lru_cache(maxsize=CACHE_SIZE)
+def to_utc_timestamp(datetime_str):
+    try:
+        dt = datetime.strptime(datetime_str, DATETIME_FORMAT).replace(tzinfo=JST)
+    except (TypeError, ValueError):
+        return None
+    dt_utc = dt.astimezone(UTC)
+    return int(dt_utc.timestamp() * 1000)  # ミリ秒に変換
+
+# HubSpotが返すISO 8601の日付・日時をタイムスタンプ（ミリ秒）の文字列にそろえる関数（それ以外の値はそのまま返す）
+# 送信した値（ミリ秒）とHubSpotから読んだ値（"2024-01-31" や "2024-01-31T15:00:00Z"）を比較する場合に使う
+def normalize_timestamp(value):
+    if not isinstance(value, str) or len(value) < 10 or value[4:5] != '-' or value[7:8] != '-':
+        return value
+    try:
+        dt = datetime.fromisoformat(value.replace('Z', '+00:00'))
+    except ValueError:
+        return value
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=UTC)  # 日付だけの値はUTCの深夜0時として扱う
+    return str(int(dt.timestamp() * 1000))
+
+# カラムの重複しない値だけを変換し、結果と変換できなかった値の件数を返す関数
+def _convert_column(series, func):
+    codes, uniques = pd.factorize(series)
+    converted = [func(value) for value in uniques]
+    counts = np.bincount(codes[codes >= 0], minlength=len(uniques))
+    invalid = Counter({
+        value: int(count) for value, result, count in zip(uniques, converted, counts) if result is None
+    })
+    values = np.empty(len(uniques), dtype=object)
+    values[:] = ['' if result is None else result for result in converted]  # 変換できない場合は空文字を送る
+    return values[codes].tolist(), invalid
+
+# 日付カラムをUTCの深夜0時のタイムスタンプに一括変換するコンバーター
+def date_column(series):
+    return _convert_column(series, to_utc_midnight_timestamp)
+
+# 日時カラム（JST）をUTCのタイムスタンプに一括変換するコンバーター
+def datetime_column(series):
+    return _convert_column(series, to_utc_timestamp)
+
+# 変換できなかった値の集計をカラムごとに1行で表示する関数
+def print_invalid_summary(invalid_report, sample_size=5):
+    for column, invalid in invalid_report.items():
+        blank = invalid.get('', 0)
+        others = Counter({value: count for value, count in invalid.items() if value != ''})
+        if not blank and not others:
+            continue
+        samples = ', '.join(f"{value!r} x{count}" for value, count in others.most_common(sample_size))
+        print(f"Skipped invalid values in {column}: blank {blank}, invalid {sum(others.values())}"
+              + (f" ({samples})" if samples else ""))
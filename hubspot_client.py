@@ -0,0 +1,147 @@
+# coding: utf-8
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import METRICS
+
+# 定数
+API_BASE = os.getenv('HUBSPOT_API_BASE', 'https://api.hubapi.com')  # ローカルのスタブに向ける場合は環境変数で上書きする
+MAX_IN_FLIGHT = 4  # 同時に送信中にできるバッチの数
+RATE_LIMIT_REQUESTS = int(os.getenv('HUBSPOT_RATE_LIMIT', '100'))  # RATE_LIMIT_WINDOW秒あたりのリクエスト上限（HubSpotのプライベートアプリは10秒あたり100〜190）
+RATE_LIMIT_WINDOW = 10  # レート制限の単位時間（秒）
+SEARCH_RATE_LIMIT_REQUESTS = 4  # search APIの1秒あたりのリクエスト上限（HubSpotは1秒あたり5回）
+MAX_RETRIES = 5  # 429を受け取った場合の最大リトライ回数
+RETRY_BACKOFF = 1.0  # Retry-Afterがない場合の初回待機時間（秒）
+REQUEST_TIMEOUT = 60  # 1リクエストのタイムアウト（秒）
+
+# トークンバケット方式のレートリミッター（複数スレッドで共有する）
+class TokenBucket:
+    def __init__(self, capacity=RATE_LIMIT_REQUESTS, window=RATE_LIMIT_WINDOW):
+        self.capacity = capacity
+        self.rate = capacity / window  # 1秒あたりに補充されるトークン数
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    # トークンを1つ取得する（足りない場合は補充されるまで待つ）
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                else:
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    # 429を受け取った場合に全スレッドの送信を一時停止する
+    def pause(self, seconds):
+        with self.lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+            self.tokens = 0
+
+# Retry-Afterヘッダーから待機秒数を取得する関数
+def _retry_after(response):
+    value = response.headers.get('Retry-After')
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+# 接続を使い回してHubSpot APIを呼び出すクライアント
+class HubSpotClient:
+    def __init__(self, api_key, max_in_flight=MAX_IN_FLIGHT, rate_limit=RATE_LIMIT_REQUESTS,
+                 rate_window=RATE_LIMIT_WINDOW, api_base=API_BASE, metrics=METRICS):
+        self.api_base = api_base.rstrip('/')
+        self.metrics = metrics  # リクエストごとのレイテンシとレート制限ヘッダーを記録する
+        self.max_in_flight = max_in_flight
+        self.limiter = TokenBucket(rate_limit, rate_window)
+        self.search_limiter = TokenBucket(SEARCH_RATE_LIMIT_REQUESTS, 1)  # search APIは別枠で制限する
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(max_in_flight, 10))  # keep-aliveの接続をプールする
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.headers.update({
+            'Authorization': f'Bearer {api_key}',
+            'Content-Type': 'application/json'
+        })
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # レート制限と429のリトライを考慮してリクエストを送信する
+    def request(self, method, path, body=None, params=None):
+        url = path if path.startswith('http') else f"{self.api_base}{path}"
+        data = json.dumps(body) if body is not None else None
+        is_search = url.split('?')[0].endswith('/search')
+        for attempt in range(MAX_RETRIES + 1):
+            if is_search:
+                self.search_limiter.acquire()
+            self.limiter.acquire()
+            started = time.perf_counter()
+            response = self.session.request(method, url, data=data, params=params, timeout=REQUEST_TIMEOUT)
+            if self.metrics is not None:
+                self.metrics.observe_request(method, url, time.perf_counter() - started, response.status_code, response.headers)
+            if response.status_code != 429 or attempt == MAX_RETRIES:
+                return response
+            wait = _retry_after(response) or RETRY_BACKOFF * (2 ** attempt)
+            print(f"Rate limited (429). Retrying in {wait} seconds...")
+            (self.search_limiter if is_search else self.limiter).pause(wait)
+        return response
+
+    # POSTしてJSONの応答を返す（本文がない場合は空の辞書）
+    def post_json(self, path, body):
+        response = self.request('POST', path, body)
+        if not response.content:
+            return {}
+        try:
+            return response.json()
+        except ValueError:
+            return {"status": "error", "message": response.text, "statusCode": response.status_code}
+
+    # 1バッチをPOSTしてJSONの応答を返す
+    def post_batch(self, path, batch, extra_body=None):
+        return self.post_json(path, {"inputs": batch, **(extra_body or {})})
+
+    # 送信済みのバッチの応答を待つ（待ち時間と件数を metrics の send ステージに記録する）
+    def _wait(self, batch, future):
+        if self.metrics is None:
+            return future.result()
+        with self.metrics.stage('send', rows=len(batch)):
+            return future.result()
+
+    # バッチを同時にMAX_IN_FLIGHT件まで送信し、送信順に (バッチ, 応答) を返すジェネレーター
+    # extra_body には inputs 以外に送る項目（idProperty など）を指定する
+    # send には1バッチを送信する関数を指定できる（batch_recovery.BatchRecovery.send など）
+    def send_batches(self, path, batches, extra_body=None, send=None):
+        send = send or self.post_batch
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            in_flight = deque()
+            for batch in batches:
+                in_flight.append((batch, executor.submit(send, path, batch, extra_body)))
+                if len(in_flight) >= self.max_in_flight:
+                    done_batch, future = in_flight.popleft()
+                    yield done_batch, self._wait(done_batch, future)
+            while in_flight:
+                done_batch, future = in_flight.popleft()
+                yield done_batch, self._wait(done_batch, future)
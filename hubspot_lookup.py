@@ -0,0 +1,157 @@
+# coding: utf-8
+
+from concurrent.futures import ThreadPoolExecutor
+
+from paginator import association_pages, iter_results, search_pages
+
+# 定数
+READ_BATCH_SIZE = 100  # batch/read の1リクエストあたりの上限
+SEARCH_IN_LIMIT = 100  # search APIのINフィルターに指定できる値の上限
+DEAL_ID_PROPERTY = 'no_____'  # 伝票No.を格納している取引のユニークプロパティ
+LINE_ITEM_SLIP_PROPERTY = 'bugyo_denpyo_no'  # 伝票No.を格納している商品項目のプロパティ
+
+# ユニークプロパティの値でオブジェクトを一括取得する関数（APIの上限ごとに分割して同時に送信する）
+# failed にセットを指定した場合は、読み込めなかったバッチのキーを追加する
+def read_by_property(client, object_type, id_property, keys, properties=None, failed=None):
+    keys = [str(key) for key in keys]
+    batches = ([{"id": key} for key in keys[i:i + READ_BATCH_SIZE]] for i in range(0, len(keys), READ_BATCH_SIZE))
+    properties = [id_property] + [name for name in (properties or []) if name != id_property]
+    objects = []
+    for batch, result in client.send_batches(
+        f'/crm/v3/objects/{object_type}/batch/read?archived=false', batches,
+        extra_body={"idProperty": id_property, "properties": properties},
+    ):
+        if 'results' not in result:
+            print(f"Failed to read {object_type}: {result}")
+            if failed is not None:
+                failed.update(item['id'] for item in batch)
+            continue
+        objects.extend(result['results'])
+    return objects
+
+# ユニークプロパティの値からオブジェクトIDを一括取得する関数
+def read_ids_by_property(client, object_type, id_property, keys):
+    return {item['properties'][id_property]: item['id'] for item in read_by_property(client, object_type, id_property, keys)}
+
+# オブジェクトIDからプロパティを一括取得する関数（APIの上限ごとに分割して同時に送信する）
+# failed にセットを指定した場合は、読み込めなかったバッチのIDを追加する
+def read_objects(client, object_type, object_ids, properties, failed=None):
+    object_ids = [str(object_id) for object_id in dict.fromkeys(object_ids)]
+    batches = ([{"id": object_id} for object_id in object_ids[i:i + READ_BATCH_SIZE]] for i in range(0, len(object_ids), READ_BATCH_SIZE))
+    objects = []
+    for batch, result in client.send_batches(
+        f'/crm/v3/objects/{object_type}/batch/read?archived=false', batches, extra_body={"properties": properties},
+    ):
+        if 'results' not in result:
+            print(f"Failed to read {object_type}: {result}")
+            if failed is not None:
+                failed.update(item['id'] for item in batch)
+            continue
+        objects.extend(result['results'])
+    return objects
+
+# 伝票No.から取引IDを取得する関数（索引にない伝票No.だけをHubSpotから取得して記録する）
+def resolve_deal_ids(client, registry, deal_numbers):
+    deal_numbers = [str(number) for number in dict.fromkeys(deal_numbers) if number]
+    deal_ids = registry.get_ids('deals', deal_numbers)
+    missing = [number for number in deal_numbers if number not in deal_ids]
+    fetched = read_ids_by_property(client, 'deals', DEAL_ID_PROPERTY, missing) if missing else {}
+    registry.record('deals', fetched.items())
+    deal_ids.update(fetched)
+    print(f"Deal IDs: {len(deal_numbers) - len(missing)} from cache, {len(fetched)} looked up, "
+          f"{len(missing) - len(fetched)} not found")
+    return deal_ids
+
+# 索引の取引IDが使えない（取引が削除・統合された）ことを示すエラーか判定する関数
+def is_stale_deal_error(error):
+    text = f"{error.get('category', '')} {error.get('subCategory', '')} {error.get('message', '')}".upper()
+    return 'OBJECT_NOT_FOUND' in text or 'ASSOCIATION' in text
+
+# 索引の取引IDを破棄し、HubSpotから引き直す関数
+def refresh_deal_ids(client, registry, deal_numbers):
+    deal_numbers = [str(number) for number in dict.fromkeys(deal_numbers) if number]
+    registry.forget('deals', deal_numbers)
+    return resolve_deal_ids(client, registry, deal_numbers)
+
+# 1つのINフィルターで検索し、すべてのページの結果を返す関数（検索に失敗した場合はNone）
+def _search_chunk(client, object_type, property_name, values, properties):
+    body = {
+        "filterGroups": [
+            {
+                "filters": [
+                    {
+                        "propertyName": property_name,
+                        "values": values,
+                        "operator": "IN"
+                    }
+                ]
+            }
+        ],
+        "properties": properties
+    }
+    try:
+        # チャンク自体を同時に検索するため、ページの先読みはしない
+        return list(iter_results(search_pages(client, object_type, body, prefetch=False)))
+    except RuntimeError as e:
+        print(e)
+        return None
+
+# プロパティの値でオブジェクトを検索する関数（値をINフィルターの上限ごとに分割して同時に検索する）
+# failed にセットを指定した場合は、検索に失敗したチャンクの値を追加する
+def search_by_values(client, object_type, property_name, values, properties=None, failed=None):
+    values = [str(value) for value in dict.fromkeys(values) if value]
+    chunks = [values[i:i + SEARCH_IN_LIMIT] for i in range(0, len(values), SEARCH_IN_LIMIT)]
+    properties = properties or [property_name]
+    results = []
+    with ThreadPoolExecutor(max_workers=client.max_in_flight) as executor:
+        for chunk, chunk_results in zip(chunks, executor.map(lambda chunk: _search_chunk(client, object_type, property_name, chunk, properties), chunks)):
+            if chunk_results is None:
+                if failed is not None:
+                    failed.update(chunk)
+                continue
+            results.extend(chunk_results)
+    return results
+
+# 伝票No.で商品項目を検索し、伝票No.ごとの商品項目のリストを返す関数
+def search_line_items_by_slip(client, slip_numbers, properties=None, failed=None):
+    properties = [LINE_ITEM_SLIP_PROPERTY] + [name for name in (properties or []) if name != LINE_ITEM_SLIP_PROPERTY]
+    line_items = {}
+    for item in search_by_values(client, 'line_items', LINE_ITEM_SLIP_PROPERTY, slip_numbers, properties, failed):
+        line_items.setdefault(item['properties'].get(LINE_ITEM_SLIP_PROPERTY), []).append(item)
+    return line_items
+
+# v4のbatch/readで関連付けを一括取得し、{元のID: [to の要素（toObjectId と associationTypes）]} を返す関数
+# failed にセットを指定した場合は、関連付けを読み込めなかった元のIDを追加する（途中のページまで読めたIDも含む）
+def read_association_links(client, from_object_type, to_object_type, from_ids, failed=None):
+    associated = {}
+    for batch, page in association_pages(client, from_object_type, to_object_type, from_ids):
+        if 'results' not in page:
+            print(f"Failed to read {from_object_type} -> {to_object_type} associations: {page}")
+            if failed is not None:
+                failed.update(item['id'] for item in batch)
+            continue
+        for item in page['results']:
+            associated.setdefault(str(item['from']['id']), []).extend(item.get('to', []))
+    return associated
+
+# v4のbatch/readで関連付けを一括取得し、{元のID: [関連付け先のID]} を返す関数
+def read_associations(client, from_object_type, to_object_type, from_ids, failed=None):
+    links = read_association_links(client, from_object_type, to_object_type, from_ids, failed)
+    return {from_id: [str(to['toObjectId']) for to in items] for from_id, items in links.items()}
+
+# 伝票No.から取引IDを引き、取引に関連付けられた商品項目を伝票No.ごとに返す関数
+# failed にセットを指定した場合は、関連付けを読み込めなかった取引の伝票No.を追加する
+# deal_ids に {伝票No.: 取引ID} を指定した場合は、取引IDを引かずにその対応を使う
+def find_line_items_by_deals(client, registry, slip_numbers, failed=None, deal_ids=None):
+    if deal_ids is None:
+        deal_ids = resolve_deal_ids(client, registry, slip_numbers)
+    else:
+        deal_ids = {slip: deal_ids[slip] for slip in slip_numbers if slip in deal_ids}
+    failed_deals = set()
+    associated = read_associations(client, 'deals', 'line_items', deal_ids.values(), failed_deals)
+    if failed is not None:
+        failed.update(slip for slip, deal_id in deal_ids.items() if str(deal_id) in failed_deals)
+    return {
+        slip: [{"id": line_item_id} for line_item_id in associated.get(str(deal_id), [])]
+        for slip, deal_id in deal_ids.items()
+    }
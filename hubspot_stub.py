@@ -0,0 +1,435 @@
+# coding: utf-8
+
+import argparse
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# 定数
+DEFAULT_PORT = 8089  # 待ち受けるポート
+BATCH_LIMIT = 100  # v3のbatch APIの1リクエストあたりの上限
+SEARCH_PAGE_LIMIT = 200  # search APIの1ページあたりの上限
+LIST_PAGE_LIMIT = 100  # v3のlist APIの1ページあたりの上限
+ASSOCIATION_PAGE_LIMIT = 500  # v4の関連付けの1ページあたりの上限
+
+# 検索や idProperty で使うため索引を持つプロパティ
+INDEXED_PROPERTIES = {
+    'deals': ['no_____'],
+    'products': ['shouhin_code'],
+    'line_items': ['bugyo_denpyo_no'],
+    'companies': ['bugyo_tokuisaki_code_unique'],
+}
+# 関連付けの逆方向のタイプID（ここにないタイプIDは逆方向も同じIDとして扱う）
+INVERSE_TYPE_IDS = {20: 19, 19: 20}
+
+# スタブの動作設定（遅延・レート制限・429・部分的な失敗）
+class StubConfig:
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit=0, rate_window=10.0, throttle_rate=0.0,
+                 failure_rate=0.0, keep_properties=None, seed=None):
+        self.latency = latency  # 1リクエストあたりの遅延（秒）
+        self.jitter = jitter  # 遅延に加えるばらつきの最大値（秒）
+        self.rate_limit = rate_limit  # rate_window秒あたりのリクエスト上限（0は無制限）
+        self.rate_window = rate_window  # レート制限の単位時間（秒）
+        self.throttle_rate = throttle_rate  # レート制限とは別にランダムに429を返す割合
+        self.failure_rate = failure_rate  # batch create/update/upsert の入力ごとにエラーにする割合（207を返す）
+        self.keep_properties = set(keep_properties) if keep_properties else None  # 保存するプロパティ（Noneはすべて、大量件数のベンチマーク用）
+        self.random = random.Random(seed)
+
+# HubSpotのオブジェクトと関連付けをメモリに保持するストア
+class StubStore:
+    def __init__(self, config):
+        self.config = config
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1000)
+        self.objects = {}  # {オブジェクトタイプ: {ID: オブジェクト}}
+        self.archived = {}  # {オブジェクトタイプ: {ID: アーカイブしたオブジェクト}}
+        self.indexes = {}  # {(オブジェクトタイプ, プロパティ): {値: set(ID)}}
+        self.associations = {}  # {(元のタイプ, 先のタイプ): {元のID: {先のID: set(タイプID)}}}
+        self.requests = deque()  # レート制限の判定に使う直近のリクエスト時刻
+        self.stats = Counter()  # エンドポイントごとのリクエスト数
+
+    def _now(self):
+        return datetime.now(timezone.utc).isoformat().replace('+00:00', 'Z')
+
+    def _index(self, object_type, name):
+        return self.indexes.setdefault((object_type, name), {})
+
+    def _store_properties(self, object_type, properties):
+        keep = self.config.keep_properties
+        if keep is None:
+            return dict(properties)
+        keep = keep | set(INDEXED_PROPERTIES.get(object_type, []))
+        return {name: value for name, value in properties.items() if name in keep}
+
+    def _set_properties(self, object_type, obj, properties):
+        for name in INDEXED_PROPERTIES.get(object_type, []):
+            if name in properties:
+                old = obj['properties'].get(name)
+                if old not in (None, ''):
+                    self._index(object_type, name).get(str(old), set()).discard(obj['id'])
+                if properties[name] not in (None, ''):
+                    self._index(object_type, name).setdefault(str(properties[name]), set()).add(obj['id'])
+        obj['properties'].update(self._store_properties(object_type, properties))
+        obj['updatedAt'] = self._now()
+        obj['properties']['hs_lastmodifieddate'] = obj['updatedAt']
+
+    def create(self, object_type, properties):
+        now = self._now()
+        obj = {"id": str(next(self.ids)), "properties": {}, "createdAt": now, "updatedAt": now, "archived": False}
+        self._set_properties(object_type, obj, properties)
+        self.objects.setdefault(object_type, {})[obj['id']] = obj
+        return obj
+
+    def find(self, object_type, object_id, id_property=None):
+        if id_property and id_property != 'hs_object_id':
+            ids = self._index(object_type, id_property).get(str(object_id)) if id_property in INDEXED_PROPERTIES.get(object_type, []) else None
+            if ids is None:
+                ids = {obj['id'] for obj in self.objects.get(object_type, {}).values() if str(obj['properties'].get(id_property)) == str(object_id)}
+            object_id = next(iter(ids), None)
+        return self.objects.get(object_type, {}).get(str(object_id))
+
+    def archive(self, object_type, object_id):
+        obj = self.objects.get(object_type, {}).pop(str(object_id), None)
+        if obj is None:
+            return
+        obj.update(archived=True, archivedAt=self._now())
+        self.archived.setdefault(object_type, {})[obj['id']] = obj
+        for name in INDEXED_PROPERTIES.get(object_type, []):
+            value = obj['properties'].get(name)
+            if value not in (None, ''):
+                self._index(object_type, name).get(str(value), set()).discard(obj['id'])
+        # 関連付けは両方向に持っているため、逆方向から自分を外してから自分の関連付けを消す
+        for (from_type, to_type), links in list(self.associations.items()):
+            if from_type != object_type:
+                continue
+            for to_id in links.pop(obj['id'], {}):
+                self.associations.get((to_type, from_type), {}).get(to_id, {}).pop(obj['id'], None)
+
+    def associate(self, from_type, from_id, to_type, to_id, type_ids):
+        for type_id in type_ids:
+            self.associations.setdefault((from_type, to_type), {}).setdefault(str(from_id), {}).setdefault(str(to_id), set()).add(type_id)
+            inverse = INVERSE_TYPE_IDS.get(type_id, type_id)
+            self.associations.setdefault((to_type, from_type), {}).setdefault(str(to_id), {}).setdefault(str(from_id), set()).add(inverse)
+
+    def dissociate(self, from_type, from_id, to_type, to_id, type_ids=None):
+        for (a_type, a_id, b_type, b_id, ids) in [
+            (from_type, from_id, to_type, to_id, type_ids),
+            (to_type, to_id, from_type, from_id, [INVERSE_TYPE_IDS.get(t, t) for t in type_ids] if type_ids else None),
+        ]:
+            targets = self.associations.get((a_type, b_type), {}).get(str(a_id), {})
+            if ids is None:
+                targets.pop(str(b_id), None)
+            elif str(b_id) in targets:
+                targets[str(b_id)] -= set(ids)
+                if not targets[str(b_id)]:
+                    targets.pop(str(b_id))
+
+    def links(self, from_type, from_id, to_type):
+        targets = self.associations.get((from_type, to_type), {}).get(str(from_id), {})
+        return [
+            {"toObjectId": int(to_id) if to_id.isdigit() else to_id,
+             "associationTypes": [{"category": "HUBSPOT_DEFINED" if type_id in INVERSE_TYPE_IDS else "USER_DEFINED", "typeId": type_id, "label": None} for type_id in sorted(type_ids)]}
+            for to_id, type_ids in targets.items()
+        ]
+
+    def search(self, object_type, filter_groups):
+        objects = self.objects.get(object_type, {})
+        if not filter_groups:
+            return list(objects.values())
+        matched = {}
+        for group in filter_groups:
+            candidates = None
+            filters = group.get('filters', [])
+            for flt in filters:
+                name = flt.get('propertyName')
+                if flt.get('operator') in ('EQ', 'IN') and name in INDEXED_PROPERTIES.get(object_type, []):
+                    values = flt.get('values') if flt.get('operator') == 'IN' else [flt.get('value')]
+                    index = self._index(object_type, name)
+                    candidates = {object_id for value in values for object_id in index.get(str(value), set())}
+                    break
+            pool = (objects.get(object_id) for object_id in candidates) if candidates is not None else objects.values()
+            for obj in pool:
+                if obj and all(_match(obj, flt) for flt in filters):
+                    matched[obj['id']] = obj
+        return sorted(matched.values(), key=lambda obj: int(obj['id']))
+
+# 1つのフィルターに一致するか判定する関数
+def _match(obj, flt):
+    value = obj['properties'].get(flt.get('propertyName'))
+    operator = flt.get('operator')
+    if operator == 'EQ':
+        return str(value) == str(flt.get('value'))
+    if operator == 'IN':
+        return str(value) in {str(v) for v in flt.get('values', [])}
+    if operator == 'HAS_PROPERTY':
+        return value not in (None, '')
+    if operator in ('GTE', 'LTE', 'GT', 'LT'):
+        if value in (None, ''):
+            return False
+        left = _as_millis(value)
+        right = _as_millis(flt.get('value'))
+        return {'GTE': left >= right, 'LTE': left <= right, 'GT': left > right, 'LT': left < right}[operator]
+    return True
+
+# 日時の文字列またはミリ秒をミリ秒に揃える関数
+def _as_millis(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return datetime.fromisoformat(str(value).replace('Z', '+00:00')).timestamp() * 1000
+
+# プロパティを絞り込んだオブジェクトを返す関数
+def _view(obj, properties=None, new=None):
+    view = dict(obj)
+    if properties is not None:
+        view['properties'] = {name: obj['properties'].get(name) for name in properties}
+    if new is not None:
+        view['new'] = new
+    return view
+
+# HubSpot APIの一部を真似るリクエストハンドラー
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'  # keep-aliveを有効にする
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=None, headers=None):
+        data = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, str(value))
+        self.end_headers()
+        self.wfile.write(data)
+
+    # レート制限と遅延を適用し、429を返した場合はFalseを返す
+    def _throttle(self, endpoint):
+        store = self.server.store
+        config = store.config
+        now = time.monotonic()
+        with store.lock:
+            store.stats[endpoint] += 1
+            while store.requests and store.requests[0] <= now - config.rate_window:
+                store.requests.popleft()
+            remaining = config.rate_limit - len(store.requests) - 1 if config.rate_limit else None
+            limited = config.rate_limit and remaining < 0
+            throttled = limited or config.random.random() < config.throttle_rate
+            if not throttled:
+                store.requests.append(now)
+        headers = {}
+        if config.rate_limit:
+            headers = {
+                'X-HubSpot-RateLimit-Max': config.rate_limit,
+                'X-HubSpot-RateLimit-Remaining': max(remaining, 0),
+                'X-HubSpot-RateLimit-Interval-Milliseconds': int(config.rate_window * 1000),
+            }
+        if throttled:
+            with store.lock:
+                store.stats['429'] += 1
+            retry_after = max(store.requests[0] + config.rate_window - now, 0.1) if limited and store.requests else 1
+            self._send(429, {"status": "error", "category": "RATE_LIMITS", "message": "You have reached your secondly limit."},
+                       {**headers, 'Retry-After': round(retry_after, 2)})
+            return False
+        delay = config.latency + config.random.uniform(0, config.jitter)
+        if delay:
+            time.sleep(delay)
+        self.rate_headers = headers
+        return True
+
+    def _body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        return json.loads(self.rfile.read(length) or b'{}') if length else {}
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {name: values[-1] for name, values in parse_qs(url.query).items()}
+        if url.path == '/__stats':
+            return self._send(200, {"requests": dict(self.server.store.stats)})
+        endpoint = 'GET ' + re.sub(r'/\d+(?=/|$)', '/{id}', url.path)
+        if not self._throttle(endpoint):
+            return
+        store = self.server.store
+        match = re.fullmatch(r'/crm/v3/objects/(\w+)', url.path)
+        if match:
+            with store.lock:
+                source = store.archived if params.get('archived') == 'true' else store.objects
+                objects = sorted(source.get(match.group(1), {}).values(), key=lambda obj: int(obj['id']))
+            properties = params['properties'].split(',') if params.get('properties') else None
+            return self._send(200, _page(objects, params.get('after'), min(int(params.get('limit', 10)), LIST_PAGE_LIMIT),
+                                         lambda obj: _view(obj, properties)), self.rate_headers)
+        self._send(404, {"status": "error", "message": f"Unknown endpoint: {url.path}"})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        body = self._body()
+        if url.path == '/__reset':
+            self.server.store = StubStore(self.server.store.config)
+            return self._send(204)
+        endpoint = 'POST ' + url.path
+        if not self._throttle(endpoint):
+            return
+        store = self.server.store
+        inputs = body.get('inputs', [])
+        match = re.fullmatch(r'/crm/v3/objects/(\w+)/batch/(create|update|upsert|read|archive)', url.path)
+        if match:
+            if len(inputs) > BATCH_LIMIT:
+                return self._send(400, {"status": "error", "category": "VALIDATION_ERROR", "message": f"Batch size {len(inputs)} exceeds {BATCH_LIMIT}"})
+            return self._batch(store, match.group(1), match.group(2), body, inputs)
+        match = re.fullmatch(r'/crm/v3/objects/(\w+)/search', url.path)
+        if match:
+            with store.lock:
+                objects = store.search(match.group(1), body.get('filterGroups', []))
+            page = _page(objects, body.get('after'), min(int(body.get('limit', 10)), SEARCH_PAGE_LIMIT),
+                         lambda obj: _view(obj, body.get('properties') or None))
+            page['total'] = len(objects)
+            return self._send(200, page, self.rate_headers)
+        match = re.fullmatch(r'/crm/v4/associations/(\w+)/(\w+)/batch/(read|create|archive|labels/archive)', url.path)
+        if match:
+            return self._associations(store, match.group(1), match.group(2), match.group(3), inputs)
+        self._send(404, {"status": "error", "message": f"Unknown endpoint: {url.path}"})
+
+    # v3の batch create/update/upsert/read/archive を処理する
+    def _batch(self, store, object_type, action, body, inputs):
+        config = store.config
+        results, errors = [], []
+        with store.lock:
+            for index, item in enumerate(inputs):
+                if action in ('create', 'update', 'upsert') and config.random.random() < config.failure_rate:
+                    trace_id = item.get('objectWriteTraceId')
+                    errors.append({
+                        "status": "error", "category": "VALIDATION_ERROR", "message": "Simulated failure",
+                        "context": {"objectWriteTraceId": [trace_id]} if trace_id else {"index": [str(index)]},
+                    })
+                    continue
+                if action == 'create':
+                    # HubSpotと同じく、関連付け先のオブジェクトが存在しない入力はエラーにする
+                    missing = [association['to']['id'] for association in item.get('associations', [])
+                               if store.find(_association_target(association), association['to']['id']) is None]
+                    if missing:
+                        trace_id = item.get('objectWriteTraceId')
+                        errors.append({
+                            "status": "error", "category": "OBJECT_NOT_FOUND", "message": f"Association target not found: {missing}",
+                            "context": {"objectWriteTraceId": [trace_id]} if trace_id else {"index": [str(index)]},
+                        })
+                        continue
+                    obj = store.create(object_type, item.get('properties', {}))
+                    for association in item.get('associations', []):
+                        store.associate(object_type, obj['id'], _association_target(association),
+                                        association['to']['id'], [t['associationTypeId'] for t in association.get('types', [])])
+                    results.append(_view(obj))
+                elif action in ('update', 'upsert'):
+                    obj = store.find(object_type, item.get('id'), item.get('idProperty'))
+                    if obj is None and action == 'upsert':
+                        obj = store.create(object_type, {**item.get('properties', {}), item['idProperty']: item['id']})
+                        results.append(_view(obj, new=True))
+                    elif obj is None:
+                        errors.append({"status": "error", "category": "OBJECT_NOT_FOUND", "message": "Object not found",
+                                       "context": {"ids": [str(item.get('id'))]}})
+                    else:
+                        store._set_properties(object_type, obj, item.get('properties', {}))
+                        # HubSpotと同じく、updateの応答には書き込んだプロパティだけを返す
+                        results.append(_view(obj, new=False) if action == 'upsert' else _view(obj, list(item.get('properties', {}))))
+                elif action == 'read':
+                    obj = store.find(object_type, item.get('id'), body.get('idProperty'))
+                    if obj is None:
+                        errors.append({"status": "error", "category": "OBJECT_NOT_FOUND", "message": "Object not found",
+                                       "context": {"ids": [str(item.get('id'))]}})
+                    else:
+                        results.append(_view(obj, body.get('properties') or None))
+                else:
+                    store.archive(object_type, item.get('id'))
+        if action == 'archive':
+            return self._send(204, None, self.rate_headers)
+        response = {"status": "COMPLETE", "results": results}
+        if errors:
+            response.update({"errors": errors, "numErrors": len(errors)})
+        status = 207 if errors else (201 if action == 'create' else 200)
+        self._send(status, response, self.rate_headers)
+
+    # v4の関連付けの batch read/create/archive/labels/archive を処理する
+    def _associations(self, store, from_type, to_type, action, inputs):
+        results = []
+        with store.lock:
+            for item in inputs:
+                from_id = str(item['from']['id'] if 'from' in item else item['id'])
+                if action == 'read':
+                    links = store.links(from_type, from_id, to_type)
+                    offset = int(item.get('after') or 0)
+                    result = {"from": {"id": from_id}, "to": links[offset:offset + ASSOCIATION_PAGE_LIMIT]}
+                    if offset + ASSOCIATION_PAGE_LIMIT < len(links):
+                        result["paging"] = {"next": {"after": str(offset + ASSOCIATION_PAGE_LIMIT)}}
+                    results.append(result)
+                elif action == 'create':
+                    store.associate(from_type, from_id, to_type, item['to']['id'], [t['associationTypeId'] for t in item.get('types', [])])
+                    results.append({"fromObjectId": from_id, "toObjectId": item['to']['id'], "labels": []})
+                elif action == 'archive':
+                    for to in item.get('to', []):
+                        store.dissociate(from_type, from_id, to_type, to['id'])
+                else:
+                    store.dissociate(from_type, from_id, to_type, item['to']['id'], [t['associationTypeId'] for t in item.get('types', [])])
+        if action in ('archive', 'labels/archive'):
+            return self._send(204, None, self.rate_headers)
+        self._send(201 if action == 'create' else 200, {"status": "COMPLETE", "results": results}, self.rate_headers)
+
+# v3の作成時の associations から関連付け先のオブジェクトタイプを判定する関数（商品項目→取引のみ対応）
+def _association_target(association):
+    type_ids = [t['associationTypeId'] for t in association.get('types', [])]
+    return 'deals' if 20 in type_ids else association.get('toObjectType', 'deals')
+
+# オフセットのカーソルでページを切り出す関数
+def _page(items, after, limit, view=lambda item: item):
+    offset = int(after or 0)
+    page = {"results": [view(item) for item in items[offset:offset + limit]]}
+    if offset + limit < len(items):
+        page["paging"] = {"next": {"after": str(offset + limit)}}
+    return page
+
+# スタブサーバーを作成する関数（port=0 の場合は空いているポートを使う）
+def create_server(config=None, host='127.0.0.1', port=DEFAULT_PORT):
+    server = ThreadingHTTPServer((host, port), StubHandler)
+    server.daemon_threads = True
+    server.store = StubStore(config or StubConfig())
+    return server
+
+# 別スレッドでスタブサーバーを起動し、(サーバー, ベースURL) を返す関数
+def start_server(config=None, host='127.0.0.1', port=0):
+    server = create_server(config, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_port}"
+
+# メイン関数（HUBSPOT_API_BASE=http://127.0.0.1:8089 を設定して各スクリプトを実行する）
+def main():
+    parser = argparse.ArgumentParser(description='HubSpot API のローカルスタブ')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--latency', type=float, default=0.0, help='1リクエストあたりの遅延（秒）')
+    parser.add_argument('--jitter', type=float, default=0.0, help='遅延のばらつき（秒）')
+    parser.add_argument('--rate-limit', type=int, default=0, help='rate-window秒あたりのリクエスト上限（0は無制限）')
+    parser.add_argument('--rate-window', type=float, default=10.0)
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='ランダムに429を返す割合')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='入力ごとにエラーにする割合')
+    parser.add_argument('--keep-properties', default='', help='保存するプロパティ（カンマ区切り、省略時はすべて）')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+    keep_properties = [name for name in args.keep_properties.split(',') if name] or None
+    config = StubConfig(args.latency, args.jitter, args.rate_limit, args.rate_window, args.throttle_rate, args.failure_rate,
+                        keep_properties, args.seed)
+    server = create_server(config, args.host, args.port)
+    print(f"HubSpot stub listening on http://{args.host}:{server.server_port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+# 実行
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+# coding: utf-8
+
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+from snapshot_store import SNAPSHOT_DB, SNAPSHOT_KINDS, SQLITE_MAX_VARIABLES
+
+# キー（伝票No.など）とHubSpotのオブジェクトIDの対応を保存するローカルの索引
+class IdRegistry:
+    def __init__(self, db_path=SNAPSHOT_DB):
+        self.db_path = db_path
+        self.lock = threading.Lock()  # 複数スレッドから使えるように接続を排他制御する
+        self.conn = sqlite3.connect(db_path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS object_ids ("
+            " kind TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " object_id TEXT NOT NULL,"
+            " updated_at TEXT NOT NULL,"
+            " PRIMARY KEY (kind, key))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS index_state ("
+            " kind TEXT PRIMARY KEY,"
+            " refreshed_at INTEGER NOT NULL)"  # 最後に索引を更新した時刻（UNIXミリ秒）
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # 指定したキーのオブジェクトIDを取得する（登録されていないキーは含まない）
+    def get_ids(self, kind, keys):
+        keys = list(dict.fromkeys(str(key) for key in keys))
+        ids = {}
+        with self.lock:
+            for i in range(0, len(keys), SQLITE_MAX_VARIABLES):
+                chunk = keys[i:i + SQLITE_MAX_VARIABLES]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self.conn.execute(
+                    f"SELECT key, object_id FROM object_ids WHERE kind = ? AND key IN ({placeholders})",
+                    [kind, *chunk],
+                )
+                ids.update(rows)
+        return ids
+
+    # キーとオブジェクトIDの対応を記録する
+    def record(self, kind, items):
+        updated_at = datetime.now(timezone.utc).isoformat()
+        rows = [(kind, str(key), str(object_id), updated_at) for key, object_id in items if key and object_id]
+        with self.lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO object_ids (kind, key, object_id, updated_at) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self.conn.commit()
+
+    # HubSpotのバッチ作成の応答の results からキーとオブジェクトIDを記録する
+    def record_results(self, kind, results):
+        key_property = SNAPSHOT_KINDS[kind]['key_property']
+        self.record(kind, [(result.get('properties', {}).get(key_property), result.get('id')) for result in results])
+
+    # 削除されたオブジェクトなど、使えなくなったキーを削除する
+    def forget(self, kind, keys):
+        with self.lock:
+            self.conn.executemany(
+                "DELETE FROM object_ids WHERE kind = ? AND key = ?",
+                [(kind, str(key)) for key in keys],
+            )
+            self.conn.commit()
+
+    # オブジェクトIDで対応を削除する（キーが変わったオブジェクトの古いキーを消す場合に使う）
+    def forget_ids(self, kind, object_ids):
+        with self.lock:
+            self.conn.executemany(
+                "DELETE FROM object_ids WHERE kind = ? AND object_id = ?",
+                [(kind, str(object_id)) for object_id in object_ids],
+            )
+            self.conn.commit()
+
+    # 種別の対応をすべて削除する（索引を作り直す場合に使う）
+    def clear(self, kind):
+        with self.lock:
+            self.conn.execute("DELETE FROM object_ids WHERE kind = ?", (kind,))
+            self.conn.execute("DELETE FROM index_state WHERE kind = ?", (kind,))
+            self.conn.commit()
+
+    # 索引を最後に更新した時刻（UNIXミリ秒）を取得する（未作成の場合はNone）
+    def get_refreshed_at(self, kind):
+        with self.lock:
+            row = self.conn.execute("SELECT refreshed_at FROM index_state WHERE kind = ?", (kind,)).fetchone()
+        return row[0] if row else None
+
+    # 索引を更新した時刻（UNIXミリ秒）を記録する
+    def set_refreshed_at(self, kind, refreshed_at):
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO index_state (kind, refreshed_at) VALUES (?, ?)",
+                (kind, int(refreshed_at)),
+            )
+            self.conn.commit()
@@ -0,0 +1,144 @@
+# coding: utf-8
+
+from hubspot_lookup import (
+    LINE_ITEM_SLIP_PROPERTY, find_line_items_by_deals, is_stale_deal_error, read_objects, refresh_deal_ids, resolve_deal_ids,
+    search_line_items_by_slip,
+)
+from product_index import PRODUCT_ID_PROPERTY, resolve_product_ids, set_product_ids
+from schemas import LINE_ITEM_SCHEMA, build_line_item_record
+from transform_engine import changed_properties
+
+# 定数
+BATCH_SIZE = 100  # 一度に送信するバッチのサイズ
+HASH_PROPERTY = 'sha512_contents'  # 商品項目の内容を比較するプロパティ
+
+# 既存の商品項目を伝票No.ごとの (商品項目ID, sha512_contents) のリストと、{商品項目ID: 現在のプロパティ}、
+# 既存の商品項目を読み込めなかった伝票No.のセットで取得する関数（deal_ids は find_line_items_by_deals と同じ）
+def fetch_existing_line_items(client, registry, slip_numbers, discovery='associations', deal_ids=None):
+    properties = LINE_ITEM_SCHEMA.target_properties + [PRODUCT_ID_PROPERTY]  # 差分だけを更新するため、送信するプロパティの現在の値も読む
+    unreadable = set()
+    if discovery == 'search':
+        found = search_line_items_by_slip(client, slip_numbers, properties, unreadable)
+        objects = [item for items in found.values() for item in items]
+    else:
+        found = find_line_items_by_deals(client, registry, slip_numbers, unreadable, deal_ids)
+        ids = [item['id'] for items in found.values() for item in items]
+        failed_ids = set()
+        objects = read_objects(client, 'line_items', ids, properties + [LINE_ITEM_SLIP_PROPERTY], failed_ids)
+        unreadable.update(slip for slip, items in found.items() if any(item['id'] in failed_ids for item in items))
+    current = {item['id']: item['properties'] for item in objects}
+    existing = {
+        slip: [(item['id'], current.get(item['id'], {}).get(HASH_PROPERTY) or '') for item in items]
+        for slip, items in found.items()
+    }
+    return existing, current, unreadable
+
+# 1伝票分の既存の商品項目と新しい明細を比較し、(更新, アーカイブ, 作成) を返す関数
+def plan_slip(existing, incoming):
+    unmatched = {}  # sha512_contentsごとの、まだ対応する明細がない既存の商品項目ID
+    for line_item_id, digest in existing:
+        unmatched.setdefault(digest, []).append(line_item_id)
+    new_rows = []
+    for digest, properties in incoming:
+        if unmatched.get(digest):
+            unmatched[digest].pop(0)  # 内容が同じ商品項目はそのまま残す
+        else:
+            new_rows.append(properties)
+    leftover = {line_item_id for ids in unmatched.values() for line_item_id in ids}
+    stale_ids = [line_item_id for line_item_id, digest in existing if line_item_id in leftover]
+    # 残った既存の商品項目は新しい明細で上書きし、余った分だけアーカイブまたは作成する
+    updates = list(zip(stale_ids, new_rows))
+    return updates, stale_ids[len(updates):], new_rows[len(updates):]
+
+# 取引IDが原因で作成できなかった商品項目の取引IDを引き直し、作り直した (伝票No., 入力) のリストを返す関数
+# failures は (送信できなかった入力, エラー) のリスト。引き直しても取引IDが見つからない伝票の入力は返さない
+def rebuild_stale_line_items(client, registry, failures):
+    stale = [item for item, error in failures if is_stale_deal_error(error)]
+    if not stale:
+        return []
+    slips = {item["properties"].get(LINE_ITEM_SLIP_PROPERTY) for item in stale}
+    print(f"Deal IDs could not be used for {len(slips)} slips. Looking them up again...")
+    deal_ids = refresh_deal_ids(client, registry, slips)
+    return [
+        (item["properties"][LINE_ITEM_SLIP_PROPERTY], build_line_item_record(item["properties"], deal_ids[item["properties"][LINE_ITEM_SLIP_PROPERTY]]))
+        for item in stale if item["properties"].get(LINE_ITEM_SLIP_PROPERTY) in deal_ids
+    ]
+
+# (伝票No., 入力) のリストをバッチに分けて同時送信し、失敗した伝票No.を返す関数
+# recovery を指定した場合は失敗した入力だけを再送し、それでも失敗した入力の伝票No.だけを返す
+# failures にリストを指定した場合は、送信できなかった (入力, エラー) を追加する
+def _send(client, path, pairs, label, recovery=None, failures=None):
+    chunks = [pairs[i:i + BATCH_SIZE] for i in range(0, len(pairs), BATCH_SIZE)]
+    failed_slips = set()
+    responses = client.send_batches(path, ([line_item for _, line_item in chunk] for chunk in chunks),
+                                    send=recovery.send if recovery else None)
+    for batch_number, (chunk, (batch, response)) in enumerate(zip(chunks, responses), start=1):
+        if 'failedInputs' in response:
+            failed = {id(line_item) for line_item in response['failedInputs']}
+            print(f"[{label}] Batch {batch_number}: {len(failed)} inputs failed")
+            failed_slips.update(slip for slip, line_item in chunk if id(line_item) in failed)
+            if failures is not None:
+                failures.extend(zip(response['failedInputs'], response.get('errors', [])))
+        elif response.get('status') not in (None, 'COMPLETE') or response.get('errors'):
+            print(f"[{label}] Batch {batch_number} failed: {response}")
+            failed_slips.update(slip for slip, _ in chunk)
+    return failed_slips
+
+# 既存の商品項目と新しい明細を比較し、差分だけをHubSpotに反映する関数
+# refresh_stale=True の場合、索引の取引IDが使えなかった伝票は取引IDを引き直して1回だけ差分を取り直す
+# deal_ids に {伝票No.: 取引ID} を指定した場合は、取引IDを引かずにその対応を使う
+def reconcile_line_items(client, registry, line_df, discovery='associations', invalid_report=None, recovery=None, refresh_stale=True, deal_ids=None):
+    slips = line_df["伝票No."].tolist()
+    properties = LINE_ITEM_SCHEMA.build_properties(line_df, invalid_report)
+    set_product_ids(properties, resolve_product_ids(client, registry, properties))
+    incoming = {}
+    for slip, digest, line_item_properties in zip(slips, line_df[HASH_PROPERTY].tolist(), properties):
+        incoming.setdefault(slip, []).append((digest, line_item_properties))
+
+    if deal_ids is None:
+        deal_ids = resolve_deal_ids(client, registry, incoming.keys())
+    # 既存の商品項目の読み込みと作成で同じ取引IDを使う
+    existing, current, unreadable = fetch_existing_line_items(client, registry, list(incoming), discovery, deal_ids)
+    if unreadable:
+        # 既存の商品項目が分からない伝票は、二重に作成したり誤ってアーカイブしたりしないよう書き込まない
+        print(f"Could not read existing line items for {len(unreadable)} slips. Skipping: {sorted(unreadable)}")
+
+    updates, archives, creates = [], [], []
+    failed_slips = set(unreadable)
+    unchanged = 0
+    for slip, rows in incoming.items():
+        if slip not in deal_ids:
+            print(f"Deal ID not found for deal number: {slip}")
+            failed_slips.add(slip)
+            continue
+        if slip in unreadable:
+            continue
+        slip_updates, slip_archives, slip_creates = plan_slip(existing.get(slip, []), rows)
+        unchanged += len(rows) - len(slip_updates) - len(slip_creates)
+        # 上書きする商品項目は現在の値と比べ、変わったプロパティだけを送る
+        for line_item_id, props in slip_updates:
+            changed = changed_properties(props, current[line_item_id]) if line_item_id in current else props
+            if changed:
+                updates.append((slip, {"id": line_item_id, "properties": changed}))
+        archives.extend((slip, {"id": line_item_id}) for line_item_id in slip_archives)
+        creates.extend((slip, build_line_item_record(props, deal_ids[slip])) for props in slip_creates)
+
+    print(f"Line items: {unchanged} unchanged, {len(updates)} to update "
+          f"({sum(len(item['properties']) for _, item in updates)} properties), {len(archives)} to archive, {len(creates)} to create")
+    failed_slips |= _send(client, '/crm/v3/objects/line_items/batch/archive', archives, 'archive')
+    failed_slips |= _send(client, '/crm/v3/objects/line_items/batch/update', updates, 'update', recovery)
+    create_failures = []
+    failed_slips |= _send(client, '/crm/v3/objects/line_items/batch/create', creates, 'create', recovery, create_failures)
+
+    # 既存の商品項目も古い取引IDから読んでいるため、作成だけを再送せずに伝票ごと差分を取り直す
+    stale_slips = {item["properties"].get(LINE_ITEM_SLIP_PROPERTY) for item, error in create_failures if is_stale_deal_error(error)}
+    if stale_slips and refresh_stale:
+        print(f"Deal IDs could not be used for {len(stale_slips)} slips. Looking them up again...")
+        # 使えなかった伝票の取引IDだけを引き直し、ほかの伝票の取引IDはそのまま使う
+        refreshed = refresh_deal_ids(client, registry, stale_slips)
+        deal_ids = {slip: deal_id for slip, deal_id in deal_ids.items() if slip not in stale_slips}
+        deal_ids.update(refreshed)
+        stale_df = line_df[line_df["伝票No."].isin(stale_slips)]
+        failed_slips = (failed_slips - stale_slips) | reconcile_line_items(
+            client, registry, stale_df, discovery, None, recovery, refresh_stale=False, deal_ids=deal_ids)
+    return failed_slips
@@ -0,0 +1,187 @@
+# coding: utf-8
+
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+
+# 定数
+LATENCY_BUCKETS = [0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60]  # レイテンシのヒストグラムの区切り（秒）
+RATE_LIMIT_SAMPLES = 1000  # 保存するレート制限ヘッダーの時系列の件数（古いものから捨てる）
+RATE_LIMIT_HEADERS = {  # 記録する X-HubSpot-RateLimit-* ヘッダーとレポート上の名前
+    'X-HubSpot-RateLimit-Max': 'max',
+    'X-HubSpot-RateLimit-Remaining': 'remaining',
+    'X-HubSpot-RateLimit-Interval-Milliseconds': 'interval_ms',
+    'X-HubSpot-RateLimit-Secondly': 'secondly',
+    'X-HubSpot-RateLimit-Secondly-Remaining': 'secondly_remaining',
+    'X-HubSpot-RateLimit-Daily': 'daily',
+    'X-HubSpot-RateLimit-Daily-Remaining': 'daily_remaining',
+}
+PROMETHEUS_DIR = os.getenv('PROMETHEUS_TEXTFILE_DIR')  # node_exporterのtextfileディレクトリ（未設定の場合はレポートと同じ場所）
+
+# パスのIDやクエリを除いてエンドポイント名にする関数
+def endpoint_name(method, path):
+    path = path.split('?')[0]
+    path = re.sub(r'^https?://[^/]+', '', path)
+    path = re.sub(r'/\d+(?=/|$)', '/{id}', path)
+    return f"{method} {path}"
+
+# 値のリストからパーセンタイルを求める関数（最近傍法）
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, math.ceil(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+# ステージの処理時間・行数とHubSpot APIのレイテンシ・レート制限を集計するクラス（複数スレッドから使える）
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started_at = time.time()
+        self.stages = {}  # {ステージ名: {'seconds': 合計秒, 'rows': 行数, 'calls': 回数}}
+        self.latencies = {}  # {エンドポイント: [秒]}
+        self.statuses = Counter()  # {(エンドポイント, ステータス): 件数}
+        self.rate_limits = deque(maxlen=RATE_LIMIT_SAMPLES)  # レート制限ヘッダーの時系列
+
+    def _stage(self, name):
+        return self.stages.setdefault(name, {'seconds': 0.0, 'rows': 0, 'calls': 0})
+
+    # ステージの処理時間を計測する（with METRICS.stage('read', rows=len(df)): ...）
+    @contextmanager
+    def stage(self, name, rows=0):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            with self.lock:
+                stage = self._stage(name)
+                stage['seconds'] += elapsed
+                stage['rows'] += rows
+                stage['calls'] += 1
+
+    # ステージで処理した行数を加算する
+    def add_rows(self, name, rows):
+        with self.lock:
+            self._stage(name)['rows'] += rows
+
+    # イテレーターの next() にかかった時間をステージの時間として計測するジェネレーター
+    def timed(self, name, iterable, count_rows=len):
+        iterator = iter(iterable)
+        while True:
+            with self.stage(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            if count_rows:
+                self.add_rows(name, count_rows(item))
+            yield item
+
+    # 1リクエストのレイテンシ・ステータス・レート制限ヘッダーを記録する
+    def observe_request(self, method, path, seconds, status_code, headers=None):
+        endpoint = endpoint_name(method, path)
+        sample = {}
+        for header, name in RATE_LIMIT_HEADERS.items():
+            value = (headers or {}).get(header)
+            if value is not None:
+                try:
+                    sample[name] = int(value)
+                except ValueError:
+                    pass
+        with self.lock:
+            self.latencies.setdefault(endpoint, []).append(seconds)
+            self.statuses[(endpoint, status_code)] += 1
+            if sample:
+                self.rate_limits.append({'time': round(time.time(), 3), 'endpoint': endpoint, **sample})
+
+    # 集計結果を辞書で返す
+    def report(self, run):
+        with self.lock:
+            stages = {
+                name: {**stage, 'seconds': round(stage['seconds'], 3),
+                       'rows_per_second': round(stage['rows'] / stage['seconds'], 1) if stage['seconds'] and stage['rows'] else None}
+                for name, stage in self.stages.items()
+            }
+            endpoints = {}
+            for endpoint, values in self.latencies.items():
+                ordered = sorted(values)
+                endpoints[endpoint] = {
+                    'count': len(ordered),
+                    'p50': percentile(ordered, 50), 'p95': percentile(ordered, 95), 'p99': percentile(ordered, 99),
+                    'max': ordered[-1],
+                    'buckets': [sum(1 for value in ordered if value <= bound) for bound in LATENCY_BUCKETS],
+                    'sum': sum(ordered),
+                    'statuses': {str(status): count for (name, status), count in self.statuses.items() if name == endpoint},
+                }
+            rate_limits = list(self.rate_limits)
+        minimum = {}
+        for sample in rate_limits:
+            for name, value in sample.items():
+                if name.endswith('remaining'):
+                    minimum[name] = min(minimum.get(name, value), value)
+        return {
+            'run': run,
+            'started_at': self.started_at,
+            'finished_at': time.time(),
+            'stages': stages,
+            'endpoints': endpoints,
+            'rate_limit': {'min': minimum, 'last': rate_limits[-1] if rate_limits else None, 'samples': rate_limits},
+        }
+
+    # JSONのレポートとPrometheusのtextfileを書き出し、JSONのパスを返す
+    def write_reports(self, directory, run):
+        report = self.report(run)
+        json_path = os.path.join(directory, f'metrics_{run}.json')
+        _atomic_write(json_path, json.dumps(report, ensure_ascii=False, indent=2))
+        _atomic_write(os.path.join(PROMETHEUS_DIR or directory, f'metrics_{run}.prom'), prometheus_text(report))
+        print(f"Metrics written to {json_path}")
+        return json_path
+
+# Prometheusのラベルの値をエスケープする関数
+def _label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+# レポートをPrometheusのtextfile形式に変換する関数
+def prometheus_text(report):
+    run = _label(report['run'])
+    lines = [
+        '# HELP hubspot_sync_last_run_timestamp_seconds Finish time of the last run.',
+        '# TYPE hubspot_sync_last_run_timestamp_seconds gauge',
+        f'hubspot_sync_last_run_timestamp_seconds{{run="{run}"}} {report["finished_at"]:.3f}',
+        '# HELP hubspot_sync_stage_seconds Wall time spent in each stage.',
+        '# TYPE hubspot_sync_stage_seconds gauge',
+    ]
+    lines += [f'hubspot_sync_stage_seconds{{run="{run}",stage="{_label(name)}"}} {stage["seconds"]}' for name, stage in report['stages'].items()]
+    lines += ['# HELP hubspot_sync_stage_rows Rows processed in each stage.', '# TYPE hubspot_sync_stage_rows gauge']
+    lines += [f'hubspot_sync_stage_rows{{run="{run}",stage="{_label(name)}"}} {stage["rows"]}' for name, stage in report['stages'].items()]
+    lines += ['# HELP hubspot_request_duration_seconds HubSpot API request latency.', '# TYPE hubspot_request_duration_seconds histogram']
+    for endpoint, stats in report['endpoints'].items():
+        labels = f'run="{run}",endpoint="{_label(endpoint)}"'
+        for bound, count in zip(LATENCY_BUCKETS, stats['buckets']):
+            lines.append(f'hubspot_request_duration_seconds_bucket{{{labels},le="{bound}"}} {count}')
+        lines.append(f'hubspot_request_duration_seconds_bucket{{{labels},le="+Inf"}} {stats["count"]}')
+        lines.append(f'hubspot_request_duration_seconds_sum{{{labels}}} {stats["sum"]:.6f}')
+        lines.append(f'hubspot_request_duration_seconds_count{{{labels}}} {stats["count"]}')
+    lines += ['# HELP hubspot_requests_total HubSpot API requests by status code.', '# TYPE hubspot_requests_total counter']
+    for endpoint, stats in report['endpoints'].items():
+        for status, count in stats['statuses'].items():
+            lines.append(f'hubspot_requests_total{{run="{run}",endpoint="{_label(endpoint)}",status="{status}"}} {count}')
+    lines += ['# HELP hubspot_ratelimit_remaining_min Lowest X-HubSpot-RateLimit-*-Remaining seen during the run.',
+              '# TYPE hubspot_ratelimit_remaining_min gauge']
+    lines += [f'hubspot_ratelimit_remaining_min{{run="{run}",window="{_label(name)}"}} {value}' for name, value in report['rate_limit']['min'].items()]
+    return '\n'.join(lines) + '\n'
+
+# 一時ファイルに書いてから置き換える関数（読み取り中のファイルが途中で切れないようにする）
+def _atomic_write(path, text):
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(text)
+    os.replace(temp_path, path)
+
+# プロセス全体で共有する集計
+METRICS = Metrics()
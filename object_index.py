@@ -0,0 +1,94 @@
+# coding: utf-8
+
+import time
+
+from date_convert import normalize_timestamp
+from hubspot_lookup import search_by_values
+from paginator import list_pages, search_pages
+
+# 定数
+INDEX_TTL = 60 * 60  # 索引をHubSpotと照合せずに使う時間（秒）。過ぎた場合は更新されたオブジェクトだけを取り込む
+SEARCH_RESULT_LIMIT = 10000  # search APIで取得できる結果の上限（超える場合は全件取り直す）
+MODIFIED_LOOKBACK = 5 * 60 * 1000  # 差分取得で前回の更新時刻から遡る幅（ミリ秒、反映の遅れ対策）
+
+# プロパティの値からオブジェクトIDを引くローカルの索引（IdRegistryの object_ids に kind の種別で保存する）
+class ObjectIndex:
+    def __init__(self, registry, object_type, property_name, kind, ttl=INDEX_TTL):
+        self.registry = registry
+        self.object_type = object_type
+        self.property_name = property_name
+        self.ttl = ttl
+        self.kind = kind
+
+    # オブジェクトの一覧または検索結果から (キー, オブジェクトID) を記録する
+    def _record(self, objects):
+        items = [(obj['properties'].get(self.property_name), obj['id']) for obj in objects]
+        self.registry.forget_ids(self.kind, [object_id for key, object_id in items])  # キーが変わったオブジェクトの古いキーを消す
+        self.registry.record(self.kind, items)
+        return sum(1 for key, object_id in items if key)
+
+    # すべてのオブジェクトをページングして索引を作り直す
+    def rebuild(self, client):
+        started_at = int(time.time() * 1000)
+        self.registry.clear(self.kind)
+        count = 0
+        # 次のページを裏で取得しながら、取得済みのページを索引に記録する
+        for page in list_pages(client, self.object_type, [self.property_name]):
+            count += self._record(page.get('results', []))
+        self.registry.set_refreshed_at(self.kind, started_at)
+        print(f"Index of {self.object_type} rebuilt: {count} {self.object_type}")
+
+    # 前回の更新以降に変更されたオブジェクトだけを取り込む（件数が多すぎる場合はFalseを返す）
+    def _refresh_modified(self, client, since):
+        started_at = int(time.time() * 1000)
+        body = {
+            "filterGroups": [{"filters": [
+                {"propertyName": "hs_lastmodifieddate", "operator": "GTE", "value": str(since - MODIFIED_LOOKBACK)}
+            ]}],
+            "sorts": [{"propertyName": "hs_lastmodifieddate", "direction": "ASCENDING"}],
+            "properties": [self.property_name],
+        }
+        count = 0
+        for page in search_pages(client, self.object_type, body):
+            if page.get('total', 0) > SEARCH_RESULT_LIMIT:
+                return False
+            count += self._record(page.get('results', []))
+        archived = self._forget_archived(client, since)
+        self.registry.set_refreshed_at(self.kind, started_at)
+        print(f"Index of {self.object_type} refreshed: {count} modified, {archived} archived {self.object_type}")
+        return True
+
+    # 前回の更新以降にアーカイブされたオブジェクトを索引から消し、件数を返す
+    # （search APIはアーカイブ済みを返さず、list APIはアーカイブ日時で絞り込めないため、アーカイブ済みをページングして比べる）
+    def _forget_archived(self, client, since):
+        object_ids = [
+            obj['id']
+            for page in list_pages(client, self.object_type, archived=True)
+            for obj in page.get('results', [])
+            if not obj.get('archivedAt') or int(normalize_timestamp(obj['archivedAt'])) >= since - MODIFIED_LOOKBACK
+        ]
+        self.registry.forget_ids(self.kind, object_ids)
+        return len(object_ids)
+
+    # TTLを過ぎていれば索引を更新する（未作成の場合や変更が多すぎる場合は作り直す）
+    def refresh(self, client, force=False):
+        refreshed_at = self.registry.get_refreshed_at(self.kind)
+        if refreshed_at is None or force:
+            self.rebuild(client)
+        elif time.time() * 1000 - refreshed_at > self.ttl * 1000:
+            if not self._refresh_modified(client, refreshed_at):
+                self.rebuild(client)
+
+    # キーからオブジェクトIDを引く（索引にないキーだけをsearch APIで検索して記録する）
+    # failed にセットを指定した場合は、検索に失敗したキーを追加する
+    def lookup(self, client, keys, failed=None):
+        keys = [str(key) for key in dict.fromkeys(keys) if key]
+        object_ids = self.registry.get_ids(self.kind, keys)
+        missing = [key for key in keys if key not in object_ids]
+        if missing:
+            found = search_by_values(client, self.object_type, self.property_name, missing, [self.property_name], failed)
+            self._record(found)
+            object_ids.update(self.registry.get_ids(self.kind, missing))
+        print(f"IDs of {self.object_type}: {len(keys) - len(missing)} from index, {len(missing)} searched, "
+              f"{len(keys) - len(object_ids)} not found")
+        return object_ids
@@ -0,0 +1,79 @@
+# coding: utf-8
+
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+# 定数
+SEARCH_PAGE_SIZE = 200  # search APIの1ページあたりの上限
+LIST_PAGE_SIZE = 100  # v3のlist APIの1ページあたりの上限
+ASSOCIATION_BATCH_SIZE = 1000  # v4の関連付け batch/read の1リクエストあたりの元のIDの上限
+PREFETCH = True  # Trueの場合は呼び出し側が処理している間に次のページを取得する
+
+# 応答から次のページのカーソルを取得する関数
+def next_after(page):
+    return page.get('paging', {}).get('next', {}).get('after')
+
+# fetch_page(after) でページを順に取得し、応答をそのまま返すジェネレーター
+# 呼び出し側がページを処理している間に次のページを裏で取得し、途中で止めた場合は先読みを破棄する
+def iter_pages(fetch_page, prefetch=PREFETCH):
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    try:
+        page = fetch_page(None)
+        while True:
+            after = next_after(page)
+            pending = executor.submit(fetch_page, after) if after and executor else None
+            yield page
+            if not after:
+                return
+            page = pending.result() if pending else fetch_page(after)
+    finally:
+        if executor:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+# ページの results を1件ずつ返すジェネレーター（max_items 件に達したら以降のページは取得しない）
+def iter_results(pages, max_items=None):
+    results = (item for page in pages for item in page.get('results', []))
+    return islice(results, max_items) if max_items is not None else results
+
+# 応答を確認してJSONを返す関数（失敗した場合は例外）
+def _json_or_raise(response, label):
+    if response.status_code != 200:
+        raise RuntimeError(f"Failed to {label}. Status code: {response.status_code}, Response: {response.text}")
+    return response.json()
+
+# search APIのページを返すジェネレーター（body には filterGroups や properties を指定する）
+def search_pages(client, object_type, body, prefetch=PREFETCH):
+    def fetch_page(after):
+        data = {**body, "limit": SEARCH_PAGE_SIZE}
+        if after:
+            data["after"] = after
+        return _json_or_raise(client.request('POST', f'/crm/v3/objects/{object_type}/search', data), f'search {object_type}')
+    return iter_pages(fetch_page, prefetch)
+
+# v3のlist APIのページを返すジェネレーター（archived=True の場合はアーカイブ済みのオブジェクトを返す）
+def list_pages(client, object_type, properties=None, prefetch=PREFETCH, archived=False):
+    def fetch_page(after):
+        params = {"limit": LIST_PAGE_SIZE, "archived": "true" if archived else "false"}
+        if properties:
+            params["properties"] = ','.join(properties)
+        if after:
+            params["after"] = after
+        return _json_or_raise(client.request('GET', f'/crm/v3/objects/{object_type}', params=params), f'list {object_type}')
+    return iter_pages(fetch_page, prefetch)
+
+# v4の関連付け batch/read の (バッチ, 応答) を送信順に返すジェネレーター（バッチは同時に送信する）
+# 関連付けが1ページに収まらなかった元のIDは、応答の after を付けて次の周でまとめて読む
+# 呼び出し側が途中で止めた場合は、以降のページを取得しない
+def association_pages(client, from_object_type, to_object_type, from_ids, batch_size=ASSOCIATION_BATCH_SIZE):
+    path = f'/crm/v4/associations/{from_object_type}/{to_object_type}/batch/read'
+    pending = [{"id": str(from_id)} for from_id in dict.fromkeys(from_ids)]
+    while pending:
+        batches = (pending[i:i + batch_size] for i in range(0, len(pending), batch_size))
+        next_pending = []
+        for batch, page in client.send_batches(path, batches):
+            for item in page.get('results', []):
+                after = next_after(item)
+                if after:
+                    next_pending.append({"id": str(item['from']['id']), "after": after})
+            yield batch, page
+        pending = next_pending
@@ -0,0 +1,33 @@
+# coding: utf-8
+
+from object_index import INDEX_TTL, ObjectIndex
+from snapshot_store import SNAPSHOT_KINDS
+
+# 定数
+PRODUCT_KEY_PROPERTY = SNAPSHOT_KINDS['products']['key_property']  # 商品コードを格納している商品のプロパティ（shouhin_code）
+PRODUCT_ID_PROPERTY = 'hs_product_id'  # 商品項目を商品に紐づけるプロパティ
+LINK_PRODUCTS = True  # Trueの場合、商品項目に商品コードに対応する商品IDを設定する
+
+# 商品コードから商品IDを引くローカルの索引
+# 商品の作成・アップサートの応答で記録した 'products' の種別をそのまま使い、足りない分は一覧の取得で補う
+class ProductIndex(ObjectIndex):
+    def __init__(self, registry, ttl=INDEX_TTL):
+        super().__init__(registry, 'products', PRODUCT_KEY_PROPERTY, 'products', ttl)
+
+# 商品項目のプロパティの商品コードから商品IDをまとめて引く関数（索引を必要に応じて更新してから引く）
+def resolve_product_ids(client, registry, properties_list):
+    if not LINK_PRODUCTS:
+        return {}
+    index = ProductIndex(registry)
+    index.refresh(client)
+    return index.lookup(client, [properties.get(PRODUCT_KEY_PROPERTY) for properties in properties_list])
+
+# 商品項目のプロパティに商品コードに対応する商品IDを設定する関数（索引にない商品コードは設定しない）
+def set_product_ids(properties_list, product_ids):
+    linked = 0
+    for properties in properties_list:
+        product_id = product_ids.get(str(properties.get(PRODUCT_KEY_PROPERTY, '')))
+        if product_id:
+            properties[PRODUCT_ID_PROPERTY] = product_id
+            linked += 1
+    return linked
@@ -0,0 +1,257 @@
+# coding: utf-8
+
+from date_convert import date_column, datetime_column
+from transform_engine import Schema, map_values
+
+# 商品項目から取引への関連付けのタイプID（HubSpotの定義済み）
+LINE_ITEM_TO_DEAL_ASSOCIATION_TYPE_ID = 20
+
+# ステージ名とパイプライン名を対応するIDに変換するマッピング
+STAGE_MAPPING = {
+    "FAX受注 (実績)": "149884283"
+}
+PIPELINE_MAPPING = {
+    "実績": "79111068"
+}
+
+# 取引（中間ファイル4）のCSVカラムとプロパティの対応
+DEAL_PROPERTIES_MAPPING = {
+    "取引ステージ": "dealstage",
+    "パイプライン": "pipeline",
+    "合計売上": "amount",
+    "クローズ日": "closedate",
+    "取引名": "dealname",
+    "部門コード": "bugyo_bumon_code",
+    "直送先役職": "bugyo_chokusosaki_yakushoku",
+    "直送先コード": "bugyo_chokusou_saki_code",
+    "直送先電話番号": "bugyo_chokusou_saki_denwa_bangou",
+    "直送先FAX番号": "bugyo_chokusou_saki_fax_bangou",
+    "直送先住所1": "bugyo_chokusou_saki_juusho1",
+    "直送先住所2": "bugyo_chokusou_saki_juusho2",
+    "直送先敬称": "bugyo_chokusou_saki_keishou",
+    "直送先名1": "bugyo_chokusou_saki_mei1",
+    "直送先名2": "bugyo_chokusou_saki_mei2",
+    "直送先担当者": "bugyo_chokusou_saki_tantousha",
+    "直送先郵便番号": "bugyo_chokusou_saki_yuubin_bangou",
+    "伝票フラグコード": "bugyo_denpyou_flag_code",
+    "受注ID": "bugyo_juchuu_id",
+    "受注明細ID": "bugyo_juchuu_meisai_id",
+    "回収期日": "bugyo_kaishuu_kijitsu",
+    "入金摘要": "bugyo_nyuukin_tekiyou",
+    "プロジェクトコード": "bugyo_project_code",
+    "請求先コード": "bugyo_seikyuu_saki_code",
+    "信販会社コード": "bugyo_shinpan_kaisha_code",
+    "信販手数料": "bugyo_shinpan_tesuuryou",
+    "修正日付": "bugyo_shuusei_hizuke",
+    "修正者名": "bugyo_shuuseisha_mei",
+    "担当者コード": "bugyo_tantousha_code",
+    "摘要": "bugyo_tekiyou",
+    "摘要2": "bugyo_tekiyou2",
+    "摘要3": "bugyo_tekiyou3",
+    "得意先コード": "bugyo_tokuisaki_code",
+    "得意先名1": "bugyo_tokuisaki_mei1",
+    "得意先名2": "bugyo_tokuisaki_mei2",
+    "得意先担当者": "bugyo_tokuisaki_tantousha",
+    "登録日付": "bugyo_touroku_hizuke",
+    "登録者名": "bugyo_tourokusha_mei",
+    "売上日付": "bugyo_uriage_hiduke",
+    "税額通知コード": "bugyo_zeigaku_tsuuchi_code",
+    "伝票No.": "no_____",
+    "sha512": "sha512",
+    "sha512_contents": "sha512_contents"
+}
+
+DEAL_SCHEMA = Schema.from_mapping(DEAL_PROPERTIES_MAPPING, converters={
+    "dealstage": map_values(STAGE_MAPPING),
+    "pipeline": map_values(PIPELINE_MAPPING),
+    "closedate": date_column,
+    "bugyo_uriage_hiduke": date_column,
+    "bugyo_touroku_hizuke": datetime_column,
+    "bugyo_shuusei_hizuke": datetime_column,
+})
+
+# 商品（商品マスター）のCSVカラムとプロパティの対応（リストの場合は複数のプロパティに同じ値を送る）
+PRODUCT_PROPERTIES_MAPPING = {
+    "標準価格（税抜）": ["hs_price_jpy", "hyoujun_kakaku_zeinuki"],
+    "売価No.１（税込）": "baika_no1_zeikomi",
+    "売価No.１（税抜）": "baika_no1_zeinuki",
+    "売価No.２（税込）": "baika_no2_zeikomi",
+    "売価No.２（税抜）": "baika_no2_zeinuki",
+    "売価No.３（税込）": "baika_no3_zeikomi",
+    "売価No.３（税抜）": "baika_no3_zeinuki",
+    "売価No.４（税込）": "baika_no4_zeikomi",
+    "売価No.４（税抜）": "baika_no4_zeinuki",
+    "売価No.５（税込）": "baika_no5_zeikomi",
+    "売価No.５（税抜）": "baika_no5_zeinuki",
+    "標準価格（税込）": "hyoujun_kakaku_zeikomi",
+    "仕入原価（税込）": "siire_genka_zeikomi",
+    "仕入原価（税抜）": "siire_genka_zeinuki",
+    "単価小数桁": "tanka_shosu_keta",
+    "単位原価（税込）": "tanni_genka_zeikomi",
+    "単位原価（税抜）": "tanni_genka_zeinuki",
+    "在庫単価（税抜）": "zaiko_tanka_zeinuki",
+    "税区分（販売）": "zei_kubun_hanbai",
+    "税区分（仕入）": "zei_kubun_shiire",
+    "税込区分（販売）": "zeikomi_kubun_hanbai",
+    "税込区分（仕入）": "zeikomi_kubun_shiire",
+    "税率種別（販売）": "zeiritsu_shubetsu_hanbai",
+    "税率種別（仕入）": "zeiritsu_shubetsu_shiire",
+    "台帳インデックス": "daichou_index",
+    "発注区分": "hacchuu_kubun",
+    "発注単位数量": "hacchuu_tanni_suuryou",
+    "発注点": "hacchuu_ten",
+    "箱数小数桁": "hakosuu_shosu_keta",
+    "個別管理": "kobetsu_kanri",
+    "個別対応": "kobetsu_taiou",
+    "共用区分": "kyouyou_kubun",
+    "明細区分": "meisai_kubun",
+    "メモ１": "memo1",
+    "メモ２": "memo2",
+    "メモ３": "memo3",
+    "商品名": "name",
+    "入数": "nyuusuu",
+    "入数小数桁": "nyuusuu_shosu_keta",
+    "利用状態": "riyou_joutai",
+    "最高点": "saikou_ten",
+    "主仕入先コード": "shu_shiire_saki_code",
+    "数量小数桁": "suuryou_shosu_keta",
+    "単位": "tanni",
+    "有効期間（開始）": "yuukou_kikan_kaishi",
+    "有効期間（終了）": "yuukou_kikan_shuryou",
+    "在庫管理": "zaiko_kanri",
+    "入数２": "bugyo_iri_su2",
+    "入数２小数桁": "bugyo_irisu2_shousu_keta",
+    "商品名２": "bugyo_shohinmei2",
+    "商品名３": "bugyo_shohinmei3",
+    "商品名４": "bugyo_shohinmei4",
+    "商品名５": "bugyo_shohinmei5",
+    "商品名６": "bugyo_shohinmei6",
+    "商品区分３コード": "bugyo_shouhin_kubun_3_code",
+    "商品区分２コード": "bugyo_shouhin_kubun_2_code",
+    "商品区分１コード": "bugyo_shouhin_kubun_1_code",
+    "商品コード２": "bugyo_shouhin_code_2",
+    "商品コード３": "bugyo_shouhin_code_3",
+    "商品コード４": "bugyo_shouhin_code_4",
+    "商品コード５": "bugyo_shouhin_code_5",
+    "印刷用商品コード": "bugyo_insatsuyou_syouhin_code",
+    "引当管理": "bugyo_hikiate_kanri",
+    "ロット管理": "bugyo_lot_kanri",
+    "在庫評価方法": "bugyo_zaiko_hyouka_houhou",
+    "主倉庫コード": "bugyo_shu_souko_code",
+    "主ロケーションNo.": "bugyo_shu_location_no",
+    "出荷予定日設定": "bugyo_shukka_yoteibi_settei",
+    "発注納品期日設定": "bugyo_hacchuu_nouhin_kijitsu_settei",
+    "期限サイクル設定": "bugyo_kigen_cycle_settei",
+    "期限サイクル（月）": "bugyo_kigen_cycle_month",
+    "期限サイクル（日）": "bugyo_kigen_cycle_day",
+    "単価区分２単位当り単価区分１数": "bugyo_tanka_kubun_2_tani_atari_tanka_kubun_1_suu",
+    "単価区分２単位": "bugyo_tanka_kubun_2_tani",
+    "単価区分２単価区分内容": "bugyo_tanka_kubun_2_tanka_kubun_naiyou",
+    "単価区分２単価区分備考": "bugyo_tanka_kubun_2_tanka_kubun_bikou",
+    "単価区分３単位当り単価区分１数": "bugyo_tanka_kubun_3_tani_atari_tanka_kubun_1_suu",
+    "単価区分３単位": "bugyo_tanka_kubun_3_tani",
+    "単価区分３単価区分内容": "bugyo_tanka_kubun_3_tanka_kubun_naiyou",
+    "単価区分３単価区分備考": "bugyo_tanka_kubun_3_tanka_kubun_bikou",
+    "単価区分４単位当り単価区分１数": "bugyo_tanka_kubun_4_tani_atari_tanka_kubun_1_suu",
+    "単価区分４単位": "bugyo_tanka_kubun_4_tani",
+    "単価区分４単価区分内容": "bugyo_tanka_kubun_4_tanka_kubun_naiyou",
+    "単価区分４単価区分備考": "bugyo_tanka_kubun_4_tanka_kubun_bikou",
+    "単価区分５単位当り単価区分１数": "bugyo_tanka_kubun_5_tani_atari_tanka_kubun_1_suu",
+    "単価区分５単位": "bugyo_tanka_kubun_5_tani",
+    "単価区分５単価区分内容": "bugyo_tanka_kubun_5_tanka_kubun_naiyou",
+    "単価区分５単価区分備考": "bugyo_tanka_kubun_5_tanka_kubun_bikou",
+    "売上単価区分": "bugyo_uriage_tanka_kubun",
+    "仕入単価区分": "bugyo_shiire_tanka_kubun",
+    "登録日付": "bugyo_toroku_hizuke_syouhin_master_base",
+    "登録者名": "bugyo_torokushamei_syouhin_master_base",
+    "修正日付": "bugyo_shuusei_hizuke_syouhin_master_base",
+    "修正者名": "bugyo_shuuseishamei_syouhin_master_base",
+    "商品区分１名": "bugyo_revol_syouhin_shouhin_kubun_1_mei",
+    "商品区分２名": "bugyo_tasha_maker_syouhin_shouhin_kubun_2_mei",
+    "商品区分３名": "bugyo_sonota_syouhin_shouhin_kubun_3_mei",
+    "sha512": "bugyo_sha512_syouhin_master_base",
+    "sha512_contents": "bugyo_sha512_contents_syouhin_master_base",
+    "商品コード": "shouhin_code"
+}
+
+PRODUCT_SCHEMA = Schema.from_mapping(PRODUCT_PROPERTIES_MAPPING, converters={
+    "bugyo_toroku_hizuke_syouhin_master_base": datetime_column,
+    "bugyo_shuusei_hizuke_syouhin_master_base": datetime_column,
+})
+
+# 商品項目（中間ファイル5）のCSVカラムとプロパティの対応
+LINE_ITEM_PROPERTIES_MAPPING = {
+    "売上金額": ["hs_price_jpy", "bugyo_urage_kingaku_urage_denpyo_base"],
+    "単価小数桁": "tanka_shosu_keta",
+    "箱数小数桁": "hakosuu_shosu_keta",
+    "商品名": "name",
+    "入数": "nyuusuu",
+    "入数2": "nyuusuu_shosu_keta",
+    "商品コード": "shouhin_code",
+    "仕入先コード": "shu_shiire_saki_code",
+    "数量小数桁": "suuryou_shosu_keta",
+    "単位": "tanni",
+    "備考": "bugyo_biko",
+    "注文No.": "bugyo_chumon_no",
+    "伝票No.": ["bugyo_denpyo_no", "no____"],
+    "同時処理コード": "bugyo_douzi_shori_code",
+    "付箋メモ": "bugyo_fusen_memo",
+    "付箋色コード": "bugyo_fusenshoku_code",
+    "原価消費税": "bugyo_genka_shohizei",
+    "原価税込区分コード": "bugyo_genka_zeikomi_kubun_code",
+    "箱数": "bugyo_hako_su",
+    "入数2小数桁": "bugyo_irisu2_shousu_keta",
+    "課税区分コード": "bugyo_kazeikubun_code",
+    "商品名2": "bugyo_shohinmei2",
+    "商品名3": "bugyo_shohinmei3",
+    "商品名4": "bugyo_shohinmei4",
+    "商品名5": "bugyo_shohinmei5",
+    "商品名6": "bugyo_shohinmei6",
+    "消費税": "bugyo_shohizei",
+    "出荷区分": "bugyo_shukka_kubun",
+    "修正日付": "bugyo_shusei_hiduke_uriage_denpyo_base",
+    "修正者名": "bugyo_shusei_sha_urage_denpyo_base",
+    "倉庫コード": "bugyo_souko_code",
+    "商品コード種類コード": "bugyo_syohin_code_shurui_code",
+    "単位原価": "bugyo_tani_genka_urage_denpyo_base",
+    "単価": ["bugyo_tanka", "price"],
+    "単価区分": "bugyo_tanka_kubun",
+    "取引状態区分コード": "bugyo_torihiki_zyotai_kubun_code",
+    "登録日付": "bugyo_touroku_hiduke_uriage_denpyo_base",
+    "登録者名": "bugyo_tourokusha_mei_uriage_denpyo_base",
+    "売上原価": "bugyo_uriage_genka",
+    "売上区分コード": "bugyo_uriage_kubun_code",
+    "売単価": "bugyo_uritanka",
+    "税込区分コード": "bugyo_zeikomi_kubun_code",
+    "税率": "bugyo_zeiritsu",
+    "税率区分コード": "bugyo_zeiritsu_kubun_code",
+    "税率種別": "bugyo_zeiritsu_shubetu",
+    "売上原価2": "n2",
+    "sha512": "sha512",
+    "sha512_contents": "sha512_contents",
+    "数量": "quantity"
+}
+
+LINE_ITEM_SCHEMA = Schema.from_mapping(LINE_ITEM_PROPERTIES_MAPPING, converters={
+    "bugyo_shusei_hiduke_uriage_denpyo_base": datetime_column,
+    "bugyo_touroku_hiduke_uriage_denpyo_base": datetime_column,
+})
+
+# 取引に関連付けた商品項目のレコードを作成する関数
+def build_line_item_record(properties, deal_id):
+    return {
+        "associations": [
+            {
+                "types": [
+                    {
+                        "associationCategory": "HUBSPOT_DEFINED",
+                        "associationTypeId": LINE_ITEM_TO_DEAL_ASSOCIATION_TYPE_ID
+                    }
+                ],
+                "to": {
+                    "id": deal_id
+                }
+            }
+        ],
+        "properties": properties
+    }
@@ -0,0 +1,130 @@
+# coding: utf-8
+
+import hashlib
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from columnar import write_columnar
+from metrics import METRICS
+
+# 定数
+CHUNK_SIZE = 20000  # 1プロセスに渡す行数
+PARALLEL_THRESHOLD = 50000  # この行数未満の場合は並列化せず現在のプロセスで処理する
+MAX_WORKERS = None  # 並列処理のプロセス数 (NoneはCPUコア数)
+
+# 修正・登録情報のカラム（sha512にのみ含め、sha512_contentsには含めない）
+AUDIT_COLUMNS = ['修正日付', '修正者名', '登録日付', '登録者名']
+
+# ファイルごとのハッシュ対象カラムの設定
+# sha512_contents は contents_columns のみ、sha512 は contents_columns + audit_columns から生成する
+HASH_SPECS = {
+    '中間ファイル4': {
+        'contents_columns': [
+            '伝票区分コード', '売上日付', '請求日付', '伝票No.', '受注ID', '受注明細ID', '得意先コード', '得意先名1', '得意先名2',
+            '請求先コード', '税額通知コード', '得意先担当者', '部門コード', '担当者コード', 'プロジェクトコード', '信販会社コード',
+            '摘要', '摘要2', '摘要3', '伝票フラグコード', '直送先コード', '直送先名1', '直送先名2', '直送先担当者', '直送先敬称',
+            '直送先役職', '直送先郵便番号', '直送先住所1', '直送先住所2', '直送先電話番号', '直送先FAX番号', '回収期日', '信販手数料', '入金摘要', '合計売上'
+        ],
+        'audit_columns': AUDIT_COLUMNS,
+    },
+    '中間ファイル5': {
+        'contents_columns': [
+            '伝票No.', '売上区分コード', '出荷区分', '商品コード種類コード', '商品コード', '商品名', '商品名2', '商品名3', '商品名4',
+            '商品名5', '商品名6', '注文No.', '倉庫コード', '単価区分', '入数', '入数2', '箱数', '数量', '単位', '単価', '単位原価',
+            '売単価', '売上金額', '売上原価', '売上原価2', '課税区分コード', '取引状態区分コード', '税率種別', '税率区分コード',
+            '税率', '税込区分コード', '原価税込区分コード', '入数小数桁', '入数2小数桁', '箱数小数桁', '数量小数桁', '単価小数桁',
+            '消費税', '原価消費税', '同時処理コード', '仕入先コード', '備考', '付箋色コード', '付箋メモ'
+        ],
+        'audit_columns': AUDIT_COLUMNS,
+    },
+}
+
+# 必要なカラムがすべて存在することを確認する関数
+def validate_columns(df, spec):
+    for col in spec['contents_columns'] + spec['audit_columns']:
+        if col not in df.columns:
+            raise ValueError(f"必要なカラム {col} がCSVファイルに存在しません。")
+
+# カラムごとの値を文字列のリストとして取り出す関数（欠損値は空文字）
+def _column_values(df, cols):
+    return [df[col].fillna('').astype(str).tolist() for col in cols]
+
+# 行ごとにカラムの値を','で連結する関数
+def _join_rows(column_values, row_count):
+    if not column_values:
+        return [''] * row_count
+    return [','.join(values) for values in zip(*column_values)]
+
+# チャンク単位でsha512とsha512_contentsを1回のパスで生成する関数
+def _hash_chunk(contents_values, audit_values, row_count):
+    contents_rows = _join_rows(contents_values, row_count)
+    audit_rows = _join_rows(audit_values, row_count) if audit_values else None
+
+    sha512_list = []
+    contents_list = []
+    for i, contents in enumerate(contents_rows):
+        h = hashlib.sha512(contents.encode())
+        contents_list.append(h.hexdigest())
+        if audit_rows is not None:
+            # sha512_contentsの途中状態を引き継いで残りのカラムだけを追加する
+            h.update((',' + audit_rows[i]).encode())
+        sha512_list.append(h.hexdigest())
+    return sha512_list, contents_list
+
+# データフレームからsha512とsha512_contentsのリストを生成する関数
+def compute_digests(df, spec, max_workers=MAX_WORKERS, chunk_size=CHUNK_SIZE):
+    validate_columns(df, spec)
+    contents_values = _column_values(df, spec['contents_columns'])
+    audit_values = _column_values(df, spec['audit_columns'])
+    row_count = len(df)
+
+    if row_count < PARALLEL_THRESHOLD or max_workers == 1:
+        return _hash_chunk(contents_values, audit_values, row_count)
+
+    starts = range(0, row_count, chunk_size)
+    chunks = [
+        (
+            [values[start:start + chunk_size] for values in contents_values],
+            [values[start:start + chunk_size] for values in audit_values],
+            min(chunk_size, row_count - start),
+        )
+        for start in starts
+    ]
+
+    sha512_list = []
+    contents_list = []
+    workers = max_workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for chunk_sha512, chunk_contents in executor.map(_hash_chunk, *zip(*chunks)):
+            sha512_list.extend(chunk_sha512)
+            contents_list.extend(chunk_contents)
+    return sha512_list, contents_list
+
+# データフレームにsha512とsha512_contentsのカラムを追加する関数
+def add_sha512_columns(df, spec, max_workers=MAX_WORKERS, chunk_size=CHUNK_SIZE):
+    with METRICS.stage('hash', rows=len(df)):
+        sha512_list, contents_list = compute_digests(df, spec, max_workers=max_workers, chunk_size=chunk_size)
+    df['sha512'] = sha512_list
+    df['sha512_contents'] = contents_list
+    return df
+
+# sha512とsha512_contentsのカラムがない場合だけ、読み込んだデータフレームに計算して追加する関数
+# （送信側の読み込み時に呼び、sha512_hash4/5 でCSVを書き直さなくても同じハッシュを使えるようにする）
+def ensure_sha512_columns(df, spec, max_workers=MAX_WORKERS):
+    if 'sha512' in df.columns and 'sha512_contents' in df.columns:
+        return df
+    return add_sha512_columns(df, spec, max_workers=max_workers)
+
+# 中間ファイルを読み込んでハッシュを追加し、元のファイルに上書き保存する関数
+def hash_file(file_path, spec, max_workers=MAX_WORKERS):
+    # CSVファイルの読み込み時に全てのカラムを文字列として扱う
+    with METRICS.stage('read'):
+        df = pd.read_csv(file_path, dtype=str)
+    METRICS.add_rows('read', len(df))
+    add_sha512_columns(df, spec, max_workers=max_workers)
+    with METRICS.stage('write', rows=len(df)):
+        df.to_csv(file_path, index=False)
+        write_columnar(df, file_path)  # 送信側が必要なカラムだけを読み込めるように、Arrow IPCも書き出す
+    return df
@@ -0,0 +1,116 @@
+# coding: utf-8
+
+import hashlib
+import json
+import sqlite3
+from datetime import datetime, timezone
+
+# 定数
+SNAPSHOT_DB = 'sync_state.sqlite3'  # 同期状態を保存するSQLiteファイル名
+SQLITE_MAX_VARIABLES = 900  # 1回のクエリで使うプレースホルダーの上限
+
+# 種別ごとのキーとハッシュのプロパティ（HubSpotの応答から記録する場合に使用）
+SNAPSHOT_KINDS = {
+    'deals': {'key_property': 'no_____', 'hash_property': 'sha512_contents'},
+    'products': {'key_property': 'shouhin_code', 'hash_property': 'bugyo_sha512_contents_syouhin_master_base'},
+    'line_items': {'key_property': 'bugyo_denpyo_no', 'hash_property': None},  # 伝票単位のハッシュを記録する
+}
+
+# 最後に同期したsha512_contentsを保存するローカルの索引
+class SnapshotStore:
+    def __init__(self, db_path=SNAPSHOT_DB):
+        self.db_path = db_path
+        self.conn = sqlite3.connect(db_path)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS snapshots ("
+            " kind TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " sha512_contents TEXT NOT NULL,"
+            " synced_at TEXT NOT NULL,"
+            " PRIMARY KEY (kind, key))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS property_values ("
+            " kind TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " properties TEXT NOT NULL,"  # 最後に同期したプロパティの値（JSON）
+            " PRIMARY KEY (kind, key))"
+        )
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    # 指定したキーの最終同期ハッシュを取得する
+    def get_hashes(self, kind, keys):
+        keys = list(dict.fromkeys(str(key) for key in keys))
+        hashes = {}
+        for i in range(0, len(keys), SQLITE_MAX_VARIABLES):
+            chunk = keys[i:i + SQLITE_MAX_VARIABLES]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT key, sha512_contents FROM snapshots WHERE kind = ? AND key IN ({placeholders})",
+                [kind, *chunk],
+            )
+            hashes.update(rows)
+        return hashes
+
+    # 同期が完了したキーとハッシュを記録する
+    def record(self, kind, items):
+        synced_at = datetime.now(timezone.utc).isoformat()
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO snapshots (kind, key, sha512_contents, synced_at) VALUES (?, ?, ?, ?)",
+            [(kind, str(key), str(sha512_contents), synced_at) for key, sha512_contents in items if key],
+        )
+        self.conn.commit()
+
+    # 指定したキーの最後に同期したプロパティの値を取得する
+    def get_properties(self, kind, keys):
+        keys = list(dict.fromkeys(str(key) for key in keys))
+        values = {}
+        for i in range(0, len(keys), SQLITE_MAX_VARIABLES):
+            chunk = keys[i:i + SQLITE_MAX_VARIABLES]
+            placeholders = ','.join('?' * len(chunk))
+            rows = self.conn.execute(
+                f"SELECT key, properties FROM property_values WHERE kind = ? AND key IN ({placeholders})",
+                [kind, *chunk],
+            )
+            values.update((key, json.loads(properties)) for key, properties in rows)
+        return values
+
+    # 同期が完了したキーとプロパティの値を記録する
+    def record_properties(self, kind, items):
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO property_values (kind, key, properties) VALUES (?, ?, ?)",
+            [(kind, str(key), json.dumps(properties, ensure_ascii=False)) for key, properties in items if key],
+        )
+        self.conn.commit()
+
+    # HubSpotのバッチ応答の results から同期済みのキーとハッシュを記録する
+    def record_results(self, kind, results):
+        key_property = SNAPSHOT_KINDS[kind]['key_property']
+        hash_property = SNAPSHOT_KINDS[kind]['hash_property']
+        self.record(kind, [
+            (result['properties'].get(key_property), result['properties'].get(hash_property))
+            for result in results
+            if result.get('properties', {}).get(hash_property)
+        ])
+
+    # 行を 新規 / 変更あり / 変更なし に振り分ける
+    def classify(self, kind, df, key_column, hash_column='sha512_contents'):
+        known = self.get_hashes(kind, df[key_column].tolist())
+        previous = df[key_column].astype(str).map(known)
+        is_new = previous.isna()
+        is_changed = ~is_new & (previous != df[hash_column])
+        return df[is_new], df[is_changed], df[~is_new & ~is_changed]
+
+# 伝票No.ごとに明細のsha512_contentsをまとめたハッシュを生成する関数
+def slip_hashes(df, key_column='伝票No.', hash_column='sha512_contents'):
+    grouped = df.groupby(key_column, sort=False, observed=True)[hash_column].agg(','.join)  # カテゴリ型の場合は出現した伝票だけを集計する
+    return {key: hashlib.sha512(joined.encode()).hexdigest() for key, joined in grouped.items()}
@@ -0,0 +1,30 @@
+# coding: utf-8
+
+import importlib.util
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import hubspot_stub  # noqa: E402
+
+# スクリプトが HubSpotClient を作る前に、ローカルのスタブに向ける（API_BASE は読み込み時に決まる）
+SERVER, BASE_URL = hubspot_stub.start_server(hubspot_stub.StubConfig(seed=0))
+os.environ['HUBSPOT_API_BASE'] = BASE_URL
+os.environ['HUBSPOT_RATE_LIMIT'] = '1000000'
+
+# 日本語名のスクリプトをモジュールとして読み込む関数
+def load_script(name):
+    spec = importlib.util.spec_from_file_location(os.path.splitext(name)[0], os.path.join(ROOT, name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# テストごとに空のスタブを返す
+@pytest.fixture
+def stub():
+    SERVER.store = hubspot_stub.StubStore(hubspot_stub.StubConfig(seed=0))
+    return SERVER
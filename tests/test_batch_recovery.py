@@ -0,0 +1,86 @@
+# coding: utf-8
+
+import pytest
+import requests
+
+import batch_recovery
+from batch_recovery import BatchRecovery, UNKNOWN_CATEGORY
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.reason = 'reason'
+        self.text = ''
+        self.content = b'{}'
+        self.body = body
+
+    def json(self):
+        return self.body
+
+# 入力ごとに応答を決める関数を受け取り、送信した回数を数えるクライアント
+class FakeClient:
+    def __init__(self, respond):
+        self.respond = respond
+        self.requests = 0
+
+    def request(self, method, path, body=None, params=None):
+        self.requests += 1
+        return self.respond(self, body['inputs'])
+
+def _created(inputs):
+    return FakeResponse(201, {"results": [{"id": str(100 + int(item['objectWriteTraceId'])), "objectWriteTraceId": item['objectWriteTraceId']} for item in inputs]})
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(batch_recovery, 'SERVER_RETRY_BACKOFF', 0)
+
+ITEMS = [{"properties": {"row": row}} for row in range(100)]
+
+def test_batch_wide_rejection_stops_after_one_split():
+    client = FakeClient(lambda client, inputs: FakeResponse(400, {"category": "VALIDATION_ERROR", "message": "Property x does not exist"}))
+    response = BatchRecovery(client).send('/crm/v3/objects/deals/batch/create', ITEMS)
+    assert client.requests == 3
+    assert len(response['failedInputs']) == 100
+
+def test_rejection_is_narrowed_to_the_bad_input():
+    def respond(client, inputs):
+        if any(item['properties']['row'] == 37 for item in inputs):
+            return FakeResponse(400, {"category": "VALIDATION_ERROR", "message": "Invalid value"})
+        return _created(inputs)
+    response = BatchRecovery(FakeClient(respond)).send('/crm/v3/objects/deals/batch/create', ITEMS)
+    assert len(response['results']) == 99
+    assert response['failedInputs'] == [{"properties": {"row": 37}}]
+
+def test_partial_failure_retries_only_failed_inputs():
+    def respond(client, inputs):
+        if client.requests == 1:
+            return FakeResponse(207, {
+                "results": _created(inputs[1:]).body['results'],
+                "errors": [{"category": "VALIDATION_ERROR", "message": "x", "context": {"objectWriteTraceId": ["0"]}}],
+            })
+        return _created(inputs)
+    client = FakeClient(respond)
+    response = BatchRecovery(client).send('/crm/v3/objects/deals/batch/create', ITEMS[:3])
+    assert client.requests == 2
+    assert len(response['results']) == 3
+    assert 'failedInputs' not in response
+
+def test_server_errors_are_retried():
+    client = FakeClient(lambda client, inputs: FakeResponse(503, {}) if client.requests < 3 else _created(inputs))
+    response = BatchRecovery(client).send('/crm/v3/objects/deals/batch/create', ITEMS[:5])
+    assert client.requests == 3
+    assert len(response['results']) == 5
+
+def test_timeout_after_sending_is_unknown_outcome():
+    def respond(client, inputs):
+        raise requests.exceptions.ReadTimeout('read timed out')
+    response = BatchRecovery(FakeClient(respond)).send('/crm/v3/objects/deals/batch/create', ITEMS[:2])
+    assert [error['category'] for error in response['errors']] == [UNKNOWN_CATEGORY, UNKNOWN_CATEGORY]
+
+def test_unmatched_error_excludes_written_inputs():
+    def respond(client, inputs):
+        return FakeResponse(207, {"results": _created(inputs[:2]).body['results'], "errors": [{"category": "X", "message": "?"}]})
+    response = BatchRecovery(FakeClient(respond)).send('/crm/v3/objects/deals/batch/create', ITEMS[:3])
+    assert response['failedInputs'] == [ITEMS[2]]
+    assert response['errors'][0]['category'] == 'X'
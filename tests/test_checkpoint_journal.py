@@ -0,0 +1,58 @@
+# coding: utf-8
+
+import os
+
+import pytest
+
+from checkpoint_journal import CheckpointJournal
+
+KEY = ['bugyo_denpyo_no', 'sha512_contents']
+
+def _line_item(slip, digest, product_id):
+    return {"properties": {"bugyo_denpyo_no": slip, "sha512_contents": digest, "hs_product_id": product_id}}
+
+@pytest.fixture
+def source(tmp_path):
+    path = tmp_path / 'lines.csv'
+    path.write_text('x\n')
+    return str(path)
+
+def test_resume_skips_completed_records_even_if_payload_changed(source):
+    items = [_line_item('1', 'a', '10'), _line_item('1', 'a', '10'), _line_item('2', 'b', '10')]
+    with CheckpointJournal(source, 'test', KEY) as journal:
+        for batch in journal.pending([items[:2]]):
+            journal.record(batch, [{"id": "100"}, {"id": "101"}])
+
+    # 商品IDが変わっても、伝票No.とハッシュが同じレコードは送信済みとして扱う
+    changed = [_line_item(item['properties']['bugyo_denpyo_no'], item['properties']['sha512_contents'], '99') for item in items]
+    with CheckpointJournal(source, 'test', KEY, resume=True) as journal:
+        pending = list(journal.pending([changed[:2], changed[2:]]))
+        journal.finish()
+    assert pending == [changed[2:]]
+    assert journal.skipped == 2
+
+def test_without_resume_starts_over(source):
+    with CheckpointJournal(source, 'test', KEY) as journal:
+        for batch in journal.pending([[_line_item('1', 'a', '10')]]):
+            journal.record(batch, [{"id": "100"}])
+    with CheckpointJournal(source, 'test', KEY) as journal:
+        assert len(list(journal.pending([[_line_item('1', 'a', '10')]]))) == 1
+
+def test_resume_refuses_changed_csv(source):
+    with CheckpointJournal(source, 'test', KEY) as journal:
+        journal.finish()
+    with open(source, 'a') as f:
+        f.write('y\n')
+    with pytest.raises(RuntimeError):
+        CheckpointJournal(source, 'test', KEY, resume=True)
+
+def test_resume_ignores_torn_last_line(source):
+    with CheckpointJournal(source, 'test', KEY) as journal:
+        for batch in journal.pending([[_line_item('1', 'a', '10')]]):
+            journal.record(batch, [{"id": "100"}])
+    with open(journal.path, 'a', encoding='utf-8') as f:
+        f.write('{"type": "batch", "keys": ["2\\tb"')  # 書き込み途中で終了した行
+    with CheckpointJournal(source, 'test', KEY, resume=True) as journal:
+        pending = list(journal.pending([[_line_item('1', 'a', '10'), _line_item('2', 'b', '10')]]))
+    assert [item['properties']['bugyo_denpyo_no'] for batch in pending for item in batch] == ['2']
+    assert os.path.exists(journal.path)
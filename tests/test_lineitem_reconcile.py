@@ -0,0 +1,19 @@
+# coding: utf-8
+
+from lineitem_reconcile import plan_slip
+
+def test_same_contents_are_kept():
+    assert plan_slip([('1', 'a'), ('2', 'b')], [('a', {"n": 1}), ('b', {"n": 2})]) == ([], [], [])
+
+def test_changed_rows_overwrite_stale_line_items():
+    updates, archives, creates = plan_slip([('1', 'a'), ('2', 'b')], [('a', {"n": 1}), ('c', {"n": 3})])
+    assert updates == [('2', {"n": 3})]
+    assert archives == [] and creates == []
+
+def test_extra_line_items_are_archived_and_missing_ones_created():
+    assert plan_slip([('1', 'a'), ('2', 'b'), ('3', 'c')], [('d', {"n": 4})]) == ([('1', {"n": 4})], ['2', '3'], [])
+    assert plan_slip([], [('a', {"n": 1}), ('a', {"n": 1})]) == ([], [], [{"n": 1}, {"n": 1}])
+
+def test_duplicate_contents_are_matched_one_to_one():
+    updates, archives, creates = plan_slip([('1', 'a')], [('a', {"n": 1}), ('a', {"n": 1})])
+    assert (updates, archives, creates) == ([], [], [{"n": 1}])
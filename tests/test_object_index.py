@@ -0,0 +1,21 @@
+# coding: utf-8
+
+import time
+
+from hubspot_client import HubSpotClient
+from id_registry import IdRegistry
+from object_index import ObjectIndex
+
+def test_refresh_forgets_archived_objects(stub, tmp_path):
+    kept = stub.store.create('products', {'shouhin_code': 'P1'})
+    archived = stub.store.create('products', {'shouhin_code': 'P2'})
+    with HubSpotClient('test') as client, IdRegistry(str(tmp_path / 'state.sqlite3')) as registry:
+        index = ObjectIndex(registry, 'products', 'shouhin_code', 'products', ttl=0)
+        index.refresh(client)
+        assert registry.get_ids('products', ['P1', 'P2']) == {'P1': kept['id'], 'P2': archived['id']}
+
+        stub.store.archive('products', archived['id'])
+        time.sleep(0.01)
+        index.refresh(client)
+        assert registry.get_ids('products', ['P1', 'P2']) == {'P1': kept['id']}
+        assert stub.store.stats['GET /crm/v3/objects/products'] == 2  # 作り直しと、アーカイブ済みの一覧
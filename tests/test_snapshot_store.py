@@ -0,0 +1,19 @@
+# coding: utf-8
+
+import pandas as pd
+
+from snapshot_store import SnapshotStore
+
+def test_classify_splits_new_changed_and_unchanged(tmp_path):
+    with SnapshotStore(str(tmp_path / 'state.sqlite3')) as store:
+        store.record('deals', [('1', 'a'), ('2', 'b')])
+        df = pd.DataFrame({'伝票No.': ['1', '2', '3'], 'sha512_contents': ['a', 'x', 'c']})
+        new_rows, changed_rows, unchanged_rows = store.classify('deals', df, '伝票No.')
+    assert new_rows['伝票No.'].tolist() == ['3']
+    assert changed_rows['伝票No.'].tolist() == ['2']
+    assert unchanged_rows['伝票No.'].tolist() == ['1']
+
+def test_properties_round_trip(tmp_path):
+    with SnapshotStore(str(tmp_path / 'state.sqlite3')) as store:
+        store.record_properties('deals', [('1', {"amount": "100"}), ('', {"ignored": True})])
+        assert store.get_properties('deals', ['1', '2']) == {'1': {"amount": "100"}}
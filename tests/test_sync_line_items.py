@@ -0,0 +1,47 @@
+# coding: utf-8
+
+import queue
+import threading
+import time
+
+from conftest import load_script
+from product_index import PRODUCT_ID_PROPERTY
+
+sync = load_script('一括同期.py')
+
+class FakeRegistry:
+    def __init__(self, ids):
+        self.ids = ids
+
+    def get_ids(self, kind, keys):
+        return {key: self.ids[kind][key] for key in keys if key in self.ids[kind]}
+
+def _line_items(code):
+    return {'1': [{sync.PRODUCT_KEY_PROPERTY: code, 'bugyo_denpyo_no': '1'}]}
+
+def _ready(slips):
+    ready = queue.Queue()
+    ready.put(slips)
+    ready.put(None)
+    return ready
+
+def test_known_product_codes_do_not_wait_for_products():
+    registry = FakeRegistry({'deals': {'1': '10'}, 'products': {'P1': '20'}})
+    products_done = threading.Event()
+    threading.Timer(1.0, products_done.set).start()  # 商品のステージは1秒後に終わる
+    started = time.monotonic()
+    batches = list(sync.iter_ready_line_items(registry, _line_items('P1'), _ready(['1']), set(), products_done))
+    assert time.monotonic() - started < 0.5
+    assert batches[0][0]['properties'][PRODUCT_ID_PROPERTY] == '20'
+
+def test_unknown_product_codes_wait_for_products():
+    registry = FakeRegistry({'deals': {'1': '10'}, 'products': {}})
+    products_done = threading.Event()
+    batches = sync.iter_ready_line_items(registry, _line_items('P2'), _ready(['1']), set(), products_done)
+
+    # 商品のステージで作成された商品IDが記録されてから、イベントがセットされる
+    def finish_products():
+        registry.ids['products']['P2'] = '30'
+        products_done.set()
+    threading.Timer(0.05, finish_products).start()
+    assert next(batches)[0]['properties'][PRODUCT_ID_PROPERTY] == '30'
@@ -0,0 +1,48 @@
+# coding: utf-8
+
+import os
+import shutil
+
+from conftest import load_script
+from csv_io import read_csv
+
+UPSERT_PATHS = ['POST /crm/v3/objects/deals/batch/upsert', 'POST /crm/v3/objects/products/batch/upsert']
+
+# 商品と取引の中間ファイルを作る
+def _write_sources(work_dir):
+    load_script('ベンチマーク.py').generate(str(work_dir), 40)
+    shutil.copy(os.path.join(work_dir, '新規だけ商品.csv'), os.path.join(work_dir, '中間ファイル商品.csv'))
+
+def _upsert_requests(stub):
+    return sum(stub.store.stats.get(path, 0) for path in UPSERT_PATHS)
+
+def test_upsert_creates_then_skips_unchanged(stub, tmp_path):
+    _write_sources(tmp_path)
+    upsert = load_script('一括アップサート.py')
+
+    upsert.main(str(tmp_path))
+    assert len(stub.store.objects['deals']) == 10
+    assert len(stub.store.objects['products']) == 4
+    assert _upsert_requests(stub) == 2
+
+    # 2回目は変更がないため送信しない
+    upsert.main(str(tmp_path))
+    assert len(stub.store.objects['deals']) == 10
+    assert len(stub.store.objects['products']) == 4
+    assert _upsert_requests(stub) == 2
+
+def test_upsert_updates_changed_rows_in_place(stub, tmp_path):
+    _write_sources(tmp_path)
+    upsert = load_script('一括アップサート.py')
+    upsert.main(str(tmp_path))
+
+    deal_path = os.path.join(tmp_path, '中間ファイル4.csv')
+    deals = read_csv(deal_path)
+    deals.loc[0, '摘要'] = 'changed'
+    deals.to_csv(deal_path, index=False)
+    upsert.main(str(tmp_path))
+
+    assert len(stub.store.objects['deals']) == 10
+    changed = [obj for obj in stub.store.objects['deals'].values() if obj['properties'].get('no_____') == deals.loc[0, '伝票No.']]
+    assert [obj['properties'].get('bugyo_tekiyou') for obj in changed] == ['changed']
+    assert stub.store.stats['POST /crm/v3/objects/deals/batch/upsert'] == 2
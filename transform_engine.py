@@ -0,0 +1,111 @@
+# coding: utf-8
+
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from date_convert import normalize_timestamp
+from metrics import METRICS
+
+# カラムの重複しない値だけに関数を適用し、結果を全行に展開する関数
+def map_unique(series, func):
+    codes, uniques = pd.factorize(series)
+    converted = np.empty(len(uniques), dtype=object)
+    converted[:] = [func(value) for value in uniques]
+    return converted[codes].tolist()
+
+# 対応表にある値だけを置き換えるコンバーターを作る関数（対応表にない値はそのまま）
+def map_values(mapping):
+    def convert(series):
+        return map_unique(series, lambda value: mapping.get(value, value))
+    return convert
+
+# プロパティの値を比較用の文字列にする関数（Noneは空文字、日付・日時はミリ秒のタイムスタンプにそろえる）
+def _comparable(value):
+    return '' if value is None else str(normalize_timestamp(value))
+
+# 前回同期した値と比べて変わったプロパティだけを返す関数（空から空への書き込みは送らない）
+def changed_properties(properties, previous):
+    return {
+        name: value for name, value in properties.items()
+        if _comparable(value) != _comparable(previous.get(name))
+    }
+
+# CSVの1カラムとHubSpotのプロパティ（複数可）の対応
+class Field:
+    def __init__(self, source, targets, converter=None):
+        self.source = source  # CSVのカラム名
+        self.targets = [targets] if isinstance(targets, str) else list(targets)  # 送信先のプロパティ名
+        self.converter = converter  # カラム全体を変換する関数（Noneの場合はそのまま）。(値のリスト, 変換できなかった値の件数) を返してもよい
+
+# CSVのカラムからHubSpotのプロパティを生成する宣言的なスキーマ
+class Schema:
+    def __init__(self, fields):
+        self.fields = list(fields)
+
+    # {CSVのカラム名: プロパティ名 または プロパティ名のリスト} の対応表からスキーマを作る
+    @classmethod
+    def from_mapping(cls, properties_mapping, converters=None):
+        converters = converters or {}
+        fields = []
+        for csv_name, internal_names in properties_mapping.items():
+            targets = internal_names if isinstance(internal_names, list) else [internal_names]
+            # 変換が必要なプロパティは単独のFieldに分ける
+            plain = [name for name in targets if name not in converters]
+            if plain:
+                fields.append(Field(csv_name, plain))
+            for name in targets:
+                if name in converters:
+                    fields.append(Field(csv_name, name, converters[name]))
+        return cls(fields)
+
+    # スキーマが使用するCSVのカラム名
+    @property
+    def source_columns(self):
+        return list(dict.fromkeys(field.source for field in self.fields))
+
+    # スキーマが使用するカラムに extra のカラムを加えたリスト（読み込むカラムの指定に使う）
+    def columns(self, *extra):
+        return list(dict.fromkeys(self.source_columns + list(extra)))
+
+    # 送信するプロパティ名
+    @property
+    def target_properties(self):
+        return [target for field in self.fields for target in field.targets]
+
+    # カラム単位で変換し、プロパティ名と値のリストを返す
+    # invalid_report を渡した場合は {カラム名: Counter(変換できなかった値)} を集計する
+    def build_columns(self, df, invalid_report=None):
+        with METRICS.stage('transform', rows=len(df)):
+            return self._build_columns(df, invalid_report)
+
+    def _build_columns(self, df, invalid_report):
+        converted = {}  # 同じカラムに同じ変換を繰り返さないためのキャッシュ
+        names = []
+        columns = []
+        for field in self.fields:
+            key = (field.source, field.converter)
+            if key not in converted:
+                series = df[field.source]
+                values = field.converter(series) if field.converter else series.tolist()
+                if isinstance(values, tuple):
+                    values, invalid = values
+                    if invalid_report is not None and invalid:
+                        invalid_report.setdefault(field.source, Counter()).update(invalid)
+                converted[key] = values
+            for target in field.targets:
+                names.append(target)
+                columns.append(converted[key])
+        return names, columns
+
+    # 行ごとのプロパティの辞書を一括で生成する
+    def build_properties(self, df, invalid_report=None):
+        names, columns = self.build_columns(df, invalid_report)
+        if not columns:
+            return [{} for _ in range(len(df))]
+        return [dict(zip(names, values)) for values in zip(*columns)]
+
+    # HubSpotのバッチAPIに渡すレコードを一括で生成する
+    def build_records(self, df, invalid_report=None):
+        return [{"properties": properties} for properties in self.build_properties(df, invalid_report)]
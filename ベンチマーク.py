@@ -0,0 +1,233 @@
+# coding: utf-8
+
+import argparse
+import importlib.util
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+import numpy as np
+import pandas as pd
+
+# 定数
+SIZES = [1000, 100000]  # 既定で計測する商品項目の行数（--sizes 1000,100000,1000000 で100万行も計測する）
+LINES_PER_SLIP = 4  # 1伝票あたりの明細数（取引の行数は商品項目の行数 / LINES_PER_SLIP）
+PRODUCTS_RATIO = 10  # 商品の行数は商品項目の行数 / PRODUCTS_RATIO
+UPDATE_RATIO = 0.1  # 更新ステージで変更する伝票の割合
+POOL_SIZE = 50  # 文字列カラムの値の種類（奉行のデータと同じく繰り返しの多い値にする）
+CLIENT_RATE_LIMIT = 1000000  # クライアント側のレート制限（スタブの処理能力を測るため実質無制限にする）
+STUB_KEEP_PROPERTIES = 'sha512_contents,bugyo_sha512_contents_syouhin_master_base'  # スタブに保存するプロパティ（メモリ節約）
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# ステージ名と計測対象のファイル
+STAGES = ['hash', 'read', 'transform', 'send_products', 'send_deals', 'send_line_items', 'update']
+
+# 日本語名のスクリプトをモジュールとして読み込む関数
+def load_script(name):
+    spec = importlib.util.spec_from_file_location(os.path.splitext(name)[0], os.path.join(SCRIPT_DIR, name))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+# 行番号から値のプールを繰り返すカラムを作る関数
+def _pooled(values, rows, seed):
+    codes = np.random.default_rng(seed).integers(0, len(values), rows)
+    return pd.Categorical.from_codes(codes, values)
+
+# カラム名に合った合成データを作る関数
+def _synthetic_column(name, rows, seed):
+    if name in ('修正日付', '登録日付'):
+        return _pooled([f"2024/{m:02d}/{d:02d} 10:{d:02d}:00" for m in range(1, 13) for d in range(1, 29)], rows, seed)
+    if '日付' in name or name in ('クローズ日', '回収期日', '有効期間（開始）', '有効期間（終了）'):
+        return _pooled([f"2024/{m:02d}/{d:02d}" for m in range(1, 13) for d in range(1, 29)], rows, seed)
+    if name == '取引ステージ':
+        return _pooled(['FAX受注 (実績)'], rows, seed)
+    if name == 'パイプライン':
+        return _pooled(['実績'], rows, seed)
+    if any(word in name for word in ('金額', '単価', '価格', '原価', '売上', '数量', '税', '入数', '箱数')):
+        return _pooled([str(value) for value in range(100, 100 + POOL_SIZE * 37, 37)], rows, seed)
+    return _pooled([f"{name}{k}" for k in range(POOL_SIZE)], rows, seed)
+
+# スキーマとハッシュの設定から必要なカラムを持つ合成データフレームを作る関数
+def synthetic_frame(columns, rows, keys):
+    data = {}
+    for seed, name in enumerate(columns):
+        data[name] = keys[name] if name in keys else _synthetic_column(name, rows, seed)
+    return pd.DataFrame(data)
+
+# 合成の 中間ファイル4 / 中間ファイル5 / 中間ファイル商品 を出力する関数
+def generate(work_dir, rows):
+    from schemas import DEAL_SCHEMA, LINE_ITEM_SCHEMA, PRODUCT_SCHEMA
+    from sha512_engine import HASH_SPECS
+
+    def columns_for(schema, spec=None):
+        names = (spec['contents_columns'] + spec['audit_columns'] if spec else []) + schema.source_columns
+        return [name for name in dict.fromkeys(names) if name not in ('sha512', 'sha512_contents')]
+
+    slips = max(rows // LINES_PER_SLIP, 1)
+    slip_numbers = np.array([f"{i:08d}" for i in range(slips)], dtype=object)
+    deals = synthetic_frame(columns_for(DEAL_SCHEMA, HASH_SPECS['中間ファイル4']), slips, {'伝票No.': slip_numbers})
+    product_rows = max(rows // PRODUCTS_RATIO, 1)
+    product_codes = np.array([f"P{i:08d}" for i in range(product_rows)], dtype=object)
+    # 明細の商品コードは生成した商品から選び、商品IDの紐付けも計測に含める
+    lines = synthetic_frame(columns_for(LINE_ITEM_SCHEMA, HASH_SPECS['中間ファイル5']), rows,
+                            {'伝票No.': slip_numbers[np.arange(rows) % slips], '商品コード': _pooled(product_codes, rows, 0)})
+    products = synthetic_frame(columns_for(PRODUCT_SCHEMA), product_rows, {'商品コード': product_codes})
+    products['sha512_contents'] = [f"{i:0128x}" for i in range(product_rows)]
+    products['sha512'] = products['sha512_contents']
+
+    deals.to_csv(os.path.join(work_dir, '中間ファイル4.csv'), index=False)
+    lines.to_csv(os.path.join(work_dir, '中間ファイル5.csv'), index=False)
+    products.to_csv(os.path.join(work_dir, '新規だけ商品.csv'), index=False)
+
+# ピークRSS（バイト）を取得する関数（取得できない環境ではNone）
+def peak_rss():
+    try:
+        import resource
+        usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return usage if sys.platform == 'darwin' else usage * 1024
+    except ImportError:
+        pass
+    try:
+        import psutil
+        info = psutil.Process().memory_info()
+        return getattr(info, 'peak_wset', info.rss)
+    except ImportError:
+        return None
+
+# 1つのステージを実行して処理した行数を返す関数（子プロセスで実行する）
+def run_stage(stage, work_dir):
+    from csv_io import read_csv
+    from schemas import DEAL_SCHEMA, LINE_ITEM_SCHEMA
+    from sha512_engine import HASH_SPECS, hash_file
+
+    deal_path = os.path.join(work_dir, '中間ファイル4.csv')
+    line_path = os.path.join(work_dir, '中間ファイル5.csv')
+    if stage == 'hash':
+        return len(hash_file(deal_path, HASH_SPECS['中間ファイル4'])) + len(hash_file(line_path, HASH_SPECS['中間ファイル5']))
+    if stage == 'read':
+        return len(read_csv(deal_path)) + len(read_csv(line_path))
+    if stage == 'transform':
+        deals = read_csv(deal_path)
+        lines = read_csv(line_path)
+        return len(DEAL_SCHEMA.build_records(deals)) + len(LINE_ITEM_SCHEMA.build_properties(lines))
+    if stage == 'send_products':
+        load_script('Products新規送信.py').main(os.path.join(work_dir, '新規だけ商品.csv'))
+        return len(read_csv(os.path.join(work_dir, '新規だけ商品.csv')))
+    if stage == 'send_deals':
+        read_csv(deal_path).to_csv(os.path.join(work_dir, '新規だけ4.csv'), index=False)
+        load_script('Deal新規送信.py').main(os.path.join(work_dir, '新規だけ4.csv'))
+        return len(read_csv(deal_path))
+    if stage == 'send_line_items':
+        read_csv(line_path).to_csv(os.path.join(work_dir, '新規だけ5.csv'), index=False)
+        load_script('Lineitems作成.py').main(os.path.join(work_dir, '新規だけ5.csv'))
+        return len(read_csv(line_path))
+    if stage == 'update':
+        # 一部の伝票の明細を1行おきに変更し、更新と商品項目の差分反映を計測する
+        deals = read_csv(deal_path)
+        lines = read_csv(line_path)
+        update_slips = set(deals['伝票No.'].iloc[:max(int(len(deals) * UPDATE_RATIO), 1)])
+        update_lines = lines[lines['伝票No.'].isin(update_slips)].copy()
+        changed = np.arange(len(update_lines)) % 2 == 0
+        update_lines.loc[changed, 'sha512_contents'] = update_lines.loc[changed, 'sha512_contents'].str[::-1]
+        deals[deals['伝票No.'].isin(update_slips)].to_csv(os.path.join(work_dir, '更新あったものだけ4.csv'), index=False)
+        update_lines.to_csv(os.path.join(work_dir, '更新あったものだけ5.csv'), index=False)
+        load_script('Deal更新送信.py').main(os.path.join(work_dir, '更新あったものだけ4.csv'))
+        return len(update_slips) + len(update_lines)
+    raise ValueError(f"Unknown stage: {stage}")
+
+# スタブのエンドポイントごとのリクエスト数を取得する関数
+def stub_stats(base_url):
+    with urllib.request.urlopen(f"{base_url}/__stats") as response:
+        return json.load(response)['requests']
+
+# スタブのサーバーを別プロセスで起動する関数
+def start_stub(port, latency, rate_limit, throttle_rate, failure_rate):
+    process = subprocess.Popen([
+        sys.executable, os.path.join(SCRIPT_DIR, 'hubspot_stub.py'), '--port', str(port),
+        '--latency', str(latency), '--rate-limit', str(rate_limit), '--throttle-rate', str(throttle_rate),
+        '--failure-rate', str(failure_rate), '--keep-properties', STUB_KEEP_PROPERTIES, '--seed', '0',
+    ], stdout=subprocess.DEVNULL)
+    base_url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            stub_stats(base_url)
+            return process, base_url
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("HubSpot stub did not start")
+
+# 1つのサイズについて全ステージを子プロセスで計測する関数
+def benchmark_size(rows, args):
+    process, base_url = start_stub(args.port, args.latency, args.stub_rate_limit, args.throttle_rate, args.failure_rate)
+    env = {**os.environ, 'HUBSPOT_API_BASE': base_url, 'HUBSPOT_RATE_LIMIT': str(args.client_rate_limit)}
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as work_dir:
+            started = time.perf_counter()
+            generate(work_dir, rows)
+            print(f"[{rows}] generated in {time.perf_counter() - started:.1f}s")
+            for stage in args.stages:
+                before = stub_stats(base_url)
+                result_path = os.path.join(work_dir, f'{stage}.json')
+                log_path = os.path.join(work_dir, f'{stage}.log')
+                with open(log_path, 'w', encoding='utf-8') as log:
+                    subprocess.run([sys.executable, os.path.abspath(__file__), '--stage', stage, '--dir', work_dir, '--result', result_path],
+                                   env=env, stdout=log, stderr=subprocess.STDOUT, check=True)
+                with open(result_path, encoding='utf-8') as f:
+                    result = json.load(f)
+                after = stub_stats(base_url)
+                result['requests'] = {name: count - before.get(name, 0) for name, count in after.items() if count != before.get(name, 0)}
+                result['rows_per_second'] = round(result['rows'] / result['seconds'], 1) if result['seconds'] else None
+                result.update({'size': rows, 'stage': stage})
+                results.append(result)
+                rss = f"{result['peak_rss'] / 2 ** 20:.0f} MiB" if result['peak_rss'] else 'n/a'
+                print(f"[{rows}] {stage:<16} {result['seconds']:>8.2f}s {result['rows_per_second'] or 0:>12,.0f} rows/s "
+                      f"peak RSS {rss:>9} requests {sum(result['requests'].values())}")
+    finally:
+        process.terminate()
+        process.wait()
+    return results
+
+# メイン関数
+def main():
+    parser = argparse.ArgumentParser(description='同期スクリプトのスループット計測（ローカルのHubSpotスタブを使用）')
+    parser.add_argument('--sizes', default=','.join(str(size) for size in SIZES), help='商品項目の行数（カンマ区切り）')
+    parser.add_argument('--stages', default=','.join(STAGES), help='計測するステージ（カンマ区切り）')
+    parser.add_argument('--port', type=int, default=8089)
+    parser.add_argument('--latency', type=float, default=0.0, help='スタブの1リクエストあたりの遅延（秒）')
+    parser.add_argument('--stub-rate-limit', type=int, default=0, help='スタブの10秒あたりのリクエスト上限（0は無制限）')
+    parser.add_argument('--client-rate-limit', type=int, default=CLIENT_RATE_LIMIT, help='クライアントの10秒あたりのリクエスト上限')
+    parser.add_argument('--throttle-rate', type=float, default=0.0, help='スタブがランダムに429を返す割合')
+    parser.add_argument('--failure-rate', type=float, default=0.0, help='スタブが入力ごとにエラーにする割合')
+    parser.add_argument('--output', default=os.path.join(SCRIPT_DIR, 'benchmark_result.json'), help='結果のJSONファイル')
+    parser.add_argument('--stage', help=argparse.SUPPRESS)
+    parser.add_argument('--dir', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # 子プロセスとして1ステージだけを実行する
+    if args.stage:
+        started = time.perf_counter()
+        rows = run_stage(args.stage, args.dir)
+        result = {'rows': rows, 'seconds': round(time.perf_counter() - started, 3), 'peak_rss': peak_rss()}
+        with open(args.result, 'w', encoding='utf-8') as f:
+            json.dump(result, f)
+        return
+
+    args.stages = [stage for stage in args.stages.split(',') if stage]
+    results = []
+    for rows in (int(size) for size in args.sizes.split(',') if size):
+        results.extend(benchmark_size(rows, args))
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"Results written to {args.output}")
+
+# 実行
+if __name__ == "__main__":
+    main()
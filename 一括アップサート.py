@@ -0,0 +1,94 @@
+# coding: utf-8
+
+import os
+import sys
+import traceback
+
+import pandas as pd
+
+from batch_recovery import BatchRecovery, DeadLetter
+from csv_io import read_csv_chunks, iter_batches
+from date_convert import print_invalid_summary
+from hubspot_client import HubSpotClient
+from id_registry import IdRegistry
+from metrics import METRICS
+from schemas import DEAL_SCHEMA, PRODUCT_SCHEMA
+from sha512_engine import HASH_SPECS
+from snapshot_store import SnapshotStore, SNAPSHOT_DB, SNAPSHOT_KINDS
+
+# 定数
+BATCH_SIZE = 100  # 一度に送信するバッチのサイズ
+API_KEY = 'xxxxxxxxxxxxxxxxxxxxxxxxx0'  # ここに実際のAPIキーを入力してください
+SKIP_UNCHANGED = True  # Trueの場合は前回同期したsha512_contentsと同じ行を送信しない
+
+# 種別ごとの入力CSV・スキーマ・キーのカラム（idProperty は snapshot_store.SNAPSHOT_KINDS の key_property）
+# hash_spec がある種別は、CSVにsha512のカラムがなければ読み込み時に計算する
+UPSERT_TARGETS = {
+    'products': {'csv': '中間ファイル商品.csv', 'schema': PRODUCT_SCHEMA, 'key_column': '商品コード', 'hash_spec': None},
+    'deals': {'csv': '中間ファイル4.csv', 'schema': DEAL_SCHEMA, 'key_column': '伝票No.', 'hash_spec': HASH_SPECS['中間ファイル4']},
+}
+
+# 新規・更新が混在したCSVをupsertのレコードに変換するジェネレーター
+def iter_upsert_records(store, kind, file_path, invalid_report=None, skip_unchanged=SKIP_UNCHANGED):
+    target = UPSERT_TARGETS[kind]
+    id_property = SNAPSHOT_KINDS[kind]['key_property']
+    # スキーマが使うカラムとキー・ハッシュのカラムだけを読み込む
+    columns = target['schema'].columns(target['key_column'], 'sha512_contents')
+    for chunk in read_csv_chunks(file_path, hash_spec=target['hash_spec'], columns=columns):
+        if skip_unchanged:
+            new_rows, changed_rows, unchanged_rows = store.classify(kind, chunk, target['key_column'])
+            chunk = pd.concat([new_rows, changed_rows])
+        properties = target['schema'].build_properties(chunk, invalid_report)
+        yield [
+            {"idProperty": id_property, "id": str(key), "properties": record_properties}
+            for key, record_properties in zip(chunk[target['key_column']].tolist(), properties)
+        ]
+
+# 1種別のCSVをbatch/upsertで送信する関数（成功したバッチのハッシュとIDを記録する）
+def upsert_kind(client, store, registry, kind, file_path, invalid_report=None, recovery=None):
+    if not os.path.exists(file_path):
+        print(f"[{kind}] CSV not found, skipping: {file_path}")
+        return
+    batches = iter_batches(iter_upsert_records(store, kind, file_path, invalid_report), BATCH_SIZE)
+    created = updated = 0
+    for batch_number, (batch, response) in enumerate(client.send_batches(f'/crm/v3/objects/{kind}/batch/upsert', batches, send=recovery.send if recovery else None), start=1):
+        print(f"[{kind}] Batch {batch_number}: {response.get('status')}")
+        if response.get('status') != 'COMPLETE':
+            print(f"[{kind}] Batch {batch_number} failed: {response}")
+            continue
+        results = response.get('results', [])
+        store.record_results(kind, results)
+        registry.record_results(kind, results)
+        # 送信した値を記録する（Deal更新送信が変わったプロパティだけを送る場合の比較に使う）
+        # upsertは対象がHubSpotになければ作成するため、変わった行も差分にせず全プロパティを送っている
+        failed = {item["id"] for item in response.get('failedInputs', [])}
+        store.record_properties(kind, [(item["id"], item["properties"]) for item in batch if item["id"] not in failed])
+        created += sum(1 for result in results if result.get('new'))
+        updated += sum(1 for result in results if not result.get('new'))
+    print(f"[{kind}] created {created}, updated {updated}")
+
+# メイン関数（kinds を指定しない場合は 商品 → 取引 の順に送信する）
+def main(script_dir, kinds=None):
+    try:
+        invalid_report = {}  # 日付に変換できなかった値の集計
+        db_path = os.path.join(script_dir, SNAPSHOT_DB)
+        # 再送しても送信できなかった入力は dead_letter_upsert.csv に書き出す
+        with HubSpotClient(API_KEY) as client, SnapshotStore(db_path) as store, IdRegistry(db_path) as registry, \
+                DeadLetter(script_dir, 'upsert') as dead_letter:
+            recovery = BatchRecovery(client, dead_letter)
+            for kind in kinds or list(UPSERT_TARGETS):
+                upsert_kind(client, store, registry, kind, os.path.join(script_dir, UPSERT_TARGETS[kind]['csv']), invalid_report, recovery)
+        print_invalid_summary(invalid_report)
+        METRICS.write_reports(script_dir, 'upsert')
+    except Exception as e:
+        print(f"Error occurred: {e}")
+        print(traceback.format_exc())
+
+# 実行（引数で deals / products を指定できる）
+if __name__ == "__main__":
+    if getattr(sys, 'frozen', False):
+        script_dir = os.path.dirname(sys.executable)
+    else:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+    print(f"Script directory: {script_dir}")
+    main(script_dir, sys.argv[1:] or None)
@@ -0,0 +1,194 @@
+# coding: utf-8
+
+import os
+import queue
+import sys
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from batch_recovery import BatchRecovery, DeadLetter
+from csv_io import read_csv, read_csv_chunks, iter_batches
+from date_convert import print_invalid_summary
+from hubspot_client import HubSpotClient
+from hubspot_lookup import resolve_deal_ids
+from id_registry import IdRegistry
+from lineitem_reconcile import rebuild_stale_line_items
+from metrics import METRICS
+from product_index import PRODUCT_KEY_PROPERTY, ProductIndex, LINK_PRODUCTS, set_product_ids
+from schemas import DEAL_SCHEMA, PRODUCT_SCHEMA, LINE_ITEM_SCHEMA, build_line_item_record
+from snapshot_store import SnapshotStore, SNAPSHOT_DB, slip_hashes
+
+# 定数
+BATCH_SIZE = 100  # 一度に送信するバッチのサイズ
+API_KEY = 'xxxxxxxxxxxxxxxxxxxxxxxx0'  # ここに実際のAPIキーを入力してください
+PRODUCT_CSV = '新規だけ商品.csv'  # 商品のCSVファイル
+DEAL_CSV = '新規だけ4.csv'  # 取引のCSVファイル
+LINE_ITEM_CSV = '新規だけ5.csv'  # 商品項目のCSVファイル
+
+# 商品を作成するステージ（取引・商品項目とは独立して実行する）
+def run_products(client, registry, script_dir, invalid_report, recovery=None):
+    file_path = os.path.join(script_dir, PRODUCT_CSV)
+    if not os.path.exists(file_path):
+        print(f"[products] CSV not found, skipping: {file_path}")
+        return
+    batches = iter_batches((PRODUCT_SCHEMA.build_records(chunk, invalid_report) for chunk in read_csv_chunks(file_path, columns=PRODUCT_SCHEMA.source_columns)), BATCH_SIZE)
+    with SnapshotStore(os.path.join(script_dir, SNAPSHOT_DB)) as store:
+        for batch_number, (batch, response) in enumerate(client.send_batches('/crm/v3/objects/products/batch/create', batches, send=recovery.send if recovery else None), start=1):
+            print(f"[products] Batch {batch_number}: {response.get('status')}")
+            if response.get('status') == 'COMPLETE':
+                store.record_results('products', response.get('results', []))
+                registry.record_results('products', response.get('results', []))
+            else:
+                print(f"[products] Batch {batch_number} failed: {response}")
+
+# 取引を作成するステージ（作成できた伝票No.を ready_slips に渡す）
+def run_deals(client, registry, script_dir, ready_slips, invalid_report, recovery=None):
+    file_path = os.path.join(script_dir, DEAL_CSV)
+    if not os.path.exists(file_path):
+        print(f"[deals] CSV not found, skipping: {file_path}")
+        return
+    batches = iter_batches((DEAL_SCHEMA.build_records(chunk, invalid_report) for chunk in read_csv_chunks(file_path, columns=DEAL_SCHEMA.source_columns)), BATCH_SIZE)
+    with SnapshotStore(os.path.join(script_dir, SNAPSHOT_DB)) as store:
+        for batch_number, (batch, response) in enumerate(client.send_batches('/crm/v3/objects/deals/batch/create', batches, send=recovery.send if recovery else None), start=1):
+            print(f"[deals] Batch {batch_number}: {response.get('status')}")
+            if response.get('status') != 'COMPLETE':
+                print(f"[deals] Batch {batch_number} failed: {response}")
+                continue
+            results = response.get('results', [])
+            # 作成応答の取引IDを記録し、その伝票の商品項目をすぐに送信できるようにする
+            registry.record_results('deals', results)
+            store.record_results('deals', results)
+            failed = {deal["properties"].get('no_____') for deal in response.get('failedInputs', [])}
+            store.record_properties('deals', [
+                (deal["properties"].get('no_____'), deal["properties"]) for deal in batch if deal["properties"].get('no_____') not in failed
+            ])
+            ready_slips.put([result['properties'].get('no_____') for result in results])
+
+# 取引IDが確定した伝票から順に商品項目のバッチを生成するジェネレーター
+# products_done は商品のステージが終わるとセットされるイベント
+def iter_ready_line_items(registry, line_items_by_slip, ready_slips, failed_slips, products_done):
+    while True:
+        slips = ready_slips.get()
+        if slips is None:
+            break
+        slips = [slip for slip in slips if slip in line_items_by_slip]
+        deal_ids = registry.get_ids('deals', slips)
+        # 商品IDはローカルの索引だけから引く。索引にない商品コードがある場合だけ、この実行で作成する商品が
+        # 作成応答から記録されるまで待って引き直す（索引を引く前に終わっていれば、その結果で確定する）
+        codes = [properties.get(PRODUCT_KEY_PROPERTY) for slip in slips for properties in line_items_by_slip[slip]]
+        codes = list(dict.fromkeys(code for code in codes if code))
+        products_finished = products_done.is_set()
+        product_ids = registry.get_ids('products', codes) if LINK_PRODUCTS else {}
+        missing = [code for code in codes if code not in product_ids]
+        if LINK_PRODUCTS and missing and not products_finished:
+            products_done.wait()
+            product_ids.update(registry.get_ids('products', missing))
+        records = []
+        for slip in slips:
+            deal_id = deal_ids.get(slip)
+            if not deal_id:
+                failed_slips.add(slip)
+                continue
+            line_items = line_items_by_slip.pop(slip)
+            set_product_ids(line_items, product_ids)
+            records.extend(build_line_item_record(properties, deal_id) for properties in line_items)
+        yield records
+
+# 商品項目のバッチを作成し、作成できなかった伝票No.と (商品項目, エラー) を記録する関数
+def create_line_items(client, batches, failed_slips, failures, recovery=None):
+    responses = client.send_batches('/crm/v3/objects/line_items/batch/create', batches, send=recovery.send if recovery else None)
+    for batch_number, (batch, response) in enumerate(responses, start=1):
+        print(f"[line_items] Batch {batch_number}: {response.get('status')}")
+        if 'failedInputs' in response:
+            print(f"[line_items] Batch {batch_number}: {response['numErrors']} inputs failed")
+            failed_slips.update(item["properties"]["bugyo_denpyo_no"] for item in response['failedInputs'])
+            failures.extend(zip(response['failedInputs'], response.get('errors', [])))
+        elif response.get('status') != 'COMPLETE' or response.get('errors'):
+            print(f"[line_items] Batch {batch_number} failed: {response}")
+            failed_slips.update(item["properties"]["bugyo_denpyo_no"] for item in batch)
+
+# 商品項目を作成するステージ（取引の作成と並行して実行し、商品IDを付ける場合は商品のステージの終了を待つ）
+def run_line_items(client, registry, line_items_by_slip, ready_slips, products_done, recovery=None):
+    failed_slips = set()
+    failures = []  # 作成できなかった (商品項目, エラー)
+    batches = iter_batches(iter_ready_line_items(registry, line_items_by_slip, ready_slips, failed_slips, products_done), BATCH_SIZE)
+    create_line_items(client, batches, failed_slips, failures, recovery)
+
+    # 索引の取引IDが使えなかった伝票は、取引IDを引き直して1回だけ再送する
+    retry = rebuild_stale_line_items(client, registry, failures)
+    if retry:
+        failed_slips -= {slip for slip, _ in retry}
+        create_line_items(client, iter_batches([[line_item for _, line_item in retry]], BATCH_SIZE), failed_slips, [], recovery)
+
+    # 取引が作成されなかった伝票の商品項目は送信しない
+    failed_slips.update(line_items_by_slip)
+    for slip in sorted(failed_slips):
+        print(f"[line_items] Line items not created for deal number: {slip}")
+    return failed_slips
+
+# 商品 → 取引 → 商品項目 を1回の実行でまとめて同期するメイン関数
+def main(script_dir):
+    try:
+        invalid_report = {}  # 日付に変換できなかった値の集計（取引・商品項目）
+        product_invalid_report = {}  # 日付に変換できなかった値の集計（商品、別スレッドで集計する）
+        db_path = os.path.join(script_dir, SNAPSHOT_DB)
+        # 一部の入力だけが失敗した場合はその入力だけを再送し、それでも失敗した入力は dead_letter_bulk_sync.csv に書き出す
+        with HubSpotClient(API_KEY) as client, IdRegistry(db_path) as registry, DeadLetter(script_dir, 'bulk_sync') as dead_letter:
+            recovery = BatchRecovery(client, dead_letter)
+            line_path = os.path.join(script_dir, LINE_ITEM_CSV)
+            line_df = read_csv(line_path, columns=LINE_ITEM_SCHEMA.columns('伝票No.', 'sha512_contents')) if os.path.exists(line_path) else None
+            line_items_by_slip = {}
+            if line_df is not None:
+                properties = LINE_ITEM_SCHEMA.build_properties(line_df, invalid_report)
+                for slip, line_item_properties in zip(line_df["伝票No."].tolist(), properties):
+                    line_items_by_slip.setdefault(slip, []).append(line_item_properties)
+
+            # 既存の商品を商品IDの索引に取り込んでおく（必要な場合だけ一覧を取得する）
+            if LINK_PRODUCTS and line_items_by_slip:
+                ProductIndex(registry).refresh(client)
+
+            ready_slips = queue.Queue()
+
+            # 今回作成しない取引（既存の取引）の商品項目は、索引またはHubSpotから取引IDを引いてすぐに送信する
+            deal_path = os.path.join(script_dir, DEAL_CSV)
+            new_slips = set(read_csv(deal_path, columns=['伝票No.'])["伝票No."]) if os.path.exists(deal_path) else set()
+            existing_slips = [slip for slip in line_items_by_slip if slip not in new_slips]
+            if existing_slips:
+                resolve_deal_ids(client, registry, existing_slips)
+                ready_slips.put(existing_slips)
+
+            # 依存関係: 商品と取引は並行して実行し、商品項目は商品のステージが終わってから取引のバッチごとに後続で実行する
+            products_done = threading.Event()
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                line_future = executor.submit(run_line_items, client, registry, line_items_by_slip, ready_slips, products_done, recovery)
+                product_future = executor.submit(run_products, client, registry, script_dir, product_invalid_report, recovery)
+                product_future.add_done_callback(lambda future: products_done.set())  # 商品のステージが失敗しても商品項目を待たせない
+                try:
+                    run_deals(client, registry, script_dir, ready_slips, invalid_report, recovery)
+                finally:
+                    ready_slips.put(None)  # 商品項目のステージに終了を通知する
+                product_future.result()
+                failed_slips = line_future.result()
+
+            # すべての明細を作成できた伝票の明細ハッシュをスナップショットに記録する
+            if line_df is not None:
+                with SnapshotStore(db_path) as store:
+                    store.record('line_items', [
+                        (slip, digest) for slip, digest in slip_hashes(line_df).items() if slip not in failed_slips
+                    ])
+        print_invalid_summary(invalid_report)
+        print_invalid_summary(product_invalid_report)
+        METRICS.write_reports(script_dir, 'bulk_sync')
+    except Exception as e:
+        print(f"Error occurred: {e}")
+        print(traceback.format_exc())
+
+# 実行
+if __name__ == "__main__":
+    if getattr(sys, 'frozen', False):
+        script_dir = os.path.dirname(sys.executable)
+    else:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+    print(f"Script directory: {script_dir}")
+    main(script_dir)
@@ -0,0 +1,31 @@
+# coding: utf-8
+
+import os
+import sys
+import traceback
+
+from company_index import CompanyIndex
+from hubspot_client import HubSpotClient
+from id_registry import IdRegistry
+from snapshot_store import SNAPSHOT_DB
+
+# 定数
+API_KEY = 'xxxxxxxxxxxxxxxxxxxxxxxxx0'  # ここに実際のAPIキーを入力してください
+
+# メイン関数（--full を指定した場合は索引を作り直す）
+def main(script_dir, full=False):
+    try:
+        with HubSpotClient(API_KEY) as client, IdRegistry(os.path.join(script_dir, SNAPSHOT_DB)) as registry:
+            CompanyIndex(registry).refresh(client, force=full)
+    except Exception as e:
+        print(f"Error occurred: {e}")
+        print(traceback.format_exc())
+
+# 実行
+if __name__ == "__main__":
+    if getattr(sys, 'frozen', False):
+        script_dir = os.path.dirname(sys.executable)
+    else:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+    print(f"Script directory: {script_dir}")
+    main(script_dir, '--full' in sys.argv[1:])
@@ -0,0 +1,110 @@
+# coding: utf-8
+
+import os
+import sys
+import traceback
+
+from csv_io import read_csv, write_csv
+from hubspot_client import HubSpotClient
+from hubspot_lookup import read_by_property
+from id_registry import IdRegistry
+from sha512_engine import HASH_SPECS
+from snapshot_store import SnapshotStore, SNAPSHOT_DB, SNAPSHOT_KINDS, slip_hashes
+
+# 入力ファイルと出力ファイル
+DEAL_SOURCE = '中間ファイル4.csv'
+LINE_ITEM_SOURCE = '中間ファイル5.csv'
+PRODUCT_SOURCE = '中間ファイル商品.csv'
+NEW_DEALS = '新規だけ4.csv'
+CHANGED_DEALS = '更新あったものだけ4.csv'
+NEW_LINE_ITEMS = '新規だけ5.csv'
+CHANGED_LINE_ITEMS = '更新あったものだけ5.csv'
+NEW_PRODUCTS = '新規だけ商品.csv'
+HASH_ON_READ = True  # Trueの場合、中間ファイルにsha512のカラムがなければ読み込み時に計算する（sha512_hash4/5 の実行と書き直しが不要になる）
+API_KEY = 'xxxxxxxxxxxxxxxxxxxxxxxxx0'  # ここに実際のAPIキーを入力してください
+SEED_FROM_HUBSPOT = True  # Trueの場合、ローカルの同期状態にない伝票No.・商品コードをHubSpotで確認し、既存のものは新規に振り分けない
+
+# ローカルの同期状態にないキーをHubSpotで確認し、既存のオブジェクトのハッシュとIDを記録する関数
+# 初回の実行や sync_state.sqlite3 を失った場合に、HubSpotにあるものまで新規として作成しないようにする
+def seed_unknown_keys(client, store, registry, kind, keys):
+    key_property = SNAPSHOT_KINDS[kind]['key_property']
+    hash_property = SNAPSHOT_KINDS[kind]['hash_property']
+    keys = [str(key) for key in dict.fromkeys(keys) if key]
+    known = store.get_hashes(kind, keys)
+    unknown = [key for key in keys if key not in known]
+    if not unknown:
+        return
+    failed = set()
+    found = read_by_property(client, kind, key_property, unknown, [hash_property], failed)
+    if failed:
+        raise RuntimeError(f"Could not check {len(failed)} {kind} keys in HubSpot. Not splitting to avoid creating duplicates")
+    # HubSpotにハッシュがない場合は空として記録し、変更ありに振り分ける
+    store.record(kind, [(item['properties'].get(key_property), item['properties'].get(hash_property) or '') for item in found])
+    registry.record_results(kind, found)
+    print(f"[{kind}] {len(unknown)} keys not in the local state, {len(found)} of them already in HubSpot")
+
+# 取引と商品項目を 新規 / 更新 / 変更なし に振り分ける関数
+def split_deals(store, script_dir, client=None, registry=None):
+    deals = read_csv(os.path.join(script_dir, DEAL_SOURCE), HASH_SPECS['中間ファイル4'] if HASH_ON_READ else None)
+    line_items = read_csv(os.path.join(script_dir, LINE_ITEM_SOURCE), HASH_SPECS['中間ファイル5'] if HASH_ON_READ else None)
+
+    if client is not None:
+        seed_unknown_keys(client, store, registry, 'deals', deals['伝票No.'].tolist())
+    new_deals, changed_deals, unchanged_deals = store.classify('deals', deals, '伝票No.')
+    new_slips = set(new_deals['伝票No.'])
+
+    # 明細だけが変わった伝票も、商品項目を作り直すため更新対象に含める
+    current = slip_hashes(line_items)
+    known = store.get_hashes('line_items', current.keys())
+    changed_line_slips = {slip for slip, digest in current.items() if known.get(slip) != digest} - new_slips
+    update_slips = set(changed_deals['伝票No.']) | (changed_line_slips & set(deals['伝票No.']))
+    update_deals = deals[deals['伝票No.'].isin(update_slips)]
+
+    # 新規の伝票の明細は作成し、更新の伝票の明細はDeal更新送信で既存の商品項目と突き合わせる
+    new_line_items = line_items[line_items['伝票No.'].isin(new_slips)]
+    update_line_items = line_items[line_items['伝票No.'].isin(update_slips)]
+
+    write_csv(new_deals, os.path.join(script_dir, NEW_DEALS))
+    write_csv(update_deals, os.path.join(script_dir, CHANGED_DEALS))
+    write_csv(new_line_items, os.path.join(script_dir, NEW_LINE_ITEMS))
+    write_csv(update_line_items, os.path.join(script_dir, CHANGED_LINE_ITEMS))
+    print(f"Deals: new {len(new_deals)}, update {len(update_deals)}, skip {len(deals) - len(new_deals) - len(update_deals)}")
+    print(f"Line items: {len(new_line_items)} rows to create, {len(update_line_items)} rows to reconcile, of {len(line_items)}")
+
+# 商品を新規のみに振り分ける関数
+def split_products(store, script_dir, client=None, registry=None):
+    source_path = os.path.join(script_dir, PRODUCT_SOURCE)
+    if not os.path.exists(source_path):
+        print(f"Product source not found, skipping: {source_path}")
+        return
+    products = read_csv(source_path)
+    if client is not None:
+        seed_unknown_keys(client, store, registry, 'products', products['商品コード'].tolist())
+    new_products, changed_products, unchanged_products = store.classify('products', products, '商品コード')
+    write_csv(new_products, os.path.join(script_dir, NEW_PRODUCTS))
+    print(f"Products: new {len(new_products)}, changed {len(changed_products)}, skip {len(unchanged_products)}")
+
+# メイン関数
+def main(script_dir):
+    try:
+        db_path = os.path.join(script_dir, SNAPSHOT_DB)
+        if not SEED_FROM_HUBSPOT:
+            with SnapshotStore(db_path) as store:
+                split_deals(store, script_dir)
+                split_products(store, script_dir)
+            return
+        with SnapshotStore(db_path) as store, HubSpotClient(API_KEY) as client, IdRegistry(db_path) as registry:
+            split_deals(store, script_dir, client, registry)
+            split_products(store, script_dir, client, registry)
+    except Exception as e:
+        print(f"Error occurred: {e}")
+        print(traceback.format_exc())
+
+# 実行
+if __name__ == "__main__":
+    if getattr(sys, 'frozen', False):
+        script_dir = os.path.dirname(sys.executable)
+    else:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+    print(f"Script directory: {script_dir}")
+    main(script_dir)
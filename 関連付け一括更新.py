@@ -0,0 +1,116 @@
+# coding: utf-8
+
+import os
+import sys
+import traceback
+
+from company_index import CompanyIndex
+from csv_io import read_csv
+from hubspot_client import HubSpotClient
+from hubspot_lookup import read_association_links, search_by_values
+from id_registry import IdRegistry
+from metrics import METRICS
+from snapshot_store import SNAPSHOT_DB
+
+# 定数（関連付けワークフローのアクションと同じ設定）
+API_KEY = 'xxxxxxxxxxxxxxxxxxxxxxxxx0'  # ここに実際のAPIキーを入力してください
+CSV_FILE = '関連付け対象.csv'  # source_record_id と source_property_with_association_key のカラムを持つCSV
+PROPERTY_NAME = 'bugyo_tokuisaki_code_unique'  # 関連付け先のキーのプロパティ名
+FROM_OBJECT_TYPE = 'companies'  # 関連付けの元のオブジェクトタイプ
+TO_OBJECT_TYPE = 'companies'  # 関連付け先のオブジェクトタイプ
+ASSOCIATION_TYPE_ID = 12  # 関連付けのタイプID（逆方向のラベルは ASSOCIATION_TYPE_ID + 1）
+DIRECTION = 0  # 1の場合は関連付け先から元への関連付けを作成する（元と先のオブジェクトタイプが同じ場合のみ）
+DELETE_REVERSE = 0  # 1の場合は逆方向の関連付けも削除対象にする（元と先のオブジェクトタイプが同じ場合のみ）
+USE_COMPANY_INDEX = True  # 関連付け先が会社の場合、company_index の索引でキーを引く（Falseの場合はsearch APIのINで検索する）
+WRITE_BATCH_SIZE = 100  # 関連付けの作成・削除の1リクエストあたりの件数
+
+# キーから関連付け先のIDのリストを引く関数（failed にセットを指定した場合は、検索に失敗したキーを追加する）
+def resolve_targets(client, registry, keys, failed=None):
+    if USE_COMPANY_INDEX and TO_OBJECT_TYPE == 'companies':
+        index = CompanyIndex(registry, PROPERTY_NAME)
+        index.refresh(client)
+        return {key: [company_id] for key, company_id in index.lookup(client, keys, failed).items()}
+    targets = {}
+    for item in search_by_values(client, TO_OBJECT_TYPE, PROPERTY_NAME, keys, [PROPERTY_NAME], failed):
+        targets.setdefault(item['properties'].get(PROPERTY_NAME), []).append(item['id'])
+    return targets
+
+# 元のレコードごとにあるべき関連付けと既存の関連付けを比較し、(削除, 作成) の入力を返す関数
+def plan_associations(sources, targets, links):
+    same_type = FROM_OBJECT_TYPE == TO_OBJECT_TYPE
+    direction = DIRECTION if same_type else 0
+    delete_reverse = DELETE_REVERSE if same_type else 0
+    reverse_type_id = ASSOCIATION_TYPE_ID + 1
+    managed_type_ids = {ASSOCIATION_TYPE_ID, reverse_type_id} if delete_reverse == 1 else {ASSOCIATION_TYPE_ID}
+    # 元のレコードから見た関連付けのタイプID（逆方向に作成したものは逆方向のラベルとして見える）
+    desired_type_id = reverse_type_id if direction == 1 else ASSOCIATION_TYPE_ID
+
+    archives, creates = [], []
+    for record_id, key in sources:
+        existing = {
+            (str(to['toObjectId']), atype['typeId'])
+            for to in links.get(record_id, [])
+            for atype in to.get('associationTypes', [])
+        }
+        desired = {(target_id, desired_type_id) for target_id in targets.get(key, [])} if key else set()
+        for to_id, type_id in sorted(existing - desired):
+            if type_id in managed_type_ids:
+                archives.append({
+                    "from": {"id": record_id}, "to": {"id": to_id},
+                    "types": [{"associationCategory": "USER_DEFINED", "associationTypeId": type_id}],
+                })
+        for to_id, type_id in sorted(desired - existing):
+            from_id, to_id = (to_id, record_id) if direction == 1 else (record_id, to_id)
+            creates.append({
+                "from": {"id": from_id}, "to": {"id": to_id},
+                "types": [{"associationCategory": "USER_DEFINED", "associationTypeId": ASSOCIATION_TYPE_ID}],
+            })
+    return archives, creates
+
+# 関連付けをWRITE_BATCH_SIZE件ずつ同時に送信し、失敗した件数を返す関数
+def send_associations(client, path, inputs, label):
+    batches = (inputs[i:i + WRITE_BATCH_SIZE] for i in range(0, len(inputs), WRITE_BATCH_SIZE))
+    failed = 0
+    for batch_number, (batch, response) in enumerate(client.send_batches(path, batches), start=1):
+        if response.get('status') not in (None, 'COMPLETE') or response.get('errors'):
+            print(f"[{label}] Batch {batch_number} failed: {response}")
+            failed += len(batch)
+    print(f"[{label}] {len(inputs) - failed} of {len(inputs)} associations done")
+    return failed
+
+# メイン関数
+def main(file_path):
+    try:
+        df = read_csv(file_path)
+        sources = list(zip(df['source_record_id'].astype(str).tolist(), df['source_property_with_association_key'].astype(str).tolist()))
+        db_path = os.path.join(os.path.dirname(file_path), SNAPSHOT_DB)
+        with HubSpotClient(API_KEY) as client, IdRegistry(db_path) as registry:
+            failed_keys, failed_records = set(), set()  # 検索に失敗したキーと、関連付けを読み込めなかった元のレコードID
+            targets = resolve_targets(client, registry, [key for record_id, key in sources if key], failed_keys)
+            links = read_association_links(client, FROM_OBJECT_TYPE, TO_OBJECT_TYPE, [record_id for record_id, key in sources], failed_records)
+            # 読み込めなかったレコードは既存やあるべき関連付けが分からないため、削除も作成もしない
+            skipped = {record_id for record_id, key in sources if record_id in failed_records or key in failed_keys}
+            if skipped:
+                print(f"Skipped {len(skipped)} records whose associations or targets could not be read: {sorted(skipped)}")
+            archives, creates = plan_associations([(record_id, key) for record_id, key in sources if record_id not in skipped], targets, links)
+            print(f"Associations: {len(archives)} to archive, {len(creates)} to create for {len(sources)} records")
+
+            # 削除は対象のタイプだけをラベル単位で外し、作成は方向に合わせた元と先で送信する
+            send_associations(client, f'/crm/v4/associations/{FROM_OBJECT_TYPE}/{TO_OBJECT_TYPE}/batch/labels/archive', archives, 'archive')
+            create_from, create_to = (TO_OBJECT_TYPE, FROM_OBJECT_TYPE) if DIRECTION == 1 and FROM_OBJECT_TYPE == TO_OBJECT_TYPE else (FROM_OBJECT_TYPE, TO_OBJECT_TYPE)
+            send_associations(client, f'/crm/v4/associations/{create_from}/{create_to}/batch/create', creates, 'create')
+        METRICS.write_reports(os.path.dirname(file_path), 'association_reconcile')
+    except Exception as e:
+        print(f"Error occurred: {e}")
+        print(traceback.format_exc())
+
+# 実行
+if __name__ == "__main__":
+    if getattr(sys, 'frozen', False):
+        script_dir = os.path.dirname(sys.executable)
+    else:
+        script_dir = os.path.dirname(os.path.abspath(__file__))
+    csv_file_path = os.path.join(script_dir, CSV_FILE)  # CSVファイルの相対パスを指定
+    print(f"Script directory: {script_dir}")
+    print(f"CSV file path: {csv_file_path}")
+    main(csv_file_path)